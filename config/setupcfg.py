@@ -41,6 +41,98 @@ host_opts = [
     cfg.StrOpt('host_etcd_client_key',
                default=None,
                help='Client certificate key location'),
+    cfg.BoolOpt('host_etcd_local_mirror',
+                default=False,
+                help='Keep an in-memory copy of volume and share metadata '
+                     'that is kept current by watching etcd. Reads that '
+                     'are not protected by a lock are served from it.'),
+    cfg.IntOpt('host_etcd_pool_size',
+               default=20,
+               help='Number of connections kept open to each etcd member. '
+                    'The connections are shared by the volume, share and '
+                    'file persona metadata clients of the plugin.'),
+    cfg.StrOpt('host_etcd_read_policy',
+               default='default',
+               choices=['default', 'nearest'],
+               help='Where reads that are not protected by a lock are '
+                    'sent when several etcd members are configured. '
+                    '"default" uses the member all requests go to. '
+                    '"nearest" uses the member with the lowest read '
+                    'latency; it may serve slightly stale data. Lock '
+                    'protected reads always use quorum reads with '
+                    '"nearest".'),
+    cfg.IntOpt('host_etcd_hedge_percentile',
+               default=0,
+               min=0,
+               max=99,
+               help='With the "nearest" read policy, send a read to the '
+                    'next best etcd member as well when it takes longer '
+                    'than this percentile of the recent read latencies '
+                    'of the member. 0 disables hedged reads.'),
+    cfg.StrOpt('host_metadata_store',
+               default='etcd',
+               choices=['etcd', 'etcd3', 'sqlite'],
+               help='Where volume, share and file persona metadata is '
+                    'kept. "etcd3" keeps it in the etcd cluster through '
+                    'the v3 API (etcd 3.4 or later), with atomic multi-key '
+                    'writes and lease based locks; the local etcd mirror '
+                    'is then not used. "sqlite" keeps it in a local '
+                    'database and is meant for single node deployments '
+                    'only; the etcd options are then ignored.'),
+    cfg.StrOpt('host_metadata_store_path',
+               default='/etc/hpedockerplugin/metadata.db',
+               help='Database file of the "sqlite" metadata store.'),
+    cfg.DictOpt('host_lock_wait_timeouts',
+                default={},
+                help='Seconds a request waits for a lock before failing, '
+                     'by lock type: VOL, RCG, FP_SHARE, FP_BACKEND, '
+                     'FP_CPG or FP_FPG. For example "VOL:120,FP_FPG:600". '
+                     'Lock types not listed wait 300 seconds.'),
+    cfg.DictOpt('host_lock_max_hold_times',
+                default={},
+                help='Seconds a lock is kept alive while held, by lock '
+                     'type, after which its holder is taken to be stuck '
+                     'and the lock expires. 0 keeps a lock alive until it '
+                     'is released. VOL and RCG locks default to 600 '
+                     'seconds, the file persona locks to 0 as they are '
+                     'held across FPG creation.'),
+    cfg.IntOpt('host_request_threads',
+               default=20,
+               help='Docker requests served concurrently.'),
+    cfg.IntOpt('host_file_background_threads',
+               default=4,
+               help='Threads creating file persona shares in the '
+                    'background.'),
+    cfg.IntOpt('host_request_timeout',
+               default=600,
+               help='Seconds after which a Docker request is answered with '
+                    'a timeout error. 0 disables the timeout.'),
+    cfg.FloatOpt('host_admission_backend_rate',
+                 default=5.0,
+                 help='Mount, unmount and remove requests dispatched per '
+                      'second to each backend. Requests above it are '
+                      'queued. 0 disables the limit.'),
+    cfg.IntOpt('host_admission_burst',
+               default=25,
+               help='Requests dispatched at once before the admission '
+                    'rates apply.'),
+    cfg.DictOpt('host_admission_operation_rates',
+                default={},
+                help='Requests dispatched per second across the backends, '
+                     'by operation: mount, unmount or remove. For example '
+                     '"mount:2,remove:1". Operations not listed are only '
+                     'limited per backend.'),
+    cfg.IntOpt('host_admission_max_queue',
+               default=100,
+               help='Requests queued per backend waiting for admission. '
+                    'Requests beyond it are rejected.'),
+    cfg.FloatOpt('host_response_cache_ttl',
+                 default=5.0,
+                 help='Seconds the responses to VolumeDriver.Get and List '
+                      'are cached. Changes made through this node drop them '
+                      'right away, as do changes made by other nodes if '
+                      'host_etcd_local_mirror is enabled. 0 disables the '
+                      'cache.'),
     cfg.StrOpt('logging',
                default='WARNING',
                help='Debug level for hpe docker volume plugin'),
@@ -0,0 +1,178 @@
+"""
+Admission control of the requests dispatched to the backends.
+
+Mount, unmount and remove requests take a token from the bucket of their
+backend and, if configured, from the bucket of their operation. Requests
+finding a bucket empty wait in a bounded queue of their backend without
+blocking the reactor, and are rejected once that queue is full.
+"""
+import collections
+import threading
+
+from oslo_log import log as logging
+from twisted.internet import defer
+
+import hpedockerplugin.exception as exception
+
+LOG = logging.getLogger(__name__)
+
+# Orchestrator requests subject to admission control and the operation
+# they are accounted to
+ADMITTED_REQUESTS = {
+    'mount_volume': 'mount',
+    'mount_share': 'mount',
+    'unmount_volume': 'unmount',
+    'unmount_share': 'unmount',
+    'remove_volume': 'remove',
+    'remove_share': 'remove',
+}
+DEFAULT_BACKEND_RATE = 5.0
+DEFAULT_BACKEND_BURST = 25
+DEFAULT_MAX_QUEUE = 100
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = now
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, now):
+        """Returns the seconds until a token is available"""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._tokens -= 1
+
+
+class AdmissionController(object):
+    """Token buckets per backend and per operation with bounded queues
+
+    A rate of 0 leaves the backends or the operation unlimited.
+    """
+    def __init__(self, clock, backend_rate=DEFAULT_BACKEND_RATE,
+                 backend_burst=DEFAULT_BACKEND_BURST, operation_rates=None,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self._clock = clock
+        self._backend_rate = backend_rate
+        self._burst = backend_burst
+        self._operation_rates = operation_rates or {}
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._buckets = {}
+        # backend -> deque of (operation, Deferred)
+        self._queues = collections.defaultdict(collections.deque)
+        self._drain_calls = {}
+        self._counts = collections.defaultdict(
+            lambda: {'admitted': 0, 'queued': 0, 'rejected': 0})
+
+    def _bucket(self, key, rate):
+        if not rate:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, max(self._burst, 1),
+                                 self._clock.seconds())
+            self._buckets[key] = bucket
+        return bucket
+
+    def _buckets_of(self, operation, backend):
+        buckets = [self._bucket(('backend', backend), self._backend_rate),
+                   self._bucket(('operation', operation),
+                                float(self._operation_rates.get(operation,
+                                                                0)))]
+        return [b for b in buckets if b is not None]
+
+    def _delay(self, operation, backend):
+        now = self._clock.seconds()
+        return max([b.delay(now)
+                    for b in self._buckets_of(operation, backend)] or [0])
+
+    def _take(self, operation, backend):
+        for bucket in self._buckets_of(operation, backend):
+            bucket.take()
+        self._counts[backend]['admitted'] += 1
+
+    def admit(self, operation, backend):
+        """Returns a Deferred firing once the request may be dispatched
+
+        It fails with AdmissionRejected if the queue of the backend is
+        full.
+        """
+        with self._lock:
+            queue = self._queues[backend]
+            if not queue and self._delay(operation, backend) == 0:
+                self._take(operation, backend)
+                return defer.succeed(None)
+            if len(queue) >= self._max_queue:
+                self._counts[backend]['rejected'] += 1
+                LOG.warning('Rejecting %s request for backend %s: %s '
+                            'requests already queued'
+                            % (operation, backend, len(queue)))
+                return defer.fail(exception.AdmissionRejected(
+                    operation=operation, backend=backend))
+            d = defer.Deferred()
+            queue.append((operation, d))
+            self._counts[backend]['queued'] += 1
+            self._schedule_drain(backend)
+            return d
+
+    def _schedule_drain(self, backend):
+        if backend in self._drain_calls:
+            return
+        operation = self._queues[backend][0][0]
+        self._drain_calls[backend] = self._clock.callLater(
+            self._delay(operation, backend), self._drain, backend)
+
+    def _drain(self, backend):
+        admitted = []
+        with self._lock:
+            del self._drain_calls[backend]
+            queue = self._queues[backend]
+            while queue and self._delay(queue[0][0], backend) == 0:
+                operation, d = queue.popleft()
+                self._take(operation, backend)
+                admitted.append(d)
+            if queue:
+                self._schedule_drain(backend)
+        for d in admitted:
+            d.callback(None)
+
+    def snapshot(self):
+        with self._lock:
+            return {backend: dict(counts,
+                                  queue_depth=len(self._queues[backend]))
+                    for backend, counts in self._counts.items()}
+
+
+_controller = None
+
+
+def configure(clock, host_config):
+    """Sets up the admission controller from the host configuration
+
+    Backends of both personas share the controller. Hence only the first
+    call has an effect.
+    """
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            clock,
+            backend_rate=host_config.host_admission_backend_rate,
+            backend_burst=host_config.host_admission_burst,
+            operation_rates=host_config.host_admission_operation_rates,
+            max_queue=host_config.host_admission_max_queue)
+    return _controller
+
+
+def get_controller():
+    return _controller
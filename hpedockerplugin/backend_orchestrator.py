@@ -34,8 +34,16 @@ import uuid
 import hpedockerplugin.volume_manager as mgr
 import hpedockerplugin.etcdutil as util
 import threading
+import hpedockerplugin.admission as admission
 import hpedockerplugin.backend_async_initializer as async_initializer
+import hpedockerplugin.coalescing as coalescing
+import hpedockerplugin.exception as exception
+import hpedockerplugin.response_cache as response_cache
+import hpedockerplugin.worker_pool as worker_pool
+from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.internet import threads
+from twisted.python import threadable
 
 LOG = logging.getLogger(__name__)
 
@@ -47,9 +55,11 @@ class Orchestrator(object):
         LOG.info('calling initialize manager objs')
         self._def_backend_name = def_backend_name
         self._etcd_client = self._get_etcd_client(host_config)
+        self._admission = admission.configure(reactor, host_config)
         self._initialize_orchestrator(host_config)
         self._manager = self.initialize_manager_objects(host_config,
                                                         backend_configs)
+        self._worker_pools = self._create_worker_pools(backend_configs)
         # This is the dictionary which have the volume -> backend map entries
         # cache after doing an etcd volume read operation.
         self.volume_backends_map = {}
@@ -59,6 +69,23 @@ class Orchestrator(object):
     def _initialize_orchestrator(host_config):
         pass
 
+    @staticmethod
+    def _create_worker_pools(backend_configs):
+        pools = {}
+        for backend_name, config in backend_configs.items():
+            size = config.safe_get('hpe3par_worker_threads') or \
+                worker_pool.DEFAULT_BACKEND_THREADS
+            pools[backend_name] = worker_pool.WorkerPool(
+                reactor, 'hpe-backend-%s' % backend_name, size)
+        return pools
+
+    def get_worker_pool_stats(self):
+        return {backend_name: pool.stats()
+                for backend_name, pool in self._worker_pools.items()}
+
+    def get_etcd_member_health(self):
+        return self._etcd_client.get_member_health()
+
     def get_default_backend_name(self):
         return self._def_backend_name
 
@@ -181,16 +208,43 @@ class Orchestrator(object):
 
     def _execute_request(self, request, volname, *args, **kwargs):
         backend = self.get_volume_backend_details(volname)
-        d = threads.deferToThread(self._execute_request_for_backend,
-                                  backend,
-                                  request,
-                                  volname,
-                                  *args,
-                                  **kwargs)
+        if not threadable.isInIOThread():
+            # Called by a request handler running in a thread of its own.
+            # The request is dispatched from the reactor and its result
+            # waited for
+            return threads.blockingCallFromThread(
+                reactor, self._dispatch_request, backend, request, volname,
+                *args, **kwargs)
+        return self._dispatch_request(backend, request, volname,
+                                      *args, **kwargs)
+
+    def _dispatch_request(self, backend, request, volname, *args, **kwargs):
+        operation = admission.ADMITTED_REQUESTS.get(request)
+        if operation:
+            d = self._admission.admit(operation, backend)
+        else:
+            d = defer.succeed(None)
+        pool = self._worker_pools.get(backend)
+        if pool:
+            run_in_thread = pool.defer
+        else:
+            run_in_thread = threads.deferToThread
+        d.addCallback(lambda _: run_in_thread(
+            self._execute_request_for_backend,
+            backend,
+            request,
+            volname,
+            *args,
+            **kwargs))
+        d.addErrback(self.admission_rejected_func)
         d.addCallback(self.callback_func)
         d.addErrback(self.error_callback_func)
         return d
 
+    def admission_rejected_func(self, failure):
+        failure.trap(exception.AdmissionRejected)
+        return json.dumps({u'Err': failure.value.msg})
+
     def callback_func(self, response):
         return response
 
@@ -212,6 +266,41 @@ class VolumeBackendOrchestrator(Orchestrator):
     def __init__(self, host_config, backend_configs, def_backend_name):
         super(VolumeBackendOrchestrator, self).__init__(
             host_config, backend_configs, def_backend_name)
+        self._single_flight = coalescing.SingleFlight()
+        self._mount_coalescer = coalescing.MountCoalescer()
+        self._response_cache = response_cache.ResponseCache(
+            host_config.host_response_cache_ttl)
+        self._etcd_client.add_change_listener(
+            self._response_cache.invalidate)
+
+    def _coalesce(self):
+        # Requests issued from the reactor thread get a Deferred which
+        # can't be shared. Request threads wait for the result instead
+        return not threadable.isInIOThread()
+
+    def _changed(self, ret_val, *names):
+        # Drops the cached responses about the names once the request
+        # changing them is done. A name may be of the form vol/snapshot
+        def invalidate(result):
+            for name in names:
+                for token in name.split('/'):
+                    self._response_cache.invalidate(token)
+            return result
+
+        if isinstance(ret_val, defer.Deferred):
+            return ret_val.addBoth(invalidate)
+        return invalidate(ret_val)
+
+    def get_response_cache_stats(self):
+        return self._response_cache.stats()
+
+    def get_inventory_cache_stats(self):
+        stats = {}
+        for backend_name, volume_mgr_info in self._manager.items():
+            volume_mgr = volume_mgr_info['mgr']
+            if volume_mgr is not None:
+                stats[backend_name] = volume_mgr.get_inventory_cache_stats()
+        return stats
 
     def _get_etcd_client(self, host_config):
         # return util.HpeVolumeEtcdClient(
@@ -219,7 +308,15 @@ class VolumeBackendOrchestrator(Orchestrator):
             host_config.host_etcd_ip_address,
             host_config.host_etcd_port_number,
             host_config.host_etcd_client_cert,
-            host_config.host_etcd_client_key)
+            host_config.host_etcd_client_key,
+            mirror=host_config.host_etcd_local_mirror,
+            pool_size=host_config.host_etcd_pool_size,
+            read_policy=host_config.host_etcd_read_policy,
+            hedge_percentile=host_config.host_etcd_hedge_percentile,
+            store=host_config.host_metadata_store,
+            store_path=host_config.host_metadata_store_path,
+            lock_wait_timeouts=host_config.host_lock_wait_timeouts,
+            lock_max_hold_times=host_config.host_lock_max_hold_times)
 
     def get_manager(self, host_config, config, etcd_client,
                     node_id, backend_name):
@@ -237,6 +334,10 @@ class VolumeBackendOrchestrator(Orchestrator):
         return vol is not None
 
     def get_path(self, volname):
+        if self._coalesce():
+            return self._single_flight.do(('get_path', volname),
+                                          self._execute_request,
+                                          'get_path', volname)
         return self._execute_request('get_path', volname)
 
     def volumedriver_remove(self, volname):
@@ -248,13 +349,14 @@ class VolumeBackendOrchestrator(Orchestrator):
             if volname in self.volume_backends_map and \
                ret_val is not None:
                 del self.volume_backends_map[volname]
-        return ret_val
+        return self._changed(ret_val, volname)
 
     def volumedriver_unmount(self, volname, vol_mount, mount_id):
-        return self._execute_request('unmount_volume',
-                                     volname,
-                                     vol_mount,
-                                     mount_id)
+        ret_val = self._execute_request('unmount_volume',
+                                        volname,
+                                        vol_mount,
+                                        mount_id)
+        return self._changed(ret_val, volname)
 
     def volumedriver_create(self, volname, vol_size,
                             vol_prov, vol_flash,
@@ -278,7 +380,7 @@ class VolumeBackendOrchestrator(Orchestrator):
             current_backend,
             rcg_name)
 
-        return ret_val
+        return self._changed(ret_val, volname)
 
     def clone_volume(self, src_vol_name, clone_name, size, cpg,
                      snap_cpg, clone_options):
@@ -287,9 +389,10 @@ class VolumeBackendOrchestrator(Orchestrator):
         # retrieved from src_vol or use DEFAULT if src_vol doesn't have it
         backend = self.get_volume_backend_details(src_vol_name)
         LOG.info('orchestrator clone_opts : %s' % (clone_options))
-        return self._execute_request('clone_volume', src_vol_name, clone_name,
-                                     size, cpg, snap_cpg, backend,
-                                     clone_options)
+        ret_val = self._execute_request('clone_volume', src_vol_name,
+                                        clone_name, size, cpg, snap_cpg,
+                                        backend, clone_options)
+        return self._changed(ret_val, src_vol_name, clone_name)
 
     def create_snapshot(self, src_vol_name, schedName, snapshot_name,
                         snapPrefix, expiration_hrs, exphrs, retention_hrs,
@@ -299,33 +402,56 @@ class VolumeBackendOrchestrator(Orchestrator):
         # Why is backend being passed to clone_volume when it can be
         # retrieved from src_vol or use DEFAULT if src_vol doesn't have it
         backend = self.get_volume_backend_details(src_vol_name)
-        return self._execute_request('create_snapshot',
-                                     src_vol_name,
-                                     schedName,
-                                     snapshot_name,
-                                     snapPrefix,
-                                     expiration_hrs,
-                                     exphrs,
-                                     retention_hrs,
-                                     rethrs,
-                                     mount_conflict_delay,
-                                     has_schedule,
-                                     schedFrequency, backend)
+        ret_val = self._execute_request('create_snapshot',
+                                        src_vol_name,
+                                        schedName,
+                                        snapshot_name,
+                                        snapPrefix,
+                                        expiration_hrs,
+                                        exphrs,
+                                        retention_hrs,
+                                        rethrs,
+                                        mount_conflict_delay,
+                                        has_schedule,
+                                        schedFrequency, backend)
+        return self._changed(ret_val, src_vol_name, snapshot_name)
 
     def mount_volume(self, volname, vol_mount, mount_id):
-        return self._execute_request('mount_volume', volname,
-                                     vol_mount, mount_id)
+        def mount():
+            return self._execute_request('mount_volume', volname,
+                                         vol_mount, mount_id)
+
+        def add_mount_ids(mount_ids):
+            return self._execute_request('add_mount_ids', volname,
+                                         mount_ids)
 
-    def get_volume_snap_details(self, volname, snapname, qualified_name):
+        if self._coalesce():
+            ret_val = self._mount_coalescer.mount(volname, mount_id, mount,
+                                                  add_mount_ids)
+        else:
+            ret_val = mount()
+        return self._changed(ret_val, volname)
+
+    def get_volume_snap_details(self, volname, snapname, qualified_name,
+                                detail=False):
+        if self._coalesce():
+            def load():
+                return self._single_flight.do(
+                    ('get_volume_snap_details', qualified_name, detail),
+                    self._execute_request, 'get_volume_snap_details',
+                    volname, snapname, qualified_name, detail)
+
+            return self._response_cache.get_or_load(
+                ('get', qualified_name, detail), volname, load)
         return self._execute_request('get_volume_snap_details', volname,
-                                     snapname, qualified_name)
+                                     snapname, qualified_name, detail)
 
     def manage_existing(self, volname, existing_ref, backend, manage_opts):
         ret_val = self._execute_request_for_backend(
             backend, 'manage_existing', volname, existing_ref,
             backend, manage_opts)
         self.add_cache_entry(volname)
-        return ret_val
+        return self._changed(ret_val, volname)
 
     def volumedriver_list(self):
         # Use the first volume manager list volumes
@@ -338,7 +464,13 @@ class VolumeBackendOrchestrator(Orchestrator):
             if volume_mgr_info:
                 volume_mgr = volume_mgr_info['mgr']
 
-        if volume_mgr:
-            return volume_mgr.list_volumes()
-        else:
-            return []
+        if not volume_mgr:
+            return ''
+
+        def load():
+            return response_cache.encode_list_entries(
+                volume_mgr.list_volumes())
+
+        return self._response_cache.get_or_load(
+            response_cache.LIST_KEY, None, load,
+            is_cacheable=lambda entries: True)
@@ -0,0 +1,124 @@
+"""
+Coalescing of concurrent identical requests of this node.
+
+Docker sends a burst of Mount, Get and Path requests for a volume when
+several containers using it start at once. Concurrent Get and Path
+requests for a name share the result of the one in flight. Concurrent
+mounts of a volume let the first one do the mount and then add the mount
+IDs of the others in a single metadata write.
+
+Callers wait for the request in flight, hence these are meant for the
+request threads, not for the reactor thread.
+"""
+import json
+import threading
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Shares the result of a call among the concurrent callers of a key"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, f, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            LOG.debug('Joining request in flight for %s' % (key,))
+            call.done.wait()
+        else:
+            try:
+                call.result = f(*args, **kwargs)
+            except Exception as ex:
+                call.error = ex
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+def _succeeded(response):
+    try:
+        return not json.loads(response).get('Err')
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+class _MountBatch(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.mount_ids = []
+        self.response = None
+
+
+class MountCoalescer(object):
+    """Mounts a volume once for the concurrent mounts of it"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def mount(self, volname, mount_id, mount, add_mount_ids):
+        """Mounts the volume or waits for the mount in flight
+
+        :param mount: Mounts the volume for mount_id, returning the
+            response to the request
+        :param add_mount_ids: Adds a list of mount IDs to the volume
+            mounted on this node, returning the response to the requests
+        """
+        with self._lock:
+            batch = self._batches.get(volname)
+            leader = batch is None
+            if leader:
+                batch = _MountBatch()
+                self._batches[volname] = batch
+            else:
+                batch.mount_ids.append(mount_id)
+        if not leader:
+            batch.done.wait()
+            if batch.response is not None:
+                return batch.response
+            # The mount in flight failed. Mount on its own
+            return mount()
+
+        response = None
+        try:
+            response = mount()
+            return response
+        finally:
+            # Mounts arriving from here on form a batch of their own
+            with self._lock:
+                del self._batches[volname]
+            self._complete(volname, batch, response, add_mount_ids)
+
+    @staticmethod
+    def _complete(volname, batch, response, add_mount_ids):
+        try:
+            if batch.mount_ids and _succeeded(response):
+                LOG.info('Adding %s coalesced mount IDs to volume %s'
+                         % (len(batch.mount_ids), volname))
+                added = add_mount_ids(batch.mount_ids)
+                if _succeeded(added):
+                    batch.response = added
+        except Exception as ex:
+            LOG.error('Adding coalesced mount IDs to volume %s failed: %s'
+                      % (volname, ex))
+        finally:
+            batch.done.set()
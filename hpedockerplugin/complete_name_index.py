@@ -0,0 +1,58 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Adds all the volumes and shares stored in etcd to the name index and marks
+it complete. Run it once all the plugin instances using the etcd cluster
+have been upgraded:
+
+    python -m hpedockerplugin.complete_name_index \
+        --config-file /etc/hpedockerplugin/hpe.conf
+
+Until then, a name missing in the index is looked for in all the volumes
+and shares, as older plugin versions do not add the names of the objects
+they create. Once the index is complete, a name missing in it is known not
+to exist. Plugin instances need no restart to make use of it.
+"""
+
+import sys
+
+from config import setupcfg
+import hpedockerplugin.etcdutil as util
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    host_config = setupcfg.get_host_config(argv)
+    etcd_util = util.EtcdUtil(
+        host_config.host_etcd_ip_address,
+        host_config.host_etcd_port_number,
+        host_config.host_etcd_client_cert,
+        host_config.host_etcd_client_key,
+        store=host_config.host_metadata_store,
+        store_path=host_config.host_metadata_store_path)
+    indexed, count = etcd_util.complete_name_index()
+    if indexed != count:
+        print('Failed to index %s of %s volumes and shares. The name index '
+              'is not complete. Run this command again' %
+              (count - indexed, count))
+        return 1
+    print('Indexed %s volumes and shares. The name index is complete' %
+          count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
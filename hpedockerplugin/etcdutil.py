@@ -12,16 +12,32 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
+from concurrent import futures
+import contextlib
+import copy
 import etcd
 import json
 from oslo_log import log as logging
 import six
+import socket
+import threading
+import time
+from urllib3.connection import HTTPConnection
 from hpedockerplugin.i18n import _, _LI
 import hpedockerplugin.exception as exception
+import hpedockerplugin.metadata_store as store_drivers
 
 LOG = logging.getLogger(__name__)
 
 VOLUMEROOT = '/volumes'
+# Index of the names of the volumes and the shares
+VOLUME_NAME_INDEX_ROOT = '/volumes-by-name'
+# Written by complete_name_index once every volume and share has an entry
+# in the name index and no older plugin version is left to miss adding one
+VOLUME_NAME_INDEX_COMPLETE_KEY = '/volumes-by-name-complete'
+VOLUME_STATE_ROOT = '/volume-state'
+VOLUME_SCHEMA_KEY = '/volume-schema'
 RCROOT = '/remote-copy'
 RC_KEY_FMT_STR = "%s/%s#%s"
 BACKENDROOT = '/backend'
@@ -31,54 +47,717 @@ RCG_LOCKROOT = '/rcg-lock'
 SHAREROOT = '/shares'
 FILEPERSONAROOT = '/file-persona'
 
+# Personas of the objects listed in the name index. These are the keys
+# of the orchestrators of the request router
+PERSONA_VOLUME = 'volume'
+PERSONA_FILE = 'file'
+
 SHARE_LOCKROOT = "/share-lock"
 FILE_BACKEND_LOCKROOT = "/fp-backend-lock"
 FILE_CPG_LOCKROOT = "/fp-cpg-lock"
 FILE_FPG_LOCKROOT = "/fp-fpg-lock"
 
+# Attempts made to write a volume document with compare-and-swap
+VOL_CAS_RETRIES = 5
+# From this schema version on, the mount state of a volume is stored under
+# VOLUME_STATE_ROOT and path_info is stored as an object, not a JSON string
+VOLUME_SCHEMA_SPLIT_STATE = 2
+# Fields of a volume that change on every mount and unmount
+VOLUME_STATE_FIELDS = ('node_mount_info', 'path_info', 'old_path_info')
+# Read index of a key that did not exist when it was read
+_KEY_ABSENT = 0
+# Seconds a mirror watch request waits for an event before re-issuing it
+MIRROR_WATCH_TIMEOUT = 60
+# Seconds to back off before re-listing a tree after a watch failure
+MIRROR_RETRY_INTERVAL = 2
+# Connections kept open to each etcd member
+DEFAULT_ETCD_POOL_SIZE = 20
+# Seconds an etcd member that failed a request is tried only as a last resort
+ETCD_MEMBER_QUARANTINE = 30
+# Read policies for reads that are not protected by a lock
+READ_POLICY_DEFAULT = 'default'
+READ_POLICY_NEAREST = 'nearest'
+# Read latencies remembered per etcd member
+READ_LATENCY_SAMPLES = 100
+# Samples needed before a hedging deadline is derived from them
+READ_HEDGE_MIN_SAMPLES = 10
+# Seconds after which a member that served no read is probed again
+READ_PROBE_INTERVAL = 60
+# Seconds an etcd lock outlives its holder. The holder keeps it alive
+# by refreshing it every LOCK_HEARTBEAT_INTERVAL seconds
+LOCK_TTL = 15
+LOCK_HEARTBEAT_INTERVAL = 5
+# Seconds to wait for a lock before failing the request, unless
+# configured otherwise for its lock type
+LOCK_WAIT_TIMEOUT = 300
+# Seconds a lock is kept alive while held, after which its holder is
+# taken to be stuck, unless configured otherwise for its lock type. The
+# file persona locks are held across FPG and VFS creation, which may take
+# many minutes, and are kept alive until released
+LOCK_MAX_HOLD_TIMES = {'VOL': 600, 'RCG': 600}
+
+_read_context = threading.local()
+
+
+@contextlib.contextmanager
+def consistent_reads():
+    """Serve metadata reads of the calling thread from etcd
+
+    Lock protected code paths modify metadata based on what they read and
+    must not act on a local mirror that may lag behind etcd.
+    """
+    depth = getattr(_read_context, 'depth', 0)
+    if depth == 0:
+        # Read indexes recorded by an earlier request run by this pooled
+        # thread must not be taken for those of this one
+        _get_read_indexes().clear()
+    _read_context.depth = depth + 1
+    try:
+        yield
+    finally:
+        _read_context.depth = depth
+        if depth == 0:
+            _get_read_indexes().clear()
+
+
+def _consistent_reads_required():
+    return getattr(_read_context, 'depth', 0) > 0
+
+
+def _get_read_indexes():
+    if not hasattr(_read_context, 'vol_indexes'):
+        _read_context.vol_indexes = {}
+    return _read_context.vol_indexes
+
+
+def load_path_info(path_info):
+    """path_info of a volume as a dictionary
+
+    Volumes of the first schema version keep it as a JSON string.
+    """
+    if isinstance(path_info, six.string_types):
+        return json.loads(path_info)
+    return path_info
+
+
+class VolumeUnitOfWork(object):
+    """Collects changes made to a volume document during a request
+
+    The changes are written to etcd by commit() as a single
+    compare-and-swap against the modifiedIndex of the document as it was
+    read by this thread. If another node modified the document in the
+    meantime, the changes are made again to its latest version, so a
+    change must be recorded as a function of the volume rather than as
+    a value when it depends on what it replaces.
+    """
+    def __init__(self, etcd_util, vol):
+        self._etcd = etcd_util
+        self._vol = vol
+        self._fields = set()
+        self._changes = []
+
+    def update(self, key, val):
+        def set_field(vol):
+            vol[key] = val
+        self.apply(set_field, key)
+
+    def remove(self, key):
+        def remove_field(vol):
+            vol.pop(key, None)
+        self.apply(remove_field, key)
+
+    def apply(self, change, *keys):
+        """Makes change(vol) to the volume
+
+        :param keys: Fields of the volume the change modifies
+        """
+        change(self._vol)
+        self._changes.append(change)
+        self._fields.update(keys)
+
+    def commit(self):
+        if not self._changes:
+            return
+        changes = self._changes
+
+        def make_changes(vol):
+            for change in changes:
+                change(vol)
+
+        self._etcd.update_vol_fields(self._vol, sorted(self._fields),
+                                     make_changes)
+        self._fields = set()
+        self._changes = []
+
+
+class EtcdTreeMirror(object):
+    """In-memory copy of the JSON documents stored under an etcd directory
+
+    The tree is listed once and then kept current with a recursive etcd v2
+    watch starting from the index of the listing. If etcd has compacted
+    the events the watch needs, the tree is listed again. Writes done by
+    this process are applied right away so that it reads its own writes.
+    """
+    def __init__(self, client, root, index_field=None):
+        self._client = client
+        self._root = root
+        self._index_field = index_field
+        self._objects = {}
+        # Last modifiedIndex seen per key. Deleted keys are retained so
+        # that a late event cannot bring them back
+        self._mod_indexes = {}
+        self._field_index = {}
+        self._etcd_index = 0
+        self._ready = False
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Calls listener(key, old, new) for each change seen by the watch
+
+        old or new is None when the key was created or deleted.
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        self._load()
+        self._thread = threading.Thread(
+            target=self._watch, name='etcd-mirror%s' % self._root)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def is_usable(self):
+        return self._ready and not _consistent_reads_required()
+
+    def get(self, key):
+        with self._lock:
+            obj = self._objects.get(key)
+        return copy.deepcopy(obj)
+
+    def get_by_field(self, value):
+        with self._lock:
+            key = self._field_index.get(value)
+            obj = self._objects.get(key) if key else None
+        return copy.deepcopy(obj)
+
+    def get_all(self):
+        return list(self.iter_all())
+
+    def iter_all(self):
+        # Objects are replaced rather than modified in place so a snapshot
+        # of the references is enough to copy them one at a time
+        with self._lock:
+            objs = [self._objects[k] for k in sorted(self._objects)]
+        for obj in objs:
+            yield copy.deepcopy(obj)
+
+    def apply_write(self, key, obj, mod_index):
+        with self._lock:
+            self._set(key, obj, mod_index)
+
+    def apply_delete(self, key, mod_index):
+        with self._lock:
+            self._remove(key, mod_index)
+
+    def _set(self, key, obj, mod_index):
+        if mod_index < self._mod_indexes.get(key, 0):
+            return
+        self._remove(key, mod_index)
+        self._objects[key] = obj
+        if self._index_field and obj.get(self._index_field):
+            self._field_index[obj[self._index_field]] = key
+
+    def _remove(self, key, mod_index):
+        if mod_index < self._mod_indexes.get(key, 0):
+            return
+        self._mod_indexes[key] = mod_index
+        obj = self._objects.pop(key, None)
+        if obj and self._index_field:
+            value = obj.get(self._index_field)
+            if self._field_index.get(value) == key:
+                del self._field_index[value]
+
+    def _load(self):
+        result = self._client.read(self._root, recursive=True)
+        objects = {}
+        mod_indexes = {}
+        for child in result.leaves:
+            if child.dir or child.key == self._root:
+                continue
+            objects[child.key] = json.loads(child.value)
+            mod_indexes[child.key] = child.modifiedIndex
+
+        with self._lock:
+            self._objects = {}
+            self._mod_indexes = mod_indexes
+            self._field_index = {}
+            for key, obj in objects.items():
+                self._set(key, obj, mod_indexes[key])
+            self._etcd_index = result.etcd_index
+            self._ready = True
+        LOG.info('Mirrored %s objects under %s at etcd index %s',
+                 len(objects), self._root, self._etcd_index)
+
+    def _apply_event(self, event):
+        if event.dir:
+            return
+        with self._lock:
+            old = self._objects.get(event.key)
+            if event.action in ('delete', 'expire', 'compareAndDelete'):
+                self._remove(event.key, event.modifiedIndex)
+            else:
+                self._set(event.key, json.loads(event.value),
+                          event.modifiedIndex)
+            new = self._objects.get(event.key)
+        for listener in self._listeners:
+            try:
+                listener(event.key, old, new)
+            except Exception as ex:
+                LOG.warning('Listener of %s failed: %s',
+                            self._root, six.text_type(ex))
+
+    def _watch(self):
+        while not self._stopped:
+            try:
+                if not self._ready:
+                    self._load()
+                event = self._client.read(self._root, recursive=True,
+                                          wait=True,
+                                          waitIndex=self._etcd_index + 1,
+                                          timeout=MIRROR_WATCH_TIMEOUT)
+                self._apply_event(event)
+                self._etcd_index = max(self._etcd_index,
+                                       event.modifiedIndex)
+            except etcd.EtcdWatchTimedOut:
+                continue
+            except etcd.EtcdEventIndexCleared:
+                LOG.info('Watch index of %s compacted. Re-listing...',
+                         self._root)
+                self._ready = False
+            except Exception as ex:
+                LOG.warning('Watch on %s failed: %s. Serving reads from '
+                            'etcd until it is restored',
+                            self._root, six.text_type(ex))
+                self._ready = False
+                time.sleep(MIRROR_RETRY_INTERVAL)
+
+
+class HealthAwareEtcdClient(etcd.Client):
+    """etcd client that remembers which cluster members failed requests
+
+    On a connection failure python-etcd moves to another member of the
+    cluster. Members that failed recently are only picked when no healthy
+    member is left, so that requests do not keep hopping onto a member
+    that is down.
+    """
+    supports_watch = True
+    supports_transactions = False
+
+    def __init__(self, *args, **kwargs):
+        self._member_failures = {}
+        self._health_lock = threading.Lock()
+        # Highest modifiedIndex of the writes done through this client
+        self.last_write_index = 0
+        super(HealthAwareEtcdClient, self).__init__(*args, **kwargs)
+
+    def write(self, key, value, *args, **kwargs):
+        result = super(HealthAwareEtcdClient, self).write(key, value, *args,
+                                                          **kwargs)
+        self._written(result)
+        return result
+
+    def delete(self, key, *args, **kwargs):
+        result = super(HealthAwareEtcdClient, self).delete(key, *args,
+                                                           **kwargs)
+        self._written(result)
+        return result
+
+    def _written(self, result):
+        index = getattr(result, 'modifiedIndex', None) or 0
+        with self._health_lock:
+            self.last_write_index = max(self.last_write_index, index)
+
+    def _next_server(self, cause=None):
+        with self._health_lock:
+            self._member_failures[self._base_uri] = time.time()
+            now = time.time()
+            for mach in self._machines_cache:
+                failed_at = self._member_failures.get(mach)
+                if failed_at is None or \
+                        now - failed_at > ETCD_MEMBER_QUARANTINE:
+                    self._machines_cache.remove(mach)
+                    LOG.info('Selected healthy etcd member %s', mach)
+                    return mach
+        return super(HealthAwareEtcdClient, self)._next_server(cause=cause)
+
+    def get_lock(self, name):
+        return HeartbeatEtcdLock(self, name)
+
+    def write_many(self, items):
+        # The v2 API has no multi-key transactions
+        return [self.write(key, value) for key, value in items]
+
+    def member_health(self):
+        """Map of etcd members to whether they are considered healthy"""
+        now = time.time()
+        members = set(self._machines_cache) | {self._base_uri}
+        with self._health_lock:
+            return {m: now - self._member_failures.get(m, 0) >
+                    ETCD_MEMBER_QUARANTINE for m in members}
+
+
+class HeartbeatEtcdLock(etcd.Lock):
+    """etcd.Lock with a short TTL kept alive by its holder
+
+    Also bounds the wait for the lock by its timeout, which etcd.Lock
+    keeps retrying past when the watch of the preceding key times out.
+    """
+    def refresh(self, lock_ttl):
+        # The key is only known once it was queued by acquire
+        if self._sequence:
+            self.client.write(self.lock_key, None, ttl=lock_ttl,
+                              refresh=True, prevExist=True)
+
+    def _acquired(self, blocking=True, timeout=0):
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            blocker = self._get_blocker()
+            self.is_taken = blocker is None
+            if self.is_taken or not blocking:
+                return self.is_taken
+            wait = None
+            if deadline:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    return False
+            try:
+                self.client.watch(blocker.key, timeout=wait,
+                                  index=blocker.modifiedIndex + 1)
+            except (etcd.EtcdKeyNotFound, etcd.EtcdWatchTimedOut):
+                pass
+            except etcd.EtcdException as ex:
+                LOG.warning('Failed to watch lock key %s: %s',
+                            blocker.key, six.text_type(ex))
+
+    def _get_blocker(self):
+        """The nearest queued key this holder waits for, if any"""
+        queue = sorted(self.client.read(self.path, recursive=True).leaves,
+                       key=lambda r: r.key)
+        keys = [r.key for r in queue]
+        if self.lock_key not in keys:
+            # Most probably our key expired
+            raise etcd.EtcdLockExpired(u"Lock not found")
+        ahead = queue[:keys.index(self.lock_key)]
+        return ahead[-1] if ahead else None
+
+
+class EtcdReadRouter(object):
+    """Sends reads to the etcd member that answers them the fastest
+
+    Only reads that tolerate slightly stale data must be routed here since
+    a member may lag behind the leader. Read latencies are tracked per
+    member and members that did not serve a read for a while are probed
+    again. With a hedge percentile, a read that takes longer than that
+    percentile of the member's recent latencies is sent to the next best
+    member as well and the first answer wins.
+
+    A member that has not applied the writes this process did before the
+    read yet may answer without them, e.g. not find a volume it just
+    created. Such an answer is dropped and the key is read again from the
+    leader with a quorum read.
+    """
+    def __init__(self, client, hedge_percentile=None):
+        self._client = client
+        self._hedge_percentile = hedge_percentile
+        self._lock = threading.Lock()
+        self._members = {}
+        for uri in [client._base_uri] + list(client._machines_cache):
+            # Member clients share the connection pool of the client
+            member = copy.copy(client)
+            member._base_uri = uri
+            member._machines_cache = []
+            member._allow_reconnect = False
+            self._members[uri] = member
+        self._ewma = {}
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=READ_LATENCY_SAMPLES))
+        self._last_read = {}
+        self._executor = None
+        if hedge_percentile:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=client.http.connection_pool_kw.get('maxsize',
+                                                               10))
+
+    def _ranked_members(self):
+        now = time.time()
+        with self._lock:
+            for uri in self._members:
+                if now - self._last_read.get(uri, 0) > READ_PROBE_INTERVAL:
+                    # Probe the member so that its latency is known
+                    self._last_read[uri] = now
+                    return [uri] + [m for m in self._members if m != uri]
+            return sorted(self._members,
+                          key=lambda m: self._ewma.get(m, 0))
+
+    def _record(self, uri, latency):
+        with self._lock:
+            prev = self._ewma.get(uri)
+            self._ewma[uri] = latency if prev is None else \
+                0.8 * prev + 0.2 * latency
+            self._latencies[uri].append(latency)
+            self._last_read[uri] = time.time()
+
+    def _hedge_deadline(self, uri):
+        with self._lock:
+            samples = sorted(self._latencies[uri])
+        if len(samples) < READ_HEDGE_MIN_SAMPLES:
+            return None
+        idx = min(len(samples) - 1,
+                  len(samples) * self._hedge_percentile // 100)
+        return samples[idx]
+
+    def _timed_read(self, uri, key, kwargs):
+        start = time.time()
+        try:
+            result = self._members[uri].read(key, **kwargs)
+        except etcd.EtcdKeyNotFound:
+            self._record(uri, time.time() - start)
+            raise
+        except etcd.EtcdConnectionFailed:
+            # Rank the member last until it is probed again
+            self._record(uri, ETCD_MEMBER_QUARANTINE)
+            raise
+        self._record(uri, time.time() - start)
+        return result
+
+    def read(self, key, **kwargs):
+        written = getattr(self._client, 'last_write_index', 0)
+        members = self._ranked_members()
+        try:
+            if self._executor is None or len(members) < 2:
+                result = self._timed_read(members[0], key, kwargs)
+            else:
+                result = self._hedged_read(members, key, kwargs)
+        except etcd.EtcdKeyNotFound as ex:
+            if not self._lags(ex.payload, written):
+                raise
+            result = None
+        except etcd.EtcdConnectionFailed as ex:
+            LOG.warning('Read of %s from nearest etcd member failed: %s. '
+                        'Retrying on the cluster...', key, ex)
+            return self._client.read(key, **kwargs)
+        if result is None or \
+                (getattr(result, 'etcd_index', None) or 0) < written:
+            LOG.debug('etcd member serving read of %s lags behind the '
+                      'writes of this process. Reading it from the '
+                      'leader...', key)
+            return self._client.read(key, quorum=True, **kwargs)
+        return result
+
+    @staticmethod
+    def _lags(payload, written):
+        """Whether a not-found error may predate the writes of this process
+
+        The error is taken as lagging if it does not tell the etcd index
+        it was raised at.
+        """
+        index = (payload or {}).get('index')
+        return written > 0 and (index is None or index < written)
+
+    def _hedged_read(self, members, key, kwargs):
+        primary = self._executor.submit(self._timed_read, members[0], key,
+                                        kwargs)
+        try:
+            return primary.result(timeout=self._hedge_deadline(members[0]))
+        except futures.TimeoutError:
+            pass
+
+        LOG.debug('Read of %s from %s is slow, hedging it on %s',
+                  key, members[0], members[1])
+        hedge = self._executor.submit(self._timed_read, members[1], key,
+                                      kwargs)
+        pending = [primary, hedge]
+        for future in futures.as_completed(pending):
+            pending.remove(future)
+            if not pending or not isinstance(future.exception(),
+                                             etcd.EtcdConnectionFailed):
+                return future.result()
+
+
+def _parse_etcd_hosts(host):
+    host_tuple = ()
+    if isinstance(host, str):
+        if ',' in host:
+            host_list = [h.strip() for h in host.split(',')]
+
+            for i in host_list:
+                temp_tuple = (i.split(':')[0], int(i.split(':')[1]))
+                host_tuple = host_tuple + (temp_tuple,)
+
+            host_tuple = tuple(host_tuple)
+    return host_tuple
+
+
+class EtcdConnectionFactory(object):
+    """Hands out one etcd client per etcd endpoint for the whole process
+
+    Volume, share and file persona metadata clients all get the same
+    client and hence share its pool of kept-alive (and for https,
+    already handshaked) connections. With the SQLite metadata store
+    they share one store per database file instead, and with the etcd v3
+    store one store per etcd endpoint.
+    """
+    def __init__(self):
+        self._clients = {}
+        self._routers = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, host, port, client_cert, client_key,
+                   pool_size=None, store=None, store_path=None):
+        if store == store_drivers.STORE_SQLITE:
+            key = (store, store_path)
+        else:
+            key = (host, port, client_cert, client_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if store == store_drivers.STORE_SQLITE:
+                    client = store_drivers.SqliteStore(store_path)
+                elif store == store_drivers.STORE_ETCD3:
+                    client = self._create_v3_store(
+                        host, port, client_cert, client_key,
+                        pool_size or DEFAULT_ETCD_POOL_SIZE)
+                else:
+                    client = self._create_client(
+                        host, port, client_cert, client_key,
+                        pool_size or DEFAULT_ETCD_POOL_SIZE)
+                self._clients[key] = client
+            return client
+
+    def get_read_router(self, client, read_policy=None,
+                        hedge_percentile=None):
+        """Router for the reads of client that tolerate stale data
+
+        Returns None if reads must be sent to the current member of the
+        client, that is if the policy is not 'nearest' or if the cluster
+        has a single member.
+        """
+        if read_policy != READ_POLICY_NEAREST or \
+                not getattr(client, '_machines_cache', None):
+            return None
+        with self._lock:
+            router = self._routers.get(id(client))
+            if router is None:
+                router = EtcdReadRouter(client, hedge_percentile)
+                self._routers[id(client)] = router
+            return router
+
+    def clear(self):
+        with self._lock:
+            self._clients = {}
+            self._routers = {}
+
+    @staticmethod
+    def _create_client(host, port, client_cert, client_key, pool_size):
+        host_tuple = _parse_etcd_hosts(host)
+        LOG.info('Creating etcd client for host_tuple %s, host %s, '
+                 'pool size %s' % (host_tuple, host, pool_size))
+
+        kwargs = {'port': port, 'per_host_pool_size': pool_size}
+        if client_cert is not None and client_key is not None:
+            kwargs['protocol'] = 'https'
+            kwargs['cert'] = (client_cert, client_key)
+        if len(host_tuple) > 0:
+            kwargs['host'] = host_tuple
+            kwargs['protocol'] = kwargs.get('protocol', 'http')
+            kwargs['allow_reconnect'] = True
+        else:
+            kwargs['host'] = host
+        client = HealthAwareEtcdClient(**kwargs)
+
+        # Keep idle pooled connections from being silently dropped by
+        # firewalls and NAT between mount storms
+        client.http.connection_pool_kw['socket_options'] = \
+            HTTPConnection.default_socket_options + \
+            [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        # Connections opened while discovering the cluster members were
+        # created without the option
+        client.http.clear()
+        return client
+
+    @staticmethod
+    def _create_v3_store(host, port, client_cert, client_key, pool_size):
+        hosts = _parse_etcd_hosts(host) or ((host, port),)
+        if client_cert is not None and client_key is not None:
+            return store_drivers.EtcdV3Store(
+                hosts, 'https', (client_cert, client_key), pool_size)
+        return store_drivers.EtcdV3Store(hosts, pool_size=pool_size)
 
-class HpeEtcdClient(object):
 
-    def __init__(self, host, port, client_cert, client_key):
-        self.host = host
-        self.port = port
+_connection_factory = EtcdConnectionFactory()
 
-        LOG.info('HpeEtcdClient datatype of host is %s ' % type(self.host))
-        host_tuple = ()
-        if isinstance(self.host, str):
-            if ',' in self.host:
-                host_list = [h.strip() for h in host.split(',')]
 
-                for i in host_list:
-                    temp_tuple = (i.split(':')[0], int(i.split(':')[1]))
-                    host_tuple = host_tuple + (temp_tuple,)
+def get_etcd_client(host, port, client_cert, client_key, pool_size=None,
+                    store=None, store_path=None):
+    return _connection_factory.get_client(host, port, client_cert,
+                                          client_key, pool_size, store,
+                                          store_path)
 
-                host_tuple = tuple(host_tuple)
 
-        LOG.info('HpeEtcdClient host_tuple is %s, host is %s ' %
-                 (host_tuple, self.host))
+def _supports_watch(client):
+    return getattr(client, 'supports_watch', True)
 
-        if client_cert is not None and client_key is not None:
-            if len(host_tuple) > 0:
-                LOG.info('HpeEtcdClient host tuple is not None')
-                self.client = etcd.Client(host=host_tuple, port=port,
-                                          protocol='https',
-                                          cert=(client_cert, client_key),
-                                          allow_reconnect=True)
-            else:
-                LOG.info('HpeEtcdClient host %s ' % host)
-                self.client = etcd.Client(host=host, port=port,
-                                          protocol='https',
-                                          cert=(client_cert, client_key))
-        else:
-            LOG.info('HpeEtcdClient no certs')
-            if len(host_tuple) > 0:
-                LOG.info('Use http protocol')
-                self.client = etcd.Client(host=host_tuple, port=port,
-                                          protocol='http',
-                                          allow_reconnect=True)
-            else:
-                self.client = etcd.Client(host, port)
+
+def _supports_transactions(client):
+    return getattr(client, 'supports_transactions', False)
+
+
+def get_etcd_read_router(client, read_policy=None, hedge_percentile=None):
+    return _connection_factory.get_read_router(client, read_policy,
+                                               hedge_percentile)
+
+
+def get_member_health(client):
+    """Map of etcd members to whether they are considered healthy
+
+    Empty for the metadata stores other than the etcd v2 client.
+    """
+    member_health = getattr(client, 'member_health', None)
+    return member_health() if member_health else {}
+
+
+def read_stale_ok(client, router, key, **kwargs):
+    """Read a key that is not protected by a lock
+
+    Lock protected code paths read from the leader with a quorum read
+    whenever the other reads may be served by any member.
+    """
+    if router is None:
+        return client.read(key, **kwargs)
+    if _consistent_reads_required():
+        return client.read(key, quorum=True, **kwargs)
+    return router.read(key, **kwargs)
+
+
+class HpeEtcdClient(object):
+
+    def __init__(self, host, port, client_cert, client_key,
+                 pool_size=None, read_policy=None, hedge_percentile=None,
+                 store=None, store_path=None):
+        self.host = host
+        self.port = port
+        self.client = get_etcd_client(host, port, client_cert, client_key,
+                                      pool_size, store, store_path)
+        self._router = get_etcd_read_router(self.client, read_policy,
+                                            hedge_percentile)
+
+    def read(self, key, **kwargs):
+        return read_stale_ok(self.client, self._router, key, **kwargs)
 
     def make_root(self, root):
         try:
@@ -91,17 +770,34 @@ class HpeEtcdClient(object):
             raise exception.HPEPluginMakeEtcdRootException(reason=msg)
         return
 
-    def save_object(self, etcd_key, obj):
+    def save_object(self, etcd_key, obj, extra_items=None):
+        """Write an object along with extra (key, value) items
+
+        Stores supporting transactions write the items atomically with
+        the object. Otherwise they are written after it, as a best effort.
+        """
         val = json.dumps(obj)
+        extra_items = list(extra_items or [])
         try:
-            self.client.write(etcd_key, val)
+            if extra_items and _supports_transactions(self.client):
+                result = self.client.write_many(
+                    [(etcd_key, val)] + extra_items)[0]
+                extra_items = []
+            else:
+                result = self.client.write(etcd_key, val)
         except Exception as ex:
             msg = 'Failed to save object to ETCD: %s'\
                   % six.text_type(ex)
             LOG.error(msg)
             raise exception.HPEPluginSaveFailed(obj=obj)
-        else:
-            LOG.info('Write key: %s to ETCD, value is: %s', etcd_key, val)
+        LOG.info('Write key: %s to ETCD, value is: %s', etcd_key, val)
+        for key, value in extra_items:
+            try:
+                self.client.write(key, value)
+            except Exception as ex:
+                LOG.warning('Failed to write key %s along with %s: %s',
+                            key, etcd_key, six.text_type(ex))
+        return result
 
     def update_object(self, etcd_key, key_to_update, val):
         result = self.client.read(etcd_key)
@@ -109,13 +805,15 @@ class HpeEtcdClient(object):
         val[key_to_update] = val
         val = json.dumps(val)
         result.value = val
-        self.client.update(result)
+        result = self.client.update(result)
         LOG.info(_LI('Update key: %s to ETCD, value is: %s'), etcd_key, val)
+        return result
 
     def delete_object(self, etcd_key):
         try:
-            self.client.delete(etcd_key)
+            result = self.client.delete(etcd_key)
             LOG.info(_LI('Deleted key: %s from ETCD'), etcd_key)
+            return result
         except etcd.EtcdKeyNotFound:
             msg = "Key to delete not found ETCD: [key=%s]" % etcd_key
             LOG.info(msg)
@@ -127,7 +825,7 @@ class HpeEtcdClient(object):
 
     def get_object(self, etcd_key):
         try:
-            result = self.client.read(etcd_key)
+            result = self.read(etcd_key)
             return json.loads(result.value)
         except etcd.EtcdKeyNotFound:
             msg = "Key not found ETCD: [key=%s]" % etcd_key
@@ -141,7 +839,7 @@ class HpeEtcdClient(object):
 
     def get_objects(self, root):
         ret_list = []
-        objects = self.client.read(root, recursive=True)
+        objects = self.read(root, recursive=True)
         for obj in objects.children:
             if obj.key != root:
                 ret_obj = json.loads(obj.value)
@@ -149,17 +847,164 @@ class HpeEtcdClient(object):
         return ret_list
 
     def get_value(self, key):
-        result = self.client.read(key)
+        result = self.read(key)
         return result.value
 
 
+class NameIndex(object):
+    """Index of the names of the volumes and the shares
+
+    Maps the name of a volume or a share to its persona, backend and ID,
+    so that an object is found and a request routed to the right
+    orchestrator without reading a whole tree. Names share a single
+    namespace across the personas.
+
+    Plugin versions older than the index do not add names to it. A name
+    missing in it is hence looked for in the trees, until the index is
+    marked complete by the complete_name_index command once all the
+    plugin instances are upgraded. From then on a name missing in the
+    index is known not to exist.
+    """
+    def __init__(self, client, read=None):
+        self._client = client
+        self._read = read or client.read
+        self._root = VOLUME_NAME_INDEX_ROOT + '/'
+
+    def ensure_built(self):
+        try:
+            self._client.write(VOLUME_NAME_INDEX_ROOT, None, dir=True,
+                               prevExist=False)
+        except etcd.EtcdAlreadyExist:
+            return
+        # Objects created by an older plugin version are not present in
+        # the index yet. Names left out, as by a node dying half way, are
+        # still found in the trees
+        self.build()
+
+    def complete(self):
+        """Builds the index and marks it complete if no name failed
+
+        Must only be run once no older plugin version uses the cluster.
+
+        :return: Number of objects indexed and number of objects
+        """
+        indexed, count = self.build()
+        if indexed == count:
+            self._client.write(VOLUME_NAME_INDEX_COMPLETE_KEY, '1')
+            LOG.info('Name index marked complete')
+        return indexed, count
+
+    def build(self):
+        """Adds all the volumes and shares to the index
+
+        :return: Number of objects indexed and number of objects
+        """
+        LOG.info('Building name index under %s...', VOLUME_NAME_INDEX_ROOT)
+        count = 0
+        indexed = 0
+        for root, persona, name_field in (
+                (VOLUMEROOT, PERSONA_VOLUME, 'display_name'),
+                (SHAREROOT, PERSONA_FILE, 'name')):
+            try:
+                objects = self._client.read(root, recursive=True)
+            except etcd.EtcdKeyNotFound:
+                continue
+            for child in objects.children:
+                if child.key == root or not child.value:
+                    continue
+                obj = json.loads(child.value)
+                count += 1
+                if self.add(obj[name_field], persona, obj.get('backend'),
+                            obj.get('id')):
+                    indexed += 1
+        LOG.info('Name index built for %s of %s volumes and shares',
+                 indexed, count)
+        return indexed, count
+
+    def is_complete(self):
+        """Whether every volume and share is known to have an entry"""
+        try:
+            self._read(VOLUME_NAME_INDEX_COMPLETE_KEY)
+        except etcd.EtcdKeyNotFound:
+            return False
+        return True
+
+    def item(self, name, persona, backend, obj_id):
+        """Returns the key and value of the entry of a name
+
+        For writing the entry along with the object in a single request.
+        """
+        entry = {'persona': persona, 'backend': backend, 'id': obj_id}
+        return self._root + name, json.dumps(entry)
+
+    def add(self, name, persona, backend, obj_id):
+        """Returns whether the name could be added to the index"""
+        key, value = self.item(name, persona, backend, obj_id)
+        try:
+            self._client.write(key, value)
+            return True
+        except Exception as ex:
+            # Lookups fall back to probing the objects until the index is
+            # completed again
+            LOG.warning('Failed to add %s to the name index: %s',
+                        name, six.text_type(ex))
+            try:
+                self._client.delete(VOLUME_NAME_INDEX_COMPLETE_KEY)
+            except etcd.EtcdKeyNotFound:
+                pass
+            except Exception as ex:
+                LOG.error('Failed to mark the name index incomplete: %s. '
+                          '%s may not be found by its name',
+                          six.text_type(ex), name)
+            else:
+                LOG.warning('Name index marked incomplete. Run '
+                            'complete_name_index to complete it again')
+            return False
+
+    def remove(self, name, persona, obj_id=None):
+        """Removes the entry of a name if it still names the object
+
+        An entry of another persona, or of another ID if one is given, is
+        left alone.
+        """
+        key = self._root + name
+        try:
+            result = self._client.read(key)
+            entry = json.loads(result.value)
+            if entry['persona'] != persona or \
+                    obj_id is not None and entry['id'] != obj_id:
+                return
+            self._client.delete(key, prevValue=result.value)
+        except (etcd.EtcdKeyNotFound, etcd.EtcdCompareFailed):
+            pass
+        except Exception as ex:
+            # A stale entry only costs a read of the object it names
+            LOG.warning('Failed to remove %s from the name index: %s',
+                        name, six.text_type(ex))
+
+    def lookup(self, name):
+        """Returns the entry of a name, None if not in the index"""
+        try:
+            result = self._read(self._root + name)
+        except etcd.EtcdKeyNotFound:
+            return None
+        return json.loads(result.value)
+
+
 # Manages File Persona metadata under /file-persona key
 class HpeFilePersonaEtcdClient(object):
-    def __init__(self, host, port, client_cert, client_key):
+    def __init__(self, host, port, client_cert, client_key,
+                 pool_size=None, read_policy=None, hedge_percentile=None,
+                 store=None, store_path=None, lock_wait_timeouts=None,
+                 lock_max_hold_times=None):
         self._client = HpeEtcdClient(host, port,
-                                     client_cert, client_key)
+                                     client_cert, client_key, pool_size,
+                                     read_policy, hedge_percentile,
+                                     store, store_path)
         self._client.make_root(FILEPERSONAROOT)
         self._root = FILEPERSONAROOT
+        self._lock_wait_timeouts = lock_wait_timeouts
+        self._lock_max_hold_times = lock_max_hold_times
 
     def create_cpg_entry(self, backend, cpg):
         etcd_key = '/'.join([self._root, backend, cpg])
@@ -221,61 +1066,118 @@ class HpeFilePersonaEtcdClient(object):
         }
         lock_root = lockroot_map.get(lock_type)
         if lock_root:
-            return EtcdLock(lock_root + '/', self._client.client, name)
+            return self._new_lock(lock_root, name, lock_type)
         raise exception.EtcdInvalidLockType(type=lock_type)
 
+    def _new_lock(self, lock_root, name, lock_type):
+        return EtcdLock(lock_root + '/', self._client.client, name=name,
+                        wait_timeout=_lock_wait_timeout(
+                            self._lock_wait_timeouts, lock_type),
+                        max_hold_time=_lock_max_hold_time(
+                            self._lock_max_hold_times, lock_type))
+
     def get_file_backend_lock(self, backend):
-        return EtcdLock(FILE_BACKEND_LOCKROOT + '/', self._client.client,
-                        name=backend)
+        return self._new_lock(FILE_BACKEND_LOCKROOT, backend, 'FP_BACKEND')
 
     def get_cpg_lock(self, backend, cpg):
         lock_key = '/'.join([backend, cpg])
-        return EtcdLock(FILE_CPG_LOCKROOT + '/', self._client.client,
-                        name=lock_key)
+        return self._new_lock(FILE_CPG_LOCKROOT, lock_key, 'FP_CPG')
 
     def get_fpg_lock(self, backend, cpg, fpg):
         lock_key = '/'.join([backend, cpg, fpg])
-        return EtcdLock(FILE_FPG_LOCKROOT + '/', self._client.client,
-                        name=lock_key)
+        return self._new_lock(FILE_FPG_LOCKROOT, lock_key, 'FP_FPG')
 
 
 class HpeShareEtcdClient(object):
 
-    def __init__(self, host, port, client_cert, client_key):
+    def __init__(self, host, port, client_cert, client_key, mirror=False,
+                 pool_size=None, read_policy=None, hedge_percentile=None,
+                 store=None, store_path=None, lock_wait_timeouts=None,
+                 lock_max_hold_times=None):
         self._client = HpeEtcdClient(host, port,
-                                     client_cert, client_key)
+                                     client_cert, client_key, pool_size,
+                                     read_policy, hedge_percentile,
+                                     store, store_path)
         self._client.make_root(SHAREROOT)
         self._root = SHAREROOT + '/'
+        self._lock_wait_timeouts = lock_wait_timeouts
+        self._lock_max_hold_times = lock_max_hold_times
+        self._names = NameIndex(self._client.client)
+        self._names.ensure_built()
 
         self._client.make_root(BACKENDROOT)
         self.backendroot = BACKENDROOT + '/'
 
+        self._mirror = None
+        if mirror and _supports_watch(self._client.client):
+            self._mirror = EtcdTreeMirror(self._client.client, SHAREROOT)
+            self._mirror.start()
+
+    def _use_mirror(self):
+        return self._mirror is not None and self._mirror.is_usable()
+
     def save_share(self, share):
         etcd_key = self._root + share['name']
-        self._client.save_object(etcd_key, share)
+        name_item = self._names.item(share['name'], PERSONA_FILE,
+                                     share.get('backend'), share.get('id'))
+        result = self._client.save_object(etcd_key, share,
+                                          extra_items=[name_item])
+        if self._mirror:
+            self._mirror.apply_write(etcd_key, json.loads(result.value),
+                                     result.modifiedIndex)
 
     def update_share(self, name, key, val):
         etcd_key = self._root + name
-        self._client.update_object(etcd_key, key, val)
+        result = self._client.update_object(etcd_key, key, val)
+        if self._mirror:
+            self._mirror.apply_write(etcd_key, json.loads(result.value),
+                                     result.modifiedIndex)
 
     def delete_share(self, share_name):
         etcd_key = self._root + share_name
-        self._client.delete_object(etcd_key)
+        result = self._client.delete_object(etcd_key)
+        self._names.remove(share_name, PERSONA_FILE)
+        if self._mirror:
+            self._mirror.apply_delete(etcd_key, result.modifiedIndex)
 
     def get_share(self, name):
         etcd_key = self._root + name
+        if self._use_mirror():
+            share = self._mirror.get(etcd_key)
+            if share is None:
+                msg = "Key not found ETCD: [key=%s]" % etcd_key
+                raise exception.EtcdMetadataNotFound(msg)
+            return share
         return self._client.get_object(etcd_key)
 
     def get_all_shares(self):
+        if self._use_mirror():
+            return self._mirror.get_all()
         return self._client.get_objects(SHAREROOT)
 
+    def lookup_name(self, name):
+        return self._names.lookup(name)
+
+    def add_name(self, name, persona, backend, obj_id):
+        return self._names.add(name, persona, backend, obj_id)
+
+    def name_index_complete(self):
+        return self._names.is_complete()
+
     def get_lock(self, lock_type, name=None):
-        return EtcdLock(SHARE_LOCKROOT + '/', self._client.client, name=name)
+        return EtcdLock(SHARE_LOCKROOT + '/', self._client.client, name=name,
+                        wait_timeout=_lock_wait_timeout(
+                            self._lock_wait_timeouts, 'FP_SHARE'),
+                        max_hold_time=_lock_max_hold_time(
+                            self._lock_max_hold_times, 'FP_SHARE'))
 
     def get_backend_key(self, backend):
         passphrase = self.backendroot + backend
         return self._client.get_value(passphrase)
 
+    def get_member_health(self):
+        return get_member_health(self._client.client)
+
 
 # TODO: Eventually this will take over and EtcdUtil will be phased out
 # class HpeVolumeEtcdClient(object):
@@ -357,49 +1259,62 @@ class HpeShareEtcdClient(object):
 
 class EtcdUtil(object):
 
-    def __init__(self, host, port, client_cert, client_key):
+    def __init__(self, host, port, client_cert, client_key, mirror=False,
+                 pool_size=None, read_policy=None, hedge_percentile=None,
+                 store=None, store_path=None, lock_wait_timeouts=None,
+                 lock_max_hold_times=None):
         self.host = host
         self.port = port
+        self._lock_wait_timeouts = lock_wait_timeouts
+        self._lock_max_hold_times = lock_max_hold_times
+        self._mirror = None
 
-        LOG.info('ETCDUTIL datatype of host is %s ' % type(self.host))
-        host_tuple = ()
-        if isinstance(self.host, str):
-            if ',' in self.host:
-                host_list = [h.strip() for h in host.split(',')]
-
-                for i in host_list:
-                    temp_tuple = (i.split(':')[0], int(i.split(':')[1]))
-                    host_tuple = host_tuple + (temp_tuple,)
-
-                host_tuple = tuple(host_tuple)
-
-        LOG.info('ETCDUTIL host_tuple is %s, host is %s ' % (host_tuple,
-                                                             self.host))
+        self._state_mirror = None
+        self._schema_version = 1
 
         self.volumeroot = VOLUMEROOT + '/'
+        self.stateroot = VOLUME_STATE_ROOT + '/'
         self.backendroot = BACKENDROOT + '/'
-        if client_cert is not None and client_key is not None:
-            if len(host_tuple) > 0:
-                LOG.info('ETCDUTIL host tuple is not None')
-                self.client = etcd.Client(host=host_tuple, port=port,
-                                          protocol='https',
-                                          cert=(client_cert, client_key),
-                                          allow_reconnect=True)
-            else:
-                LOG.info('ETCDUTIL host %s ' % host)
-                self.client = etcd.Client(host=host, port=port,
-                                          protocol='https',
-                                          cert=(client_cert, client_key))
-        else:
-            LOG.info('ETCDUTIL no certs')
-            if len(host_tuple) > 0:
-                LOG.info('Use http protocol')
-                self.client = etcd.Client(host=host_tuple, port=port,
-                                          protocol='http',
-                                          allow_reconnect=True)
-            else:
-                self.client = etcd.Client(host, port)
+        self.client = get_etcd_client(host, port, client_cert, client_key,
+                                      pool_size, store, store_path)
+        self._router = get_etcd_read_router(self.client, read_policy,
+                                            hedge_percentile)
+        self._names = NameIndex(self.client, self._read)
         self._make_root()
+        if mirror and _supports_watch(self.client):
+            self._mirror = EtcdTreeMirror(self.client, VOLUMEROOT,
+                                          index_field='display_name')
+            self._mirror.start()
+            self._state_mirror = EtcdTreeMirror(self.client,
+                                                VOLUME_STATE_ROOT)
+            self._state_mirror.start()
+
+    def _use_mirror(self):
+        return self._mirror is not None and self._mirror.is_usable() and \
+            self._state_mirror.is_usable()
+
+    def add_change_listener(self, listener):
+        """Calls listener(name) when the watch sees a volume change
+
+        The name is None if the volume can't be told. Nothing is reported
+        unless the local mirror is enabled.
+        """
+        if not self._mirror:
+            return
+
+        def volume_changed(key, old, new):
+            listener((new or old or {}).get('display_name'))
+
+        def state_changed(key, old, new):
+            vol = self._mirror.get(self.volumeroot +
+                                   key[len(self.stateroot):])
+            listener(vol.get('display_name') if vol else None)
+
+        self._mirror.add_listener(volume_changed)
+        self._state_mirror.add_listener(state_changed)
+
+    def _read(self, key, **kwargs):
+        return read_stale_ok(self.client, self._router, key, **kwargs)
 
     def _make_root(self):
         try:
@@ -414,13 +1329,129 @@ class EtcdUtil(object):
             msg = (_('Could not init EtcUtil: %s'), six.text_type(ex))
             LOG.error(msg)
             raise exception.HPEPluginMakeEtcdRootException(reason=msg)
+        try:
+            self.client.read(VOLUME_STATE_ROOT)
+        except etcd.EtcdKeyNotFound:
+            self.client.write(VOLUME_STATE_ROOT, None, dir=True)
+        self._read_schema_version()
+        try:
+            self._names.ensure_built()
+        except Exception as ex:
+            msg = (_('Could not init EtcUtil: %s'), six.text_type(ex))
+            LOG.error(msg)
+            raise exception.HPEPluginMakeEtcdRootException(reason=msg)
         return
 
+    def _read_schema_version(self):
+        """Schema version new volumes are to be created with
+
+        Read from etcd until it is the latest version, as the migration
+        may be run while this process is serving requests.
+        """
+        if self._schema_version < VOLUME_SCHEMA_SPLIT_STATE:
+            try:
+                self._schema_version = int(
+                    self.client.read(VOLUME_SCHEMA_KEY).value)
+            except etcd.EtcdKeyNotFound:
+                pass
+        return self._schema_version
+
+    def _state_key(self, volid):
+        return self.stateroot + volid
+
+    @staticmethod
+    def _is_split(vol):
+        return vol.get('schema_version', 1) >= VOLUME_SCHEMA_SPLIT_STATE
+
+    @staticmethod
+    def _decode_state_fields(fields):
+        if fields.get('path_info') is not None:
+            fields['path_info'] = load_path_info(fields['path_info'])
+        if fields.get('old_path_info'):
+            fields['old_path_info'] = [
+                [node_id, load_path_info(path_info)]
+                for node_id, path_info in fields['old_path_info']]
+        return fields
+
+    @staticmethod
+    def _encode_state_fields(fields):
+        # Volumes of the first schema version keep path_info as a JSON
+        # string so that older plugin versions can read them
+        fields = dict(fields)
+        if isinstance(fields.get('path_info'), dict):
+            fields['path_info'] = json.dumps(fields['path_info'])
+        if fields.get('old_path_info'):
+            fields['old_path_info'] = [
+                [node_id, json.dumps(path_info)
+                 if isinstance(path_info, dict) else path_info]
+                for node_id, path_info in fields['old_path_info']]
+        return fields
+
+    def _vol_from_stored(self, doc, state):
+        vol = doc
+        if self._is_split(doc):
+            vol.setdefault('path_info', None)
+            vol.update(state or {})
+        return self._decode_state_fields(vol)
+
+    def _vol_to_stored(self, vol):
+        """Split a volume into the document and the state to be stored"""
+        if not self._is_split(vol):
+            return self._encode_state_fields(vol), None
+        doc = {k: v for k, v in vol.items() if k not in VOLUME_STATE_FIELDS}
+        state = {k: v for k, v in vol.items() if k in VOLUME_STATE_FIELDS}
+        return doc, state
+
+    def _with_state(self, doc):
+        """Merge the separately stored mount state into a volume"""
+        state = None
+        if self._is_split(doc):
+            statekey = self._state_key(doc['id'])
+            if self._use_mirror():
+                state = self._state_mirror.get(statekey)
+            else:
+                try:
+                    result = self._read(statekey)
+                    state = json.loads(result.value)
+                    index = result.modifiedIndex
+                except etcd.EtcdKeyNotFound:
+                    index = _KEY_ABSENT
+                _get_read_indexes()[statekey] = index
+        return self._vol_from_stored(doc, state)
+
+    def _read_all_states(self):
+        try:
+            states = self._read(VOLUME_STATE_ROOT, recursive=True)
+        except etcd.EtcdKeyNotFound:
+            return {}
+        return {child.key[len(self.stateroot):]: json.loads(child.value)
+                for child in states.children
+                if child.key != VOLUME_STATE_ROOT}
+
     def save_vol(self, vol):
         volkey = self.volumeroot + vol['id']
-        volval = json.dumps(vol)
+        schema_version = self._read_schema_version()
+        if schema_version >= VOLUME_SCHEMA_SPLIT_STATE:
+            vol['schema_version'] = schema_version
+        doc, state = self._vol_to_stored(vol)
+        volval = json.dumps(doc)
+        # The state is written before the document referring to it and the
+        # name index entries last. Stores with transactions write them all
+        # atomically. On the others, failing to write the name index
+        # entries must not fail the save of a volume that is stored already
+        items = []
+        if state is not None:
+            statekey = self._state_key(vol['id'])
+            items.append((statekey, json.dumps(state)))
+        doc_pos = len(items)
+        items.append((volkey, volval))
+        transactional = _supports_transactions(self.client)
+        if transactional:
+            items.append(self._names.item(vol['display_name'],
+                                          PERSONA_VOLUME, vol.get('backend'),
+                                          vol['id']))
         try:
-            self.client.write(volkey, volval)
+            results = self.client.write_many(items)
         except Exception as ex:
             msg = 'Failed to save volume to ETCD: %s'\
                   % six.text_type(ex)
@@ -428,86 +1459,479 @@ class EtcdUtil(object):
             raise exception.HPEPluginSaveFailed(obj=vol['display_name'])
         else:
             LOG.info('Write key: %s to etc, value is: %s', volkey, volval)
+        if not transactional:
+            self._names.add(vol['display_name'], PERSONA_VOLUME,
+                            vol.get('backend'), vol['id'])
+        result = results[doc_pos]
+        if state is not None:
+            state_result = results[0]
+        if self._mirror:
+            self._mirror.apply_write(volkey, doc, result.modifiedIndex)
+            if state is not None:
+                self._state_mirror.apply_write(statekey, state,
+                                               state_result.modifiedIndex)
 
     def update_vol(self, volid, key, val):
+        if key in VOLUME_STATE_FIELDS:
+            uow = VolumeUnitOfWork(self, self.get_vol_by_id(volid))
+            uow.update(key, val)
+            uow.commit()
+            return
+
         volkey = self.volumeroot + volid
         result = self.client.read(volkey)
         volval = json.loads(result.value)
         volval[key] = val
         volval = json.dumps(volval)
         result.value = volval
-        self.client.update(result)
+        result = self.client.update(result)
+        if self._mirror:
+            self._mirror.apply_write(volkey, json.loads(volval),
+                                     result.modifiedIndex)
 
         LOG.info(_LI('Update key: %s to etcd, value is: %s'), volkey, volval)
 
+    def update_vol_fields(self, vol, fields, make_changes):
+        """Write changes made to a volume with compare-and-swap
+
+        The document and the mount state of the volume are written only
+        if the changes modify them.
+
+        :param vol: Volume as read by this thread with changes applied
+        :param fields: Names of the fields the changes modify
+        :param make_changes: Makes the changes to a volume. Called on the
+            latest version of the volume if another writer modified it
+            since this thread read it
+        """
+        volkey = self.volumeroot + vol['id']
+        name = vol['display_name']
+        doc, state = self._vol_to_stored(vol)
+        if state is None:
+            def rebuild_vol(latest):
+                latest = self._vol_from_stored(latest, None)
+                make_changes(latest)
+                return self._vol_to_stored(latest)[0]
+
+            self._cas_update(volkey, doc, rebuild_vol, self._mirror, name)
+            return
+
+        if any(k not in VOLUME_STATE_FIELDS for k in fields):
+            def rebuild_doc(latest):
+                make_changes(latest)
+                return {k: v for k, v in latest.items()
+                        if k not in VOLUME_STATE_FIELDS}
+
+            self._cas_update(volkey, doc, rebuild_doc, self._mirror, name)
+
+        if any(k in VOLUME_STATE_FIELDS for k in fields):
+            def rebuild_state(latest):
+                latest = self._decode_state_fields(latest)
+                make_changes(latest)
+                return {k: v for k, v in latest.items()
+                        if k in VOLUME_STATE_FIELDS}
+
+            self._cas_update(self._state_key(vol['id']), state,
+                             rebuild_state, self._state_mirror, name,
+                             must_exist=False)
+
+    def _cas_update(self, key, val, rebuild, mirror, name,
+                    must_exist=True):
+        """Write val to key if unchanged since this thread read it
+
+        Otherwise rebuild(latest) returns the value to write in place of
+        the latest value of the key, which is {} if the key is absent.
+        """
+        prev_index = _get_read_indexes().get(key)
+        for attempt in range(VOL_CAS_RETRIES):
+            try:
+                if prev_index is None:
+                    try:
+                        result = self.client.read(key)
+                        latest = json.loads(result.value)
+                        prev_index = result.modifiedIndex
+                    except etcd.EtcdKeyNotFound:
+                        if must_exist:
+                            raise
+                        latest = {}
+                        prev_index = _KEY_ABSENT
+                    val = rebuild(latest)
+                data = json.dumps(val)
+                if prev_index == _KEY_ABSENT:
+                    result = self.client.write(key, data, prevExist=False)
+                else:
+                    result = self.client.write(key, data,
+                                               prevIndex=prev_index)
+            except (etcd.EtcdCompareFailed, etcd.EtcdAlreadyExist):
+                LOG.info('Key %s was modified concurrently. Making the '
+                         'changes again, attempt #%s...', key, attempt + 1)
+                prev_index = None
+            except etcd.EtcdKeyNotFound:
+                msg = 'Volume %s removed while it was being updated' % name
+                LOG.error(msg)
+                raise exception.HPEPluginSaveFailed(obj=name)
+            else:
+                LOG.info(_LI('Update key: %s to etcd, value is: %s'),
+                         key, data)
+                _get_read_indexes()[key] = result.modifiedIndex
+                if mirror:
+                    mirror.apply_write(key, val, result.modifiedIndex)
+                return
+
+        LOG.error('Failed to update key %s after %s attempts',
+                  key, VOL_CAS_RETRIES)
+        raise exception.HPEPluginSaveFailed(obj=name)
+
     def delete_vol(self, vol):
         volkey = self.volumeroot + vol['id']
 
-        self.client.delete(volkey)
+        result = self.client.delete(volkey)
+        # Removed only once the volume is gone, so that a volume whose
+        # delete failed is still found by its name. Lookups skip the
+        # entries left over by a failed removal
+        self._names.remove(vol['display_name'], PERSONA_VOLUME, vol['id'])
+        if self._mirror:
+            self._mirror.apply_delete(volkey, result.modifiedIndex)
         LOG.info(_LI('Deleted key: %s from etcd'), volkey)
 
+        if self._is_split(vol):
+            statekey = self._state_key(vol['id'])
+            try:
+                result = self.client.delete(statekey)
+            except etcd.EtcdKeyNotFound:
+                return
+            if self._state_mirror:
+                self._state_mirror.apply_delete(statekey,
+                                                result.modifiedIndex)
+
+    def complete_name_index(self):
+        """Index all volumes and shares and mark the index complete
+
+        A name missing in a complete index is known not to exist, without
+        looking for it in the trees. Must only be run once no older plugin
+        version uses the cluster.
+
+        :return: Number of objects indexed and number of objects
+        """
+        return self._names.complete()
+
+    def migrate_volume_schema(self):
+        """Upgrade all volumes to the current schema version in place
+
+        Each volume is migrated under its volume lock. The new schema
+        version is recorded first, so that running plugin instances create
+        volumes with it from their next save on. The volumes are listed
+        again until none of the old version is left, to catch those
+        created while the version was being recorded. Must only be run
+        once no older plugin version uses the cluster.
+
+        :return: Number of volumes migrated
+        """
+        self.client.write(VOLUME_SCHEMA_KEY,
+                          str(VOLUME_SCHEMA_SPLIT_STATE))
+        self._schema_version = VOLUME_SCHEMA_SPLIT_STATE
+        migrated = 0
+        while True:
+            migrated_now = self._migrate_vols()
+            if not migrated_now:
+                break
+            migrated += migrated_now
+        LOG.info('Migrated %s volumes to schema version %s', migrated,
+                 VOLUME_SCHEMA_SPLIT_STATE)
+        return migrated
+
+    def _migrate_vols(self):
+        migrated = 0
+        volumes = self.client.read(self.volumeroot, recursive=True)
+        for volinfo in volumes.children:
+            if volinfo.key == VOLUMEROOT:
+                continue
+            doc = json.loads(volinfo.value)
+            if self._is_split(doc):
+                continue
+            with self.get_lock('VOL', doc['display_name']):
+                if self._migrate_vol(doc['id']):
+                    migrated += 1
+        return migrated
+
+    def _migrate_vol(self, volid):
+        volkey = self.volumeroot + volid
+        try:
+            result = self.client.read(volkey)
+        except etcd.EtcdKeyNotFound:
+            # Removed since the listing
+            return False
+        vol = self._vol_from_stored(json.loads(result.value), None)
+        if self._is_split(vol):
+            return False
+        vol['schema_version'] = VOLUME_SCHEMA_SPLIT_STATE
+        doc, state = self._vol_to_stored(vol)
+        # The state goes first so that whoever sees the new document
+        # finds it
+        self.client.write(self._state_key(volid), json.dumps(state))
+        self.client.write(volkey, json.dumps(doc),
+                          prevIndex=result.modifiedIndex)
+        LOG.info('Migrated volume %s to schema version %s',
+                 vol['display_name'], VOLUME_SCHEMA_SPLIT_STATE)
+        return True
+
     def get_lock(self, lock_type, lock_name):
         # By default this is volume lock-root
         lock_root = LOCKROOT
         if lock_type == 'RCG':
             lock_root = RCG_LOCKROOT
-        return EtcdLock(lock_root + '/', self.client, name=lock_name)
+        return EtcdLock(lock_root + '/', self.client, name=lock_name,
+                        wait_timeout=_lock_wait_timeout(
+                            self._lock_wait_timeouts, lock_type),
+                        max_hold_time=_lock_max_hold_time(
+                            self._lock_max_hold_times, lock_type))
+
+    def lookup_name(self, name):
+        return self._names.lookup(name)
+
+    def add_name(self, name, persona, backend, obj_id):
+        return self._names.add(name, persona, backend, obj_id)
+
+    def name_index_complete(self):
+        return self._names.is_complete()
 
     def get_vol_byname(self, volname):
-        volumes = self.client.read(self.volumeroot, recursive=True)
         LOG.info(_LI('Get volbyname: volname is %s'), volname)
+        if self._use_mirror():
+            vol = self._mirror.get_by_field(volname)
+            if vol is None:
+                # 'name' of a volume is the same as its ID
+                vol = self._mirror.get(self.volumeroot + volname)
+            return self._with_state(vol) if vol else None
+
+        vol = self._get_vol_from_name_index(volname)
+        if vol:
+            return vol
+
+        if self._names.is_complete():
+            # Not in the index means there is no volume of that name.
+            # It may still be the ID of one
+            try:
+                return self.get_vol_by_id(volname)
+            except etcd.EtcdKeyNotFound:
+                return None
+
+        vol = self._scan_vol_byname(volname)
+        if vol and vol['display_name'] == volname:
+            LOG.info('Volume %s missing in name index. Adding it...',
+                     volname)
+            self._names.add(volname, PERSONA_VOLUME, vol.get('backend'),
+                            vol['id'])
+        return vol
+
+    def _get_vol_from_name_index(self, volname):
+        entry = self._names.lookup(volname)
+        if not entry or entry['persona'] != PERSONA_VOLUME:
+            return None
+        try:
+            vol = self.get_vol_by_id(entry['id'])
+        except etcd.EtcdKeyNotFound:
+            return None
+
+        # Guard against a stale entry left behind by a crash between
+        # the index update and the volume update
+        if vol.get('display_name') != volname:
+            LOG.info('Stale name index entry found for volume %s', volname)
+            return None
+        return vol
 
+    def _scan_vol_byname(self, volname):
+        volumes = self._read(self.volumeroot, recursive=True)
         for child in volumes.children:
             if child.key != VOLUMEROOT:
                 volmember = json.loads(child.value)
                 vol = volmember['display_name']
                 if vol.startswith(volname, 0, len(volname)):
                     if volmember['display_name'] == volname:
-                        return volmember
+                        return self._with_state(volmember)
                 elif volmember['name'] == volname:
-                    return volmember
+                    return self._with_state(volmember)
         return None
 
     def get_vol_by_id(self, volid):
         volkey = self.volumeroot + volid
-        result = self.client.read(volkey)
-        return json.loads(result.value)
+        if self._use_mirror():
+            vol = self._mirror.get(volkey)
+            if vol is None:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % volkey)
+            return self._with_state(vol)
+        result = self._read(volkey)
+        vol = json.loads(result.value)
+        _get_read_indexes()[volkey] = result.modifiedIndex
+        return self._with_state(vol)
 
     def get_all_vols(self):
-        ret_vol_list = []
-        volumes = self.client.read(self.volumeroot, recursive=True)
+        return list(self.iter_vols())
+
+    def iter_vols(self):
+        """Yield all volumes, decoding each one only when it is reached"""
+        if self._use_mirror():
+            for vol in self._mirror.iter_all():
+                yield self._with_state(vol)
+            return
+        volumes = self._read(self.volumeroot, recursive=True)
+        states = None
         for volinfo in volumes.children:
             if volinfo.key != VOLUMEROOT:
                 vol = json.loads(volinfo.value)
-                ret_vol_list.append(vol)
-        return ret_vol_list
+                state = None
+                if self._is_split(vol):
+                    # Mount state of all volumes is read with one request
+                    if states is None:
+                        states = self._read_all_states()
+                    state = states.get(vol['id'])
+                yield self._vol_from_stored(vol, state)
 
     def get_vol_path_info(self, volname):
         vol = self.get_vol_byname(volname)
         if vol:
             if 'path_info' in vol and vol['path_info'] is not None:
-                path_info = json.loads(vol['path_info'])
+                path_info = load_path_info(vol['path_info'])
                 return path_info
         return None
 
     def get_path_info_from_vol(self, vol):
         if vol:
             if 'path_info' in vol and vol['path_info'] is not None:
-                return json.loads(vol['path_info'])
+                return load_path_info(vol['path_info'])
         return None
 
     def get_backend_key(self, backend):
         passphrase = self.backendroot + backend
-        result = self.client.read(passphrase)
+        result = self._read(passphrase)
         return result.value
 
+    def get_member_health(self):
+        return get_member_health(self.client)
+
+
+class _LocalLocks(object):
+    """In-process locks by name, dropped once nobody holds or waits"""
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, name, timeout):
+        with self._guard:
+            entry = self._locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(timeout=timeout):
+            return True
+        self._unref(name)
+        return False
+
+    def release(self, name):
+        with self._guard:
+            lock = self._locks[name][0]
+        lock.release()
+        self._unref(name)
+
+    def _unref(self, name):
+        with self._guard:
+            entry = self._locks[name]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[name]
+
+
+_local_locks = _LocalLocks()
+
+
+class _LockHeartbeat(object):
+    """Refreshes the etcd locks this process holds or waits for
+
+    A lock hence expires LOCK_TTL seconds after its holder died instead
+    of blocking the other nodes until a long TTL ran out. A lock may be
+    refreshed only until a deadline, so that it also expires when its
+    holder is stuck.
+    """
+    def __init__(self):
+        # lock -> time after which it is no longer refreshed, None for
+        # none
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._thread = None
+
+    def add(self, lock, deadline=None):
+        """Refreshes lock until deadline, replacing any previous one"""
+        with self._guard:
+            self._locks[lock] = deadline
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='etcd-lock-heartbeat')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def remove(self, lock):
+        with self._guard:
+            self._locks.pop(lock, None)
+
+    def _run(self):
+        while True:
+            time.sleep(LOCK_HEARTBEAT_INTERVAL)
+            self._refresh_all()
+
+    def _refresh_all(self):
+        now = time.time()
+        with self._guard:
+            locks = list(self._locks.items())
+        for lock, deadline in locks:
+            if deadline is not None and now > deadline:
+                LOG.error('Lock %s is still held or waited for past its '
+                          'deadline. Its holder seems to be stuck. No '
+                          'longer refreshing it, so that it expires in %s '
+                          'seconds and other nodes can take it',
+                          lock.name, LOCK_TTL)
+                with self._guard:
+                    # Unless given a new deadline in the meantime
+                    if self._locks.get(lock) == deadline:
+                        del self._locks[lock]
+                continue
+            try:
+                lock.refresh(LOCK_TTL)
+            except Exception as ex:
+                LOG.warning('Failed to refresh lock %s: %s',
+                            lock.name, six.text_type(ex))
+
+
+_lock_heartbeat = _LockHeartbeat()
+
+
+def _lock_wait_timeout(lock_wait_timeouts, lock_type):
+    return int((lock_wait_timeouts or {}).get(lock_type, LOCK_WAIT_TIMEOUT))
+
+
+def _lock_max_hold_time(lock_max_hold_times, lock_type):
+    """Seconds a lock of the type may be held, None for no limit"""
+    max_hold_time = int((lock_max_hold_times or {}).get(
+        lock_type, LOCK_MAX_HOLD_TIMES.get(lock_type, 0)))
+    # 0 stands for no limit
+    return max_hold_time or None
+
 
 class EtcdLock(object):
-    def __init__(self, lock_root, client, name):
+    """Lock of a name shared by all the plugin instances
+
+    Requests of this node for the same name first queue up on an
+    in-process lock, and only its holder goes on to take the etcd lock.
+    Contention between local requests hence costs no etcd round trips.
+    The etcd lock has a short TTL and is refreshed by the lock heartbeat
+    while it is waited for and while it is held, up to max_hold_time
+    seconds if given.
+    """
+    def __init__(self, lock_root, client, name,
+                 wait_timeout=LOCK_WAIT_TIMEOUT, max_hold_time=None):
         self._lock_root = lock_root
         self._client = client
         self._name = name
-        self._lock = etcd.Lock(client, name)
+        self._wait_timeout = wait_timeout
+        self._max_hold_time = max_hold_time
+        self._lock = client.get_lock(name)
+        self._locally_held = False
 
     def __enter__(self):
         if self._name:
@@ -519,17 +1943,58 @@ class EtcdLock(object):
 
     def try_lock_name(self):
         LOG.debug("Try locking name %s", self._name)
-        self._lock.acquire(lock_ttl=300, timeout=300)
-        if self._lock.is_acquired:
+        deadline = time.time() + self._wait_timeout
+        # Keyed by name only, like the etcd lock itself
+        if _local_locks.acquire(self._name, self._wait_timeout):
+            self._locally_held = True
+            # Also a queued etcd lock must not expire while waiting
+            _lock_heartbeat.add(self._lock, deadline)
+            try:
+                # A timeout of 0 would wait forever
+                self._lock.acquire(
+                    lock_ttl=LOCK_TTL,
+                    timeout=max(int(deadline - time.time()), 1))
+                acquired = self._lock.is_acquired
+            except Exception:
+                self._abandon()
+                raise
+            if not acquired:
+                self._abandon()
+            elif self._max_hold_time:
+                _lock_heartbeat.add(self._lock,
+                                    time.time() + self._max_hold_time)
+            else:
+                # Kept alive until released
+                _lock_heartbeat.add(self._lock)
+        if self._locally_held:
             LOG.debug("Name is locked : %s", self._name)
         else:
             msg = 'Failed to acquire lock: %(name)s' % {'name': self._name}
             LOG.error(msg)
             raise exception.HPEPluginLockFailed(obj=self._name)
 
+    def _release_local(self):
+        if self._locally_held:
+            self._locally_held = False
+            _local_locks.release(self._name)
+
+    def _abandon(self):
+        _lock_heartbeat.remove(self._lock)
+        try:
+            # Leave the etcd queue rather than block it until the TTL
+            self._lock.release()
+        except Exception as ex:
+            LOG.warning('Failed to leave the queue of lock %s: %s',
+                        self._name, six.text_type(ex))
+        self._release_local()
+
     def try_unlock_name(self):
         LOG.debug("Try unlocking name %s", self._name)
-        self._lock.release()
+        _lock_heartbeat.remove(self._lock)
+        try:
+            self._lock.release()
+        finally:
+            self._release_local()
         if not self._lock.is_acquired:
             LOG.debug("Name is unlocked : %s", self._name)
         else:
@@ -441,3 +441,8 @@ class HPEDriverNonExistentCpg(HPEDriverException):
 
 class FpgCapacityInsufficient(PluginException):
     message = _("FPG %(fpg)s does not have enough capacity")
+
+
+class AdmissionRejected(PluginException):
+    message = _("Too many %(operation)s requests queued for backend "
+                "%(backend)s. Retry later")
@@ -1,9 +1,11 @@
 import json
 from oslo_log import log as logging
+from twisted.internet import reactor
 
 from hpedockerplugin.backend_orchestrator import Orchestrator
 import hpedockerplugin.etcdutil as util
 import hpedockerplugin.file_manager as fmgr
+import hpedockerplugin.worker_pool as worker_pool
 
 LOG = logging.getLogger(__name__)
 
@@ -11,6 +13,7 @@ LOG = logging.getLogger(__name__)
 class FileBackendOrchestrator(Orchestrator):
 
     fp_etcd_client = None
+    background_pool = None
 
     def __init__(self, host_config, backend_configs, def_backend_name):
         super(FileBackendOrchestrator, self).__init__(
@@ -22,13 +25,25 @@ class FileBackendOrchestrator(Orchestrator):
             host_config.host_etcd_ip_address,
             host_config.host_etcd_port_number,
             host_config.host_etcd_client_cert,
-            host_config.host_etcd_client_key
+            host_config.host_etcd_client_key,
+            pool_size=host_config.host_etcd_pool_size,
+            read_policy=host_config.host_etcd_read_policy,
+            hedge_percentile=host_config.host_etcd_hedge_percentile,
+            store=host_config.host_metadata_store,
+            store_path=host_config.host_metadata_store_path,
+            lock_wait_timeouts=host_config.host_lock_wait_timeouts,
+            lock_max_hold_times=host_config.host_lock_max_hold_times
         )
 
     def _initialize_orchestrator(self, host_config):
         FileBackendOrchestrator.fp_etcd_client = self._get_fp_etcd_client(
             host_config
         )
+        # Share creation outlives the request. It runs apart from the
+        # backend pools so that it never holds up mounts and unmounts
+        FileBackendOrchestrator.background_pool = worker_pool.WorkerPool(
+            reactor, 'hpe-file-background',
+            host_config.host_file_background_threads)
 
     # Implementation of abstract function from base class
     def get_manager(self, host_config, config, etcd_client,
@@ -36,7 +51,8 @@ class FileBackendOrchestrator(Orchestrator):
         LOG.info("Getting file manager...")
         return fmgr.FileManager(host_config, config, etcd_client,
                                 FileBackendOrchestrator.fp_etcd_client,
-                                node_id, backend_name)
+                                node_id, backend_name,
+                                FileBackendOrchestrator.background_pool)
 
     # Implementation of abstract function from base class
     def _get_etcd_client(self, host_config):
@@ -45,7 +61,15 @@ class FileBackendOrchestrator(Orchestrator):
             host_config.host_etcd_ip_address,
             host_config.host_etcd_port_number,
             host_config.host_etcd_client_cert,
-            host_config.host_etcd_client_key)
+            host_config.host_etcd_client_key,
+            mirror=host_config.host_etcd_local_mirror,
+            pool_size=host_config.host_etcd_pool_size,
+            read_policy=host_config.host_etcd_read_policy,
+            hedge_percentile=host_config.host_etcd_hedge_percentile,
+            store=host_config.host_metadata_store,
+            store_path=host_config.host_metadata_store_path,
+            lock_wait_timeouts=host_config.host_lock_wait_timeouts,
+            lock_max_hold_times=host_config.host_lock_max_hold_times)
 
     def get_meta_data_by_name(self, name):
         LOG.info("Fetching share details from ETCD: %s" % name)
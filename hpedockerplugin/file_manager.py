@@ -3,7 +3,6 @@ import json
 import sh
 import six
 import os
-from threading import Thread
 
 from oslo_log import log as logging
 from oslo_utils import netutils
@@ -31,8 +30,9 @@ LOG = logging.getLogger(__name__)
 
 class FileManager(object):
     def __init__(self, host_config, hpepluginconfig, etcd_util,
-                 fp_etcd_client, node_id, backend_name):
+                 fp_etcd_client, node_id, backend_name, background_pool):
         self._host_config = host_config
+        self._background_pool = background_pool
         self._hpepluginconfig = hpepluginconfig
 
         self._etcd = etcd_util
@@ -120,11 +120,9 @@ class FileManager(object):
     def create_share(self, share_name, **args):
         share_args = copy.deepcopy(args)
         # ====== TODO: Uncomment later ===============
-        thread = Thread(target=self._create_share,
-                        args=(share_name, share_args))
-
-        # Process share creation on child thread
-        thread.start()
+        # Process share creation on a background thread
+        self._background_pool.submit(self._create_share, share_name,
+                                     share_args)
         # ====== TODO: Uncomment later ===============
 
         # ======= TODO: Remove this later ========
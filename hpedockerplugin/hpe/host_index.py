@@ -0,0 +1,133 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Index of the 3PAR hosts of a backend by the WWNs and IQNs of their paths.
+
+Finding the host of an initiator used to read every host of the array and
+scan their paths. The index is built from one read of all the hosts and
+then kept up to date with the hosts the driver creates, modifies and
+deletes. It is read again after a refresh interval to take in the hosts
+changed by others, such as an initiator moved to another host. An
+initiator missing from the index is looked up with a query for it alone,
+as the host may have been created elsewhere.
+"""
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = 300
+
+
+def _wwn_key(wwn):
+    return 'wwn', wwn.replace(':', '').lower()
+
+
+def _iqn_key(iqn):
+    return 'iqn', iqn.lower()
+
+
+def _as_list(names):
+    if names is None:
+        return []
+    if not isinstance(names, list):
+        return [names]
+    return names
+
+
+class HostIndex(object):
+    def __init__(self, name, refresh_interval=None, clock=time.monotonic):
+        self._name = name
+        self._refresh_interval = refresh_interval or DEFAULT_REFRESH_INTERVAL
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (kind, normalized initiator) -> host name. None until built
+        self._hosts = None
+        self._loaded_at = None
+
+    def find_host(self, wwns, iqns, get_hosts, query_host):
+        """Returns the name of the host of any of the initiators or None
+
+        :param get_hosts: Returns all the hosts of the array
+        :param query_host: Returns the hosts with any of the given WWNs
+            or IQNs
+        """
+        wwns = _as_list(wwns)
+        iqns = _as_list(iqns)
+        self._build_if_stale(get_hosts)
+        hostname = self._lookup(wwns, iqns)
+        if hostname is None:
+            LOG.debug('Initiators %s not indexed, querying array %s'
+                      % (iqns + wwns, self._name))
+            hosts = query_host(wwns=wwns or None, iqns=iqns or None)
+            for host in (hosts or {}).get('members', []):
+                self._add_host(host)
+            hostname = self._lookup(wwns, iqns)
+        return hostname
+
+    def _build_if_stale(self, get_hosts):
+        with self._lock:
+            if (self._loaded_at is not None and
+                    self._clock() - self._loaded_at < self._refresh_interval):
+                return
+        index = {}
+        for host in get_hosts().get('members', []):
+            index.update(self._host_keys(host))
+        with self._lock:
+            self._hosts = index
+            self._loaded_at = self._clock()
+        LOG.info('Indexed %s host paths of array %s'
+                 % (len(index), self._name))
+
+    @staticmethod
+    def _host_keys(host):
+        keys = {}
+        for path in host.get('iSCSIPaths', []):
+            if path.get('name'):
+                keys[_iqn_key(path['name'])] = host['name']
+        for path in host.get('FCPaths', []):
+            if path.get('wwn'):
+                keys[_wwn_key(path['wwn'])] = host['name']
+        return keys
+
+    def _lookup(self, wwns, iqns):
+        keys = [_iqn_key(iqn) for iqn in iqns] + \
+            [_wwn_key(wwn) for wwn in wwns]
+        with self._lock:
+            for key in keys:
+                hostname = (self._hosts or {}).get(key)
+                if hostname is not None:
+                    return hostname
+        return None
+
+    def _add_host(self, host):
+        with self._lock:
+            if self._hosts is not None:
+                self._hosts.update(self._host_keys(host))
+
+    def add_paths(self, hostname, wwns=None, iqns=None):
+        """Indexes the initiators added to a host"""
+        self._add_host({'name': hostname,
+                        'FCPaths': [{'wwn': wwn} for wwn in _as_list(wwns)],
+                        'iSCSIPaths': [{'name': iqn}
+                                       for iqn in _as_list(iqns)]})
+
+    def remove_host(self, hostname):
+        with self._lock:
+            if self._hosts is not None:
+                self._hosts = {k: v for k, v in self._hosts.items()
+                               if v != hostname}
@@ -52,6 +52,55 @@ hpe3par_opts = [
     cfg.IntOpt('hpe3par_default_fpg_size',
                default=16,
                help='FPG size in TiB'),
+    cfg.IntOpt('hpe3par_worker_threads',
+               default=10,
+               help='Threads running the requests for this backend. An '
+                    'unresponsive array only ties up the threads of its '
+                    'own backend.'),
+    cfg.BoolOpt('hpe3par_get_volume_detail',
+                default=False,
+                help='Answer VolumeDriver.Get with the QoS, flash cache, '
+                     'domain and RCG details read from the array and sync '
+                     'the snapshots with it. By default only the metadata '
+                     'is returned.'),
+    cfg.IntOpt('hpe3par_max_sessions',
+               default=4,
+               help='WSAPI sessions the plugin keeps open to the array. '
+                    'Calls beyond it wait for a session to be free. The '
+                    'array limits the sessions a user may have open.'),
+    cfg.IntOpt('hpe3par_session_idle_timeout',
+               default=600,
+               help='Seconds after which an unused WSAPI session is logged '
+                    'out.'),
+    cfg.IntOpt('hpe3par_max_ssh_sessions',
+               default=2,
+               help='SSH connections to the array CLI the plugin keeps '
+                    'open. Commands beyond it wait for a connection to be '
+                    'free.'),
+    cfg.IntOpt('hpe3par_ssh_idle_timeout',
+               default=300,
+               help='Seconds after which an unused SSH connection is '
+                    'closed.'),
+    cfg.IntOpt('hpe3par_ssh_keepalive_interval',
+               default=30,
+               help='Seconds between the keepalives sent over an open SSH '
+                    'connection.'),
+    cfg.DictOpt('hpe3par_inventory_cache_ttl',
+                default={},
+                help='Seconds the ports, CPGs, hosts, storage system info '
+                     'and WSAPI version read from the array are kept, by '
+                     'kind. E.g. ports:60,cpg:300,host:30,system_info:3600,'
+                     'wsapi_version:3600. 0 disables caching of a kind.'),
+    cfg.IntOpt('hpe3par_vlun_refresh_interval',
+               default=600,
+               help='Seconds after which the active VLUNs by iSCSI port, '
+                    'used to pick the least used port, are read again from '
+                    'the array to take in the VLUNs changed by others.'),
+    cfg.IntOpt('hpe3par_host_index_refresh_interval',
+               default=300,
+               help='Seconds after which the hosts, used to find the host '
+                    'of an initiator, are read again from the array to '
+                    'take in the hosts changed by others.'),
     cfg.MultiOpt('hpe3par_server_ip_pool',
                  item_type=ip_pool.VfsIpPool(),
                  help='Target server IP pool'),
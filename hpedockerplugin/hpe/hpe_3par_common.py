@@ -23,6 +23,8 @@ from oslo_log import log as logging
 from oslo_utils import units
 
 from hpedockerplugin import exception
+from hpedockerplugin.hpe import host_index
+from hpedockerplugin.hpe import inventory_cache
 from hpedockerplugin.hpe import utils
 from hpedockerplugin.i18n import _, _LE, _LI, _LW
 
@@ -106,11 +108,17 @@ class HPE3PARCommon(object):
     hpe3par_valid_keys = ['cpg', 'snap_cpg', 'provisioning', 'persona', 'vvs',
                           'flash_cache']
 
-    def __init__(self, host_config, src_bkend_config, tgt_bkend_config=None):
+    def __init__(self, host_config, src_bkend_config, tgt_bkend_config=None,
+                 ssh_pool=None, inventory=None, host_index=None,
+                 nsp_tracker=None):
         self._host_config = host_config
         self.src_bkend_config = src_bkend_config
         self.tgt_bkend_config = tgt_bkend_config
         self.client = None
+        self._ssh_pool = ssh_pool
+        self._inventory = inventory
+        self._host_index = host_index
+        self._nsp_tracker = nsp_tracker
         self.uuid = uuid.uuid4()
 
     def get_version(self):
@@ -165,12 +173,15 @@ class HPE3PARCommon(object):
             LOG.error(msg)
             raise exception.InvalidInput(reason=msg)
 
+        self._set_ssh_options(self.client)
+
+    def _set_ssh_options(self, cl):
         known_hosts_file = self._host_config.ssh_hosts_key_file
 
         policy = "AutoAddPolicy"
         if self._host_config.strict_ssh_host_key_policy:
             policy = "RejectPolicy"
-        self.client.setSSHOptions(
+        cl.setSSHOptions(
             self.src_bkend_config.san_ip,
             self.src_bkend_config.san_login,
             self.src_bkend_config.san_password,
@@ -184,6 +195,29 @@ class HPE3PARCommon(object):
         LOG.debug("Disconnect from 3PAR REST and SSH %s", self.uuid)
         self.client.logout()
 
+    def create_cli_client(self):
+        """Returns a client for running CLI commands over SSH"""
+        cl = self._create_client()
+        self._set_ssh_options(cl)
+        return cl
+
+    def _run_cli(self, cmd):
+        if self._ssh_pool is None:
+            return self.client._run(cmd)
+        return self._ssh_pool.run(cmd)
+
+    def _get_inventory(self, kind, key, load):
+        if self._inventory is None:
+            return load()
+        return self._inventory.get(kind, key, load)
+
+    def _host_changed(self, hostname, wwns=None, iqns=None):
+        """Drops the cached host and indexes the initiators added to it"""
+        if self._inventory is not None:
+            self._inventory.invalidate(inventory_cache.HOST, hostname)
+        if self._host_index is not None and (wwns or iqns):
+            self._host_index.add_paths(hostname, wwns=wwns, iqns=iqns)
+
     def do_setup(self, timeout=TIME_OUT):
         if hpe3parclient is None:
             msg = _('You must install hpe3parclient before using 3PAR'
@@ -192,7 +226,9 @@ class HPE3PARCommon(object):
             raise exception.VolumeBackendAPIException(data=msg)
         try:
             self.client = self._create_client(timeout=timeout)
-            wsapi_version = self.client.getWsApiVersion()
+            wsapi_version = self._get_inventory(
+                inventory_cache.WSAPI_VERSION, None,
+                self.client.getWsApiVersion)
             self.API_VERSION = wsapi_version['build']
         except hpeexceptions.UnsupportedVersion as ex:
             raise exception.InvalidInput(ex)
@@ -217,15 +253,19 @@ class HPE3PARCommon(object):
 
     def validate_cpg(self, cpg_name):
         try:
-            self.client.getCPG(cpg_name)
+            self._get_cpg(cpg_name)
         except hpeexceptions.HTTPNotFound:
             err = (_("CPG (%s) doesn't exist on array") % cpg_name)
             LOG.error(err)
             raise exception.InvalidInput(reason=err)
 
+    def _get_cpg(self, cpg_name):
+        return self._get_inventory(inventory_cache.CPG, cpg_name,
+                                   lambda: self.client.getCPG(cpg_name))
+
     def get_domain(self, cpg_name):
         try:
-            cpg = self.client.getCPG(cpg_name)
+            cpg = self._get_cpg(cpg_name)
         except hpeexceptions.HTTPNotFound:
             err = (_("Failed to get domain because CPG (%s) doesn't "
                      "exist on array.") % cpg_name)
@@ -248,6 +288,9 @@ class HPE3PARCommon(object):
 
     def _delete_3par_host(self, hostname):
         self.client.deleteHost(hostname)
+        self._host_changed(hostname)
+        if self._host_index is not None:
+            self._host_index.remove_host(hostname)
 
     def _create_3par_vlun(self, volume, hostname, nsp, lun_id=None):
         try:
@@ -265,6 +308,8 @@ class HPE3PARCommon(object):
                 location = self.client.createVLUN(volume, hostname=hostname,
                                                   auto=auto, portPos=port,
                                                   lun=lun_id)
+            if self._nsp_tracker is not None:
+                self._nsp_tracker.vlun_created(hostname, nsp)
 
             vlun_info = None
             if location:
@@ -299,10 +344,12 @@ class HPE3PARCommon(object):
         return hostname[:index]
 
     def _get_3par_host(self, hostname):
-        return self.client.getHost(hostname)
+        return self._get_inventory(inventory_cache.HOST, hostname,
+                                   lambda: self.client.getHost(hostname))
 
     def get_ports(self):
-        return self.client.getPorts()
+        return self._get_inventory(inventory_cache.PORTS, None,
+                                   self.client.getPorts)
 
     def get_qos_detail(self, vvset):
         try:
@@ -469,7 +516,7 @@ class HPE3PARCommon(object):
         err_resp = ""
         try:
             LOG.info("Creating a snapshot schedule, command is %s..." % cmd)
-            resp = self.client._run(cmd)
+            resp = self._run_cli(cmd)
             LOG.info("Created a snapshot schedule - command is: %s..." % cmd)
             LOG.info("Create schedule response is: %s..." % resp)
 
@@ -489,7 +536,7 @@ class HPE3PARCommon(object):
         err_resp = ""
         try:
             LOG.info("Removing a snapshot schedule, command is %s..." % cmd)
-            resp = self.client._run(cmd)
+            resp = self._run_cli(cmd)
             LOG.info("Removed a snapshot schedule - command is: %s..." % cmd)
             LOG.info("Remove schedule response is: %s..." % resp)
 
@@ -542,7 +589,10 @@ class HPE3PARCommon(object):
                     cmd.append('\r')
                     try:
                         LOG.info("Removing VLUN forcibly - Cmd: %s..." % cmd)
-                        resp = self.client._run(cmd)
+                        resp = self._run_cli(cmd)
+                        if self._nsp_tracker is not None:
+                            self._nsp_tracker.vlun_deleted(
+                                hostname, self.build_nsp(port_pos))
                         LOG.info("Removed VLUN forcibly - Cmd: %s..." % cmd)
                         LOG.info("Removed VLUN - Cmd Response: %s..." % resp)
                     except hpeexceptions.SSHException as ex:
@@ -592,6 +642,11 @@ class HPE3PARCommon(object):
             else:
                 self.client.deleteVLUN(volume_name, vlun['lun'],
                                        hostname=hostname)
+            if self._nsp_tracker is not None:
+                nsp = None
+                if 'portPos' in vlun:
+                    nsp = self.build_nsp(vlun['portPos'])
+                self._nsp_tracker.vlun_deleted(hostname, nsp)
 
         # Determine if there are other volumes attached to the host.
         # This will determine whether we should try removing host from host set
@@ -694,7 +749,8 @@ class HPE3PARCommon(object):
 
     def get_compression_policy(self, compression_val):
         compression_support = False
-        info = self.client.getStorageSystemInfo()
+        info = self._get_inventory(inventory_cache.SYSTEM_INFO, None,
+                                   self.client.getStorageSystemInfo)
         if 'licenseInfo' in info:
             if 'licenses' in info['licenseInfo']:
                 valid_licenses = info['licenseInfo']['licenses']
@@ -1049,27 +1105,10 @@ class HPE3PARCommon(object):
                          {'rcg_name': rcg_name})
 
     def _get_3par_hostname_from_wwn_iqn(self, wwns, iqns):
-        if wwns is not None and not isinstance(wwns, list):
-            wwns = [wwns]
-        if iqns is not None and not isinstance(iqns, list):
-            iqns = [iqns]
-
-        out = self.client.getHosts()
-        hosts = out['members']
-        for host in hosts:
-            if 'iSCSIPaths' in host and iqns is not None:
-                iscsi_paths = host['iSCSIPaths']
-                for iscsi in iscsi_paths:
-                    for iqn in iqns:
-                        if iqn == iscsi['name']:
-                            return host['name']
-
-            if 'FCPaths' in host and wwns is not None:
-                fc_paths = host['FCPaths']
-                for fc in fc_paths:
-                    for wwn in wwns:
-                        if wwn == fc['wwn']:
-                            return host['name']
+        index = self._host_index or host_index.HostIndex(
+            self.src_bkend_config.hpe3par_api_url)
+        return index.find_host(wwns, iqns, self.client.getHosts,
+                               self.client.queryHost)
 
     def terminate_connection(self, volume, hostname, is_snap, wwn=None,
                              iqn=None):
@@ -38,6 +38,9 @@ from hpedockerplugin import exception
 # from hpedockerplugin.i18n import _, _LI, _LW, _LE
 from hpedockerplugin.i18n import _, _LE
 from hpedockerplugin.hpe import hpe_3par_common as hpecommon
+from hpedockerplugin.hpe import host_index
+from hpedockerplugin.hpe import inventory_cache
+from hpedockerplugin.hpe import session_pool
 from oslo_utils.excutils import save_and_reraise_exception
 
 LOG = logging.getLogger(__name__)
@@ -63,21 +66,50 @@ class HPE3PARFCDriver(object):
         # Get source and target backend configs as separate dictionaries
         self.src_bkend_config = src_bkend_config
         self.tgt_bkend_config = tgt_bkend_config
+        self._session_pool = session_pool.SessionPool(
+            src_bkend_config.hpe3par_api_url, self._new_session,
+            max_sessions=getattr(src_bkend_config, 'hpe3par_max_sessions',
+                                 None),
+            idle_timeout=getattr(src_bkend_config,
+                                 'hpe3par_session_idle_timeout', None))
+        self._ssh_pool = session_pool.SSHClientPool(
+            src_bkend_config.san_ip, self._new_cli_client,
+            max_sessions=getattr(src_bkend_config,
+                                 'hpe3par_max_ssh_sessions', None),
+            idle_timeout=getattr(src_bkend_config,
+                                 'hpe3par_ssh_idle_timeout', None),
+            keepalive=getattr(src_bkend_config,
+                              'hpe3par_ssh_keepalive_interval', None))
+        self._inventory = inventory_cache.InventoryCache(
+            src_bkend_config.hpe3par_api_url,
+            ttls=getattr(src_bkend_config, 'hpe3par_inventory_cache_ttl',
+                         None))
+        self._host_index = host_index.HostIndex(
+            src_bkend_config.hpe3par_api_url,
+            refresh_interval=getattr(src_bkend_config,
+                                     'hpe3par_host_index_refresh_interval',
+                                     None))
+
+    def get_inventory_cache_stats(self):
+        return self._inventory.stats()
 
     def _init_common(self):
         return hpecommon.HPE3PARCommon(self._host_config,
                                        self.src_bkend_config,
-                                       self.tgt_bkend_config)
+                                       self.tgt_bkend_config,
+                                       ssh_pool=self._ssh_pool,
+                                       inventory=self._inventory,
+                                       host_index=self._host_index)
 
-    def _login(self):
+    def _new_cli_client(self):
+        return self._init_common().create_cli_client()
+
+    def _new_session(self):
         common = self._init_common()
         common.do_setup()
         common.client_login()
         return common
 
-    def _logout(self, common):
-        common.client_logout()
-
     def _check_flags(self, common):
         required_flags = ['hpe3par_api_url', 'hpe3par_username',
                           'hpe3par_password', 'san_ip', 'san_login',
@@ -95,32 +127,20 @@ class HPE3PARFCDriver(object):
         pass
 
     def create_volume(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_volume(volume)
-        finally:
-            self._logout(common)
 
     def delete_volume(self, volume, is_snapshot=False):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             common.delete_volume(volume, is_snapshot)
-        finally:
-            self._logout(common)
 
     def get_snapcpg(self, volume, is_snap):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_snapcpg(volume, is_snap)
-        finally:
-            self._logout(common)
 
     def get_cpg(self, volume, is_snap, allowSnap=False):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_cpg(volume, is_snap, allowSnap)
-        finally:
-            self._logout(common)
 
     def initialize_connection(self, volume, connector, is_snap):
         """Assigns the volume to a server.
@@ -161,8 +181,7 @@ class HPE3PARFCDriver(object):
           * Create a VLUN for that HOST with the volume we want to export.
 
         """
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             # we have to make sure we have a host
             host = self._create_host(common, volume, connector, is_snap)
             target_wwns, init_targ_map, numPaths = \
@@ -221,13 +240,10 @@ class HPE3PARFCDriver(object):
             encryption_key_id = volume.get('encryption_key_id', None)
             info['data']['encrypted'] = encryption_key_id is not None
             return info
-        finally:
-            self._logout(common)
 
     def terminate_connection(self, volume, connector, is_snap, **kwargs):
         """Driver entry point to unattach a volume from an instance."""
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             hostname = common._safe_hostname(connector['host'])
             common.terminate_connection(volume, hostname, is_snap,
                                         wwn=connector['wwpns'])
@@ -249,8 +265,6 @@ class HPE3PARFCDriver(object):
             #                    'initiator_target_map': init_targ_map}
             return info
 
-        finally:
-            self._logout(common)
 
     def _build_initiator_target_map(self, common, connector):
         """Build the target_wwns and the initiator target map."""
@@ -277,6 +291,7 @@ class HPE3PARFCDriver(object):
                        'FCWWNs': wwn}
         try:
             common.client.modifyHost(hostname, mod_request)
+            common._host_changed(hostname, wwns=wwn)
         except hpeexceptions.HTTPConflict as path_conflict:
             msg = _LE("Modify FC Host %(hostname)s caught "
                       "HTTP conflict code: %(code)s")
@@ -370,6 +385,7 @@ class HPE3PARFCDriver(object):
                 common.client.createHost(hostname, FCWwns=wwns,
                                          optional={'domain': domain,
                                                    'persona': persona_id})
+                common._host_changed(hostname, wwns=wwns)
             except hpeexceptions.HTTPConflict as path_conflict:
                 msg = _LE("Create FC host caught HTTP conflict code: %s")
                 LOG.exception(msg, path_conflict.get_code())
@@ -391,176 +407,104 @@ class HPE3PARFCDriver(object):
             return hostname
 
     def create_snapshot(self, snapshot):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_snapshot(snapshot)
-        finally:
-            self._logout(common)
 
     def revert_snap_to_vol(self, volume, snapshot):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             common.revert_snap_to_vol(volume, snapshot)
-        finally:
-            self._logout(common)
 
     def create_cloned_volume(self, volume, src_vref):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_cloned_volume(volume, src_vref)
-        finally:
-            self._logout(common)
 
     def get_snapshots_by_vol(self, vol_id, snap_cpg):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_snapshots_by_vol(vol_id, snap_cpg)
-        finally:
-            self._logout(common)
 
     def get_qos_detail(self, vvset):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_qos_detail(vvset)
-        finally:
-            self._logout(common)
 
     def get_vvset_detail(self, vvset):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_vvset_detail(vvset)
-        finally:
-            self._logout(common)
 
     def get_vvset_from_volume(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_vvset_from_volume(volume)
-        finally:
-            self._logout(common)
 
     def get_volume_detail(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_volume_detail(volume)
-        finally:
-            self._logout(common)
 
     def manage_existing(self, volume, existing_ref_details, is_snap=False,
                         target_vol_name=None, comment=None):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.manage_existing(
                 volume, existing_ref_details, is_snap=is_snap,
                 target_vol_name=target_vol_name, comment=comment)
-        finally:
-            self._logout(common)
 
     def create_vvs(self, id):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_vvs(id)
-        finally:
-            self._logout(common)
 
     def delete_vvset(self, id):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.delete_vvset(id)
-        finally:
-            self._logout(common)
 
     def add_volume_to_volume_set(self, vol, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.add_volume_to_volume_set(vol, vvs_name)
-        finally:
-            self._logout(common)
 
     def remove_volume_from_volume_set(self, vol_name, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.remove_volume_from_volume_set(vol_name, vvs_name)
-        finally:
-            self._logout(common)
 
     def set_flash_cache_policy_on_vvs(self, flash_cache, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.set_flash_cache_policy_on_vvs(flash_cache,
                                                         vvs_name)
-        finally:
-            self._logout(common)
 
     def force_remove_volume_vlun(self, vol_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.force_remove_volume_vlun(vol_name)
-        finally:
-            self._logout(common)
 
     def add_volume_to_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.add_volume_to_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def remove_volume_from_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.remove_volume_from_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def create_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def delete_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.delete_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def force_remove_3par_schedule(self, schedule_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.force_remove_3par_schedule(schedule_name)
-        finally:
-            self._logout(common)
 
     def create_snap_schedule(self, src_vol_name, schedName, snapPrefix,
                              exphrs, rethrs, schedFrequency):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_snap_schedule(src_vol_name, schedName,
                                                snapPrefix, exphrs, rethrs,
                                                schedFrequency)
-        finally:
-            self._logout(common)
 
     def get_rcg(self, rcg_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_rcg(rcg_name)
-        finally:
-            self._logout(common)
 
     def is_vol_having_active_task(self, vol_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.is_vol_having_active_task(vol_name)
-        finally:
-            self._logout(common)
 
     def get_domain(self, cpg_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_domain(cpg_name)
-        finally:
-            self._logout(common)
@@ -24,7 +24,6 @@ hpedockerplugin_driver = hpe.hpe_3par_iscsi.HPE3PARISCSIDriver
 """
 
 import re
-import sys
 
 try:
     from hpe3parclient import exceptions as hpeexceptions
@@ -38,7 +37,11 @@ from hpedockerplugin import exception
 from hpedockerplugin.i18n import _, _LW
 
 from hpedockerplugin.hpe import hpe_3par_common as hpecommon
+from hpedockerplugin.hpe import host_index
+from hpedockerplugin.hpe import inventory_cache
+from hpedockerplugin.hpe import session_pool
 from hpedockerplugin.hpe import utils as volume_utils
+from hpedockerplugin.hpe import vlun_tracker
 
 LOG = logging.getLogger(__name__)
 DEFAULT_ISCSI_PORT = 3260
@@ -70,21 +73,55 @@ class HPE3PARISCSIDriver(object):
         # Get source and target backend configs as separate dictionaries
         self.src_bkend_config = src_bkend_config
         self.tgt_bkend_config = tgt_bkend_config
+        self._session_pool = session_pool.SessionPool(
+            src_bkend_config.hpe3par_api_url, self._new_session,
+            max_sessions=getattr(src_bkend_config, 'hpe3par_max_sessions',
+                                 None),
+            idle_timeout=getattr(src_bkend_config,
+                                 'hpe3par_session_idle_timeout', None))
+        self._ssh_pool = session_pool.SSHClientPool(
+            src_bkend_config.san_ip, self._new_cli_client,
+            max_sessions=getattr(src_bkend_config,
+                                 'hpe3par_max_ssh_sessions', None),
+            idle_timeout=getattr(src_bkend_config,
+                                 'hpe3par_ssh_idle_timeout', None),
+            keepalive=getattr(src_bkend_config,
+                              'hpe3par_ssh_keepalive_interval', None))
+        self._inventory = inventory_cache.InventoryCache(
+            src_bkend_config.hpe3par_api_url,
+            ttls=getattr(src_bkend_config, 'hpe3par_inventory_cache_ttl',
+                         None))
+        self._host_index = host_index.HostIndex(
+            src_bkend_config.hpe3par_api_url,
+            refresh_interval=getattr(src_bkend_config,
+                                     'hpe3par_host_index_refresh_interval',
+                                     None))
+        self._nsp_tracker = vlun_tracker.NspLoadTracker(
+            src_bkend_config.hpe3par_api_url,
+            refresh_interval=getattr(src_bkend_config,
+                                     'hpe3par_vlun_refresh_interval', None))
+
+    def get_inventory_cache_stats(self):
+        return self._inventory.stats()
 
     def _init_common(self):
         return hpecommon.HPE3PARCommon(self._host_config,
                                        self.src_bkend_config,
-                                       self.tgt_bkend_config)
+                                       self.tgt_bkend_config,
+                                       ssh_pool=self._ssh_pool,
+                                       inventory=self._inventory,
+                                       host_index=self._host_index,
+                                       nsp_tracker=self._nsp_tracker)
 
-    def _login(self):
+    def _new_cli_client(self):
+        return self._init_common().create_cli_client()
+
+    def _new_session(self):
         common = self._init_common()
         common.do_setup()
         common.client_login()
         return common
 
-    def _logout(self, common):
-        common.client_logout()
-
     def _check_flags(self, common):
         """Sanity check to ensure we have required options set."""
         required_flags = ['hpe3par_api_url', 'hpe3par_username',
@@ -102,7 +139,7 @@ class HPE3PARISCSIDriver(object):
             common.client_login()
             self.initialize_iscsi_ports(common)
         finally:
-            self._logout(common)
+            common.client_logout()
 
     def initialize_iscsi_ports(self, common):
         # map iscsi_ip-> ip_port
@@ -169,32 +206,20 @@ class HPE3PARISCSIDriver(object):
         pass
 
     def create_volume(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_volume(volume)
-        finally:
-            self._logout(common)
 
     def delete_volume(self, volume, is_snapshot=False):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             common.delete_volume(volume, is_snapshot)
-        finally:
-            self._logout(common)
 
     def get_snapcpg(self, volume, is_snap):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_snapcpg(volume, is_snap)
-        finally:
-            self._logout(common)
 
     def get_cpg(self, volume, is_snap, allowSnap=False):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_cpg(volume, is_snap, allowSnap)
-        finally:
-            self._logout(common)
 
     def initialize_connection(self, volume, connector, is_snap):
         """Assigns the volume to a server.
@@ -218,8 +243,7 @@ class HPE3PARISCSIDriver(object):
           * Create a host on the 3par
           * create vlun on the 3par
         """
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             # we have to make sure we have a host
             host, username, password = self._create_host(
                 common,
@@ -336,13 +360,10 @@ class HPE3PARISCSIDriver(object):
             info['data']['encrypted'] = encryption_key_id is not None
 
             return info
-        finally:
-            self._logout(common)
 
     def terminate_connection(self, volume, connector, is_snap, **kwargs):
         """Driver entry point to unattach a volume from an instance."""
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             hostname = common._safe_hostname(connector['host'])
             common.terminate_connection(
                 volume,
@@ -350,8 +371,6 @@ class HPE3PARISCSIDriver(object):
                 is_snap,
                 iqn=connector['initiator'])
             self._clear_chap_3par(common, volume, is_snap)
-        finally:
-            self._logout(common)
 
     def _clear_chap_3par(self, common, volume, is_snap):
         """Clears CHAP credentials on a 3par volume.
@@ -398,6 +417,7 @@ class HPE3PARISCSIDriver(object):
             common.client.createHost(hostname, iscsiNames=iqn,
                                      optional={'domain': domain,
                                                'persona': persona_id})
+            common._host_changed(hostname, iqns=iqn)
             return hostname
 
     def _modify_3par_iscsi_host(self, common, hostname, iscsi_iqn):
@@ -405,6 +425,7 @@ class HPE3PARISCSIDriver(object):
                        'iSCSINames': [iscsi_iqn]}
 
         common.client.modifyHost(hostname, mod_request)
+        common._host_changed(hostname, iqns=[iscsi_iqn])
 
     def _set_3par_chaps(self, common, hostname, volume, username, password):
         """Sets a 3PAR host's CHAP credentials."""
@@ -416,6 +437,7 @@ class HPE3PARISCSIDriver(object):
                        'chapName': username,
                        'chapSecret': password}
         common.client.modifyHost(hostname, mod_request)
+        common._host_changed(hostname)
 
     def _create_host(self, common, volume, connector, is_snap):
         """Creates or modifies existing 3PAR host."""
@@ -534,11 +556,8 @@ class HPE3PARISCSIDriver(object):
         return model_update
 
     def create_export(self, volume, connector, is_snap):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return self._do_export(common, volume, connector, is_snap)
-        finally:
-            self._logout(common)
 
     def _get_least_used_nsp_for_host(self, common, hostname):
         """Get the least used NSP for the current host.
@@ -553,21 +572,10 @@ class HPE3PARISCSIDriver(object):
         if len(iscsi_nsps) == 1:
             return iscsi_nsps[0]
 
-        # Try to reuse an existing iscsi path to the host
-        vluns = common.client.getVLUNs()
-        for vlun in vluns['members']:
-            if vlun['active']:
-                if vlun['hostname'] == hostname:
-                    temp_nsp = common.build_nsp(vlun['portPos'])
-                    if temp_nsp in iscsi_nsps:
-                        # this host already has an iscsi path, so use it
-                        return temp_nsp
-
-        # Calculate the least used iscsi nsp
-        least_used_nsp = self._get_least_used_nsp(common,
-                                                  vluns['members'],
-                                                  self._get_iscsi_nsps())
-        return least_used_nsp
+        # Reuse an existing iscsi path to the host or else calculate the
+        # least used iscsi nsp
+        return self._nsp_tracker.least_used_nsp(
+            hostname, iscsi_nsps, common.client.getVLUNs, common.build_nsp)
 
     def _get_iscsi_nsps(self):
         """Return the list of candidate nsps."""
@@ -582,203 +590,105 @@ class HPE3PARISCSIDriver(object):
             if value['nsp'] == nsp:
                 return key
 
-    def _get_least_used_nsp(self, common, vluns, nspss):
-        """Return the nsp that has the fewest active vluns."""
-        # return only the nsp (node:server:port)
-        # count the number of nsps
-        nsp_counts = {}
-        for nsp in nspss:
-            # initialize counts to zero
-            nsp_counts[nsp] = 0
-
-        current_least_used_nsp = None
-
-        for vlun in vluns:
-            if vlun['active']:
-                nsp = common.build_nsp(vlun['portPos'])
-                if nsp in nsp_counts:
-                    nsp_counts[nsp] = nsp_counts[nsp] + 1
-
-        # identify key (nsp) of least used nsp
-        current_smallest_count = sys.maxsize
-        for (nsp, count) in nsp_counts.items():
-            if count < current_smallest_count:
-                current_least_used_nsp = nsp
-                current_smallest_count = count
-
-        return current_least_used_nsp
-
     def create_snapshot(self, snapshot):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_snapshot(snapshot)
-        finally:
-            self._logout(common)
 
     def revert_snap_to_vol(self, volume, snapshot):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             common.revert_snap_to_vol(volume, snapshot)
-        finally:
-            self._logout(common)
 
     def create_cloned_volume(self, volume, src_vref):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_cloned_volume(volume, src_vref)
-        finally:
-            self._logout(common)
 
     def get_snapshots_by_vol(self, vol_id, snp_cpg):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_snapshots_by_vol(vol_id, snp_cpg)
-        finally:
-            self._logout(common)
 
     def get_qos_detail(self, vvset):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_qos_detail(vvset)
-        finally:
-            self._logout(common)
 
     def get_vvset_detail(self, vvset):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_vvset_detail(vvset)
-        finally:
-            self._logout(common)
 
     def get_vvset_from_volume(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_vvset_from_volume(volume)
-        finally:
-            self._logout(common)
 
     def get_volume_detail(self, volume):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_volume_detail(volume)
-        finally:
-            self._logout(common)
 
     def manage_existing(self, volume, existing_ref_details, is_snap=False,
                         target_vol_name=None, comment=None):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.manage_existing(
                 volume, existing_ref_details, is_snap=is_snap,
                 target_vol_name=target_vol_name, comment=comment)
-        finally:
-            self._logout(common)
 
     def create_vvs(self, id):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_vvs(id)
-        finally:
-            self._logout(common)
 
     def delete_vvset(self, id):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.delete_vvset(id)
-        finally:
-            self._logout(common)
 
     def add_volume_to_volume_set(self, vol, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.add_volume_to_volume_set(vol, vvs_name)
-        finally:
-            self._logout(common)
 
     def remove_volume_from_volume_set(self, vol_name, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.remove_volume_from_volume_set(vol_name, vvs_name)
-        finally:
-            self._logout(common)
 
     def set_flash_cache_policy_on_vvs(self, flash_cache, vvs_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.set_flash_cache_policy_on_vvs(flash_cache,
                                                         vvs_name)
-        finally:
-            self._logout(common)
 
     def force_remove_volume_vlun(self, vol_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.force_remove_volume_vlun(vol_name)
-        finally:
-            self._logout(common)
 
     def add_volume_to_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.add_volume_to_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def remove_volume_from_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.remove_volume_from_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def create_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def delete_rcg(self, **kwargs):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.delete_rcg(**kwargs)
-        finally:
-            self._logout(common)
 
     def force_remove_3par_schedule(self, schedule_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.force_remove_3par_schedule(schedule_name)
-        finally:
-            self._logout(common)
 
     def create_snap_schedule(self, src_vol_name, schedName, snapPrefix,
                              exphrs, rethrs, schedFrequency):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.create_snap_schedule(src_vol_name, schedName,
                                                snapPrefix, exphrs, rethrs,
                                                schedFrequency)
-        finally:
-            self._logout(common)
 
     def get_rcg(self, rcg_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_rcg(rcg_name)
-        finally:
-            self._logout(common)
 
     def is_vol_having_active_task(self, vol_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.is_vol_having_active_task(vol_name)
-        finally:
-            self._logout(common)
 
     def get_domain(self, cpg_name):
-        common = self._login()
-        try:
+        with self._session_pool.session() as common:
             return common.get_domain(cpg_name)
-        finally:
-            self._logout(common)
@@ -23,6 +23,7 @@ from oslo_service import loopingcall
 from oslo_utils import importutils
 
 from hpedockerplugin import exception
+from hpedockerplugin.hpe import session_pool
 from hpedockerplugin.i18n import _
 
 hpe3parclient = importutils.try_import("hpe3parclient")
@@ -73,6 +74,12 @@ class HPE3ParMediator(object):
         self._config = config
         self._client = None
         self.client_version = None
+        self._ssh_pool = session_pool.SSHClientPool(
+            config.san_ip, self._new_cli_client,
+            max_sessions=getattr(config, 'hpe3par_max_ssh_sessions', None),
+            idle_timeout=getattr(config, 'hpe3par_ssh_idle_timeout', None),
+            keepalive=getattr(config, 'hpe3par_ssh_keepalive_interval',
+                              None))
 
     @staticmethod
     def no_client():
@@ -112,22 +119,7 @@ class HPE3ParMediator(object):
             raise exception.ShareBackendException(message=msg)
 
         try:
-            ssh_kwargs = {}
-            if self._config.san_ssh_port:
-                ssh_kwargs['port'] = self._config.san_ssh_port
-            if self._config.ssh_conn_timeout:
-                ssh_kwargs['conn_timeout'] = self._config.ssh_conn_timeout
-            if self._config.san_private_key:
-                ssh_kwargs['privatekey'] = \
-                    self._config.san_private_key
-
-            self._client.setSSHOptions(
-                self._config.san_ip,
-                self._config.san_login,
-                self._config.san_password,
-                **ssh_kwargs
-            )
-
+            self._set_ssh_options(self._client)
         except Exception as e:
             msg = (_('Failed to set SSH options for HPE 3PAR File Persona '
                      'Client: %s') % six.text_type(e))
@@ -151,6 +143,28 @@ class HPE3ParMediator(object):
         if self._config.hpe3par_debug:
             self._client.debug_rest(True)  # Includes SSH debug (setSSH above)
 
+    def _set_ssh_options(self, client):
+        ssh_kwargs = {}
+        if self._config.san_ssh_port:
+            ssh_kwargs['port'] = self._config.san_ssh_port
+        if self._config.ssh_conn_timeout:
+            ssh_kwargs['conn_timeout'] = self._config.ssh_conn_timeout
+        if self._config.san_private_key:
+            ssh_kwargs['privatekey'] = \
+                self._config.san_private_key
+
+        client.setSSHOptions(
+            self._config.san_ip,
+            self._config.san_login,
+            self._config.san_password,
+            **ssh_kwargs
+        )
+
+    def _new_cli_client(self):
+        client = self._create_client()
+        self._set_ssh_options(client)
+        return client
+
     def _wsapi_login(self):
         try:
             self._client.login(self._config.hpe3par_username,
@@ -666,12 +680,12 @@ class HPE3ParMediator(object):
         try:
             LOG.info("Executing first command: %s..." % cmd1)
             cmd1.append('\r')
-            res_cmd1 = self._client._run(cmd1)
+            res_cmd1 = self._ssh_pool.run(cmd1)
             LOG.info("Resp: %s" % res_cmd1)
             f_user_name = self._check_usr_grp_existence(fUser, res_cmd1)
             LOG.info("Executing second command: %s..." % cmd2)
             cmd2.append('\r')
-            res_cmd2 = self._client._run(cmd2)
+            res_cmd2 = self._ssh_pool.run(cmd2)
             LOG.info("Resp: %s" % res_cmd2)
             f_group_name = self._check_usr_grp_existence(fGroup, res_cmd2)
             return f_user_name, f_group_name
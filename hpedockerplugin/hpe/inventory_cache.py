@@ -0,0 +1,110 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Cache of the array inventory read by a backend.
+
+Ports, CPGs, hosts, the storage system info and the WSAPI version seldom
+change but were read from the array on every attach, create and login.
+They are kept for a time set per kind of object. Hosts created, modified
+or deleted by the driver are dropped right away so that the next read of
+them sees the change.
+"""
+import copy
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+PORTS = 'ports'
+CPG = 'cpg'
+HOST = 'host'
+SYSTEM_INFO = 'system_info'
+WSAPI_VERSION = 'wsapi_version'
+
+# Seconds each kind of object is kept. Ports are kept the shortest as
+# their link state decides the paths given to the host.
+DEFAULT_TTLS = {PORTS: 60,
+                CPG: 300,
+                HOST: 30,
+                SYSTEM_INFO: 3600,
+                WSAPI_VERSION: 3600}
+
+
+class InventoryCache(object):
+    def __init__(self, name, ttls=None, clock=time.monotonic):
+        """
+        :param ttls: Seconds to keep objects for by kind, overriding the
+            defaults. Objects of a kind with no positive TTL are not kept
+        """
+        self._name = name
+        self._ttls = dict(DEFAULT_TTLS)
+        for kind, ttl in (ttls or {}).items():
+            self._ttls[kind] = float(ttl)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (kind, key) -> (expiry, value)
+        self._entries = {}
+        # Bumped by every invalidation so that an object read while it was
+        # being changed is not kept
+        self._generation = 0
+        self._hits = dict.fromkeys(self._ttls, 0)
+        self._misses = dict.fromkeys(self._ttls, 0)
+
+    def get(self, kind, key, load):
+        """Returns the cached object or loads and caches it
+
+        Errors raised by load are not cached. The caller gets a copy it
+        is free to modify.
+        """
+        ttl = self._ttls.get(kind, 0)
+        if ttl <= 0:
+            return load()
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry and entry[0] > now:
+                self._hits[kind] += 1
+                return copy.deepcopy(entry[1])
+            self._misses[kind] += 1
+            generation = self._generation
+        value = load()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[(kind, key)] = (self._clock() + ttl,
+                                              copy.deepcopy(value))
+        return value
+
+    def invalidate(self, kind=None, key=None):
+        """Drops the object of a kind and key
+
+        All the objects of the kind are dropped if no key is given and
+        everything if no kind is given either.
+        """
+        with self._lock:
+            self._generation += 1
+            for k in list(self._entries):
+                if kind is None or k[0] == kind and key in (None, k[1]):
+                    del self._entries[k]
+        LOG.debug('Dropped cached %s %s of %s' % (kind, key, self._name))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'kinds': {kind: {'ttl': ttl,
+                                     'hits': self._hits[kind],
+                                     'misses': self._misses[kind]}
+                              for kind, ttl in self._ttls.items()}}
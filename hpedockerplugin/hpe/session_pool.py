@@ -0,0 +1,201 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Pools of logged in 3PAR WSAPI sessions and SSH connections of a backend.
+
+Logging in takes a new client, a WSAPI version query and the login itself.
+Sessions are instead logged in once and handed from one driver call to the
+next. An expired session is logged in again by hpe3parclient on the 401 it
+gets. Sessions idle for long are logged out, as are sessions that failed
+in a way which leaves them unusable. The array limits the sessions a user
+may have open, so the calls beyond the pool size wait for a session.
+
+CLI commands are run the same way over SSH connections kept open between
+commands, sparing the key exchange and authentication of each command.
+"""
+import contextlib
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_utils import importutils
+import six
+
+hpe3parclient = importutils.try_import("hpe3parclient")
+if hpe3parclient:
+    from hpe3parclient import exceptions as hpeexceptions
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_MAX_SSH_SESSIONS = 2
+DEFAULT_SSH_IDLE_TIMEOUT = 300
+DEFAULT_SSH_KEEPALIVE = 30
+
+
+class SessionPool(object):
+    def __init__(self, name, login, max_sessions=None, idle_timeout=None,
+                 clock=time.monotonic):
+        """
+        :param login: Returns a new HPE3PARCommon logged in to the array
+        """
+        self._name = name
+        self._login = login
+        self._max_sessions = max_sessions or DEFAULT_MAX_SESSIONS
+        self._idle_timeout = idle_timeout or DEFAULT_IDLE_TIMEOUT
+        self._clock = clock
+        self._slots = threading.BoundedSemaphore(self._max_sessions)
+        self._lock = threading.Lock()
+        # (released at, session) with the most recently used last
+        self._idle = []
+        self._in_use = 0
+        self.logins = 0
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            session = self._pop_idle()
+            if session is None:
+                session = self._login()
+                with self._lock:
+                    self.logins += 1
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return session
+
+    def _pop_idle(self):
+        now = self._clock()
+        with self._lock:
+            expired = [s for t, s in self._idle
+                       if now - t >= self._idle_timeout]
+            self._idle = [(t, s) for t, s in self._idle
+                          if now - t < self._idle_timeout]
+            session = self._idle.pop()[1] if self._idle else None
+        for s in expired:
+            self._logout(s)
+        return session
+
+    @contextlib.contextmanager
+    def session(self):
+        session = self.acquire()
+        error = None
+        try:
+            yield session
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            self.release(session, error=error)
+
+    def release(self, session, error=None):
+        """Returns a session to the pool
+
+        :param error: Exception the call using the session raised, if any
+        """
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if self._is_broken(error):
+                LOG.info('Discarding 3PAR session of %s after error: %s',
+                         self._name, six.text_type(error))
+                self._logout(session)
+            else:
+                with self._lock:
+                    self._idle.append((self._clock(), session))
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _is_broken(error):
+        """Whether the session may be unusable after the error"""
+        if error is None or hpe3parclient is None:
+            return False
+        return isinstance(error, (hpeexceptions.HTTPUnauthorized,
+                                  hpeexceptions.ConnectionError,
+                                  hpeexceptions.RequestException,
+                                  hpeexceptions.Timeout))
+
+    def _close(self, session):
+        session.client_logout()
+
+    def _logout(self, session):
+        try:
+            self._close(session)
+        except Exception as ex:
+            LOG.warning('Failed to log out 3PAR session of %s: %s',
+                        self._name, six.text_type(ex))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for t, session in idle:
+            self._logout(session)
+
+    def stats(self):
+        with self._lock:
+            return {'max_sessions': self._max_sessions,
+                    'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'logins': self.logins}
+
+
+class SSHClientPool(SessionPool):
+    """Clients of a backend holding open SSH connections to the array CLI
+
+    A client connects on its first command and reconnects if it finds its
+    connection closed. Clients whose command failed are closed, as the
+    state of their connection is unknown.
+    """
+    def __init__(self, name, create_client, max_sessions=None,
+                 idle_timeout=None, keepalive=None, clock=time.monotonic):
+        """
+        :param create_client: Returns a new hpe3parclient client with its
+            SSH options set
+        """
+        super(SSHClientPool, self).__init__(
+            name, create_client,
+            max_sessions=max_sessions or DEFAULT_MAX_SSH_SESSIONS,
+            idle_timeout=idle_timeout or DEFAULT_SSH_IDLE_TIMEOUT,
+            clock=clock)
+        self._keepalive = keepalive or DEFAULT_SSH_KEEPALIVE
+
+    def run(self, cmd):
+        with self.session() as cli_client:
+            resp = cli_client._run(cmd)
+            self._keep_alive(cli_client)
+            return resp
+
+    def _keep_alive(self, cli_client):
+        # Keeps the connection from being dropped by firewalls and the
+        # array while idle in the pool
+        ssh = getattr(cli_client, 'ssh', None)
+        if ssh is None:
+            return
+        transport = ssh.ssh.get_transport()
+        if transport is not None:
+            transport.set_keepalive(self._keepalive)
+
+    @staticmethod
+    def _is_broken(error):
+        return error is not None
+
+    def _close(self, cli_client):
+        ssh = getattr(cli_client, 'ssh', None)
+        if ssh is not None:
+            ssh.close()
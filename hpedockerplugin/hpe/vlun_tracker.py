@@ -0,0 +1,99 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Count of the active VLUNs of an array by NSP, for picking iSCSI paths.
+
+Picking the least used iSCSI port used to read every VLUN of the array on
+each export. The counts are instead read once and then kept up to date
+with the VLUNs the driver creates and deletes. They are read again after
+a refresh interval to take in the VLUNs changed by others, or as soon as
+the driver changed VLUNs whose ports it does not know.
+"""
+import collections
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = 600
+
+
+class NspLoadTracker(object):
+    def __init__(self, name, refresh_interval=None, clock=time.monotonic):
+        self._name = name
+        self._refresh_interval = refresh_interval or DEFAULT_REFRESH_INTERVAL
+        self._clock = clock
+        self._lock = threading.Lock()
+        # nsp -> active VLUNs
+        self._nsp_vluns = collections.Counter()
+        # (host name, nsp) -> active VLUNs
+        self._host_nsp_vluns = collections.Counter()
+        self._loaded_at = None
+
+    def least_used_nsp(self, hostname, nsps, get_vluns, build_nsp):
+        """Returns the NSP to export a volume to a host through
+
+        That is the NSP the host already has active VLUNs on or else the
+        NSP with the fewest active VLUNs.
+
+        :param get_vluns: Returns all the VLUNs of the array
+        :param build_nsp: Returns the NSP of a VLUN port position
+        """
+        self._load_if_stale(get_vluns, build_nsp)
+        with self._lock:
+            for nsp in nsps:
+                if self._host_nsp_vluns[(hostname, nsp)] > 0:
+                    return nsp
+            if not nsps:
+                return None
+            return min(nsps, key=lambda nsp: self._nsp_vluns[nsp])
+
+    def _load_if_stale(self, get_vluns, build_nsp):
+        with self._lock:
+            if (self._loaded_at is not None and
+                    self._clock() - self._loaded_at < self._refresh_interval):
+                return
+        nsp_vluns = collections.Counter()
+        host_nsp_vluns = collections.Counter()
+        for vlun in get_vluns()['members']:
+            if vlun['active']:
+                nsp = build_nsp(vlun['portPos'])
+                nsp_vluns[nsp] += 1
+                host_nsp_vluns[(vlun['hostname'], nsp)] += 1
+        with self._lock:
+            self._nsp_vluns = nsp_vluns
+            self._host_nsp_vluns = host_nsp_vluns
+            self._loaded_at = self._clock()
+        LOG.debug('Loaded active VLUNs by NSP of %s: %s'
+                  % (self._name, dict(nsp_vluns)))
+
+    def vlun_created(self, hostname, nsp):
+        self._count(hostname, nsp, 1)
+
+    def vlun_deleted(self, hostname, nsp):
+        self._count(hostname, nsp, -1)
+
+    def _count(self, hostname, nsp, delta):
+        with self._lock:
+            if nsp is None:
+                # Exported through ports not known here
+                self._loaded_at = None
+                return
+            self._nsp_vluns[nsp] = max(self._nsp_vluns[nsp] + delta, 0)
+            key = (hostname, nsp)
+            self._host_nsp_vluns[key] = max(
+                self._host_nsp_vluns[key] + delta, 0)
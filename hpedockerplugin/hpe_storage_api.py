@@ -23,22 +23,40 @@ import datetime
 
 from oslo_log import log as logging
 
+import hpedockerplugin.admission as admission
 import hpedockerplugin.exception as exception
 from hpedockerplugin.i18n import _, _LE, _LI
 from klein import Klein
+from twisted.internet import defer
 from hpedockerplugin.hpe import volume
-from ratelimit import limits
-from ratelimit.exception import RateLimitException
-from backoff import on_exception, expo
 
 import hpedockerplugin.backend_orchestrator as orchestrator
 import hpedockerplugin.request_validator as req_validator
 import hpedockerplugin.file_backend_orchestrator as f_orchestrator
 import hpedockerplugin.request_router as req_router
+import hpedockerplugin.response_cache as response_cache
+import hpedockerplugin.synchronization as synchronization
+import hpedockerplugin.worker_pool as worker_pool
 
 LOG = logging.getLogger(__name__)
 
 
+def _encode_list_response(objs, encoded_entries=''):
+    """Encode a List response one volume or share at a time
+
+    objs may be a generator, so that only one entry is held in memory
+    as a dictionary at a time. encoded_entries are appended as they are,
+    as encoded by response_cache.encode_list_entries. The encoded entries
+    are still collected into the response string, which Klein needs in
+    one piece.
+    """
+    entries = [e for e in (response_cache.encode_list_entries(objs),
+                           encoded_entries) if e]
+    if not entries:
+        return json.dumps({u"Err": ''})
+    return '{"Err": "", "Volumes": [' + ', '.join(entries) + ']}'
+
+
 class VolumePlugin(object):
     """
     An implementation of the Docker Volumes Plugin API.
@@ -116,6 +134,18 @@ class VolumePlugin(object):
             file_orchestrator=self._file_orchestrator,
             all_configs=all_configs)
 
+        # Handlers do blocking etcd and array I/O. They run in a pool of
+        # their own, so that the reactor keeps serving the other requests
+        # and so that waiting for the orchestrator's deferred work, which
+        # runs in the reactor's pool, can never exhaust the pool it needs
+        host_config = getattr(self, '_host_config', None) or \
+            getattr(self, '_f_host_config', None)
+        self._request_timeout = host_config.host_request_timeout \
+            if host_config else 0
+        self._request_pool = worker_pool.WorkerPool(
+            self._reactor, 'hpe-request',
+            host_config.host_request_threads if host_config else 1)
+
     def is_backend_initialized(self, backend_name):
         if (backend_name not in self._backend_configs and
                 backend_name not in self._f_backend_configs):
@@ -130,6 +160,22 @@ class VolumePlugin(object):
 
         return 'INITIALIZING'
 
+    def _run_request(self, handler, *args):
+        d = self._request_pool.defer(handler, *args)
+        if self._request_timeout:
+            d.addTimeout(self._request_timeout, self._reactor)
+        d.addErrback(self._request_timed_out, handler.__name__)
+        return d
+
+    def _request_timed_out(self, failure, handler_name):
+        failure.trap(defer.TimeoutError)
+        # The handler keeps running in its thread. Only the response to
+        # Docker is not held up any longer
+        msg = "Request %s timed out after %s seconds" % \
+              (handler_name.lstrip('_'), self._request_timeout)
+        LOG.error(msg)
+        return json.dumps({u"Err": msg})
+
     def disconnect_volume_callback(self, connector_info):
         LOG.info(_LI('In disconnect_volume_callback: connector info is %s'),
                  json.dumps(connector_info))
@@ -146,8 +192,6 @@ class VolumePlugin(object):
         LOG.info(_LI('In Plugin Activate'))
         return json.dumps({u"Implements": [u"VolumeDriver"]})
 
-    @on_exception(expo, RateLimitException, max_tries=8)
-    @limits(calls=25, period=30)
     @app.route("/VolumeDriver.Remove", methods=["POST"])
     def volumedriver_remove(self, name):
         """
@@ -157,6 +201,9 @@ class VolumePlugin(object):
 
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_remove, name)
+
+    def _volumedriver_remove(self, name):
         contents = json.loads(name.content.getvalue())
         name = contents['Name']
 
@@ -186,8 +233,6 @@ class VolumePlugin(object):
 
         return json.dumps({"Err": ""})
 
-    @on_exception(expo, RateLimitException, max_tries=8)
-    @limits(calls=25, period=30)
     @app.route("/VolumeDriver.Unmount", methods=["POST"])
     def volumedriver_unmount(self, name):
         """
@@ -199,6 +244,9 @@ class VolumePlugin(object):
         :param unicode name: The name of the volume.
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_unmount, name)
+
+    def _volumedriver_unmount(self, name):
         LOG.info(_LI('In volumedriver_unmount'))
         contents = json.loads(name.content.getvalue())
         volname = contents['Name']
@@ -232,6 +280,9 @@ class VolumePlugin(object):
 
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_create, request, opts)
+
+    def _volumedriver_create(self, request, opts=None):
         contents = json.loads(request.content.getvalue())
         if 'Name' not in contents:
             msg = (_('create volume failed, error is: Name is required.'))
@@ -240,10 +291,7 @@ class VolumePlugin(object):
 
         name = contents['Name']
 
-        if ((self.orchestrator and
-             self.orchestrator.volume_exists(name)) or
-            (self._file_orchestrator and
-             self._file_orchestrator.share_exists(name))):
+        if self._req_router.name_exists(name):
             return json.dumps({'Err': ''})
 
         # Try to handle this as file persona operation
@@ -790,8 +838,6 @@ class VolumePlugin(object):
         LOG.info(' Schedule Name auto generated is %s' % scheduleNameGenerated)
         return scheduleNameGenerated
 
-    @on_exception(expo, RateLimitException, max_tries=8)
-    @limits(calls=25, period=30)
     @app.route("/VolumeDriver.Mount", methods=["POST"])
     def volumedriver_mount(self, name):
         """
@@ -806,6 +852,9 @@ class VolumePlugin(object):
 
         :return: Result that includes the mountpoint.
         """
+        return self._run_request(self._volumedriver_mount, name)
+
+    def _volumedriver_mount(self, name):
         LOG.debug('In volumedriver_mount')
 
         # TODO: use persistent storage to lookup volume for deletion
@@ -842,6 +891,9 @@ class VolumePlugin(object):
 
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_path, name)
+
+    def _volumedriver_path(self, name):
         contents = json.loads(name.content.getvalue())
         volname = contents['Name']
 
@@ -861,15 +913,83 @@ class VolumePlugin(object):
         response = json.dumps(capability)
         return response
 
+    @app.route("/Admin.LockStats", methods=["GET", "POST"])
+    def admin_lock_stats(self, request):
+        """
+        Return the lock wait and hold time histograms per lock type and
+        the locks waited for the longest.
+        """
+        return json.dumps(synchronization.lock_stats.snapshot())
+
+    @app.route("/Admin.AdmissionStats", methods=["GET", "POST"])
+    def admin_admission_stats(self, request):
+        """
+        Return the requests admitted, queued and rejected and the depth
+        of the admission queue per backend.
+        """
+        controller = admission.get_controller()
+        return json.dumps(controller.snapshot() if controller else {})
+
+    @app.route("/Admin.WorkerPoolStats", methods=["GET", "POST"])
+    def admin_worker_pool_stats(self, request):
+        """
+        Return the size, busy and queued work and utilization of the
+        request pool, of the pool of each backend and of the file persona
+        background pool.
+        """
+        stats = {'request': self._request_pool.stats(), 'backends': {}}
+        for orch in (self.orchestrator, self._file_orchestrator):
+            if orch:
+                stats['backends'].update(orch.get_worker_pool_stats())
+        pool = f_orchestrator.FileBackendOrchestrator.background_pool
+        if pool:
+            stats['file_background'] = pool.stats()
+        return json.dumps(stats)
+
+    @app.route("/Admin.ResponseCacheStats", methods=["GET", "POST"])
+    def admin_response_cache_stats(self, request):
+        """
+        Return the entries, hits and misses of the Get and List response
+        cache.
+        """
+        if not self.orchestrator:
+            return json.dumps({})
+        return json.dumps(self.orchestrator.get_response_cache_stats())
+
+    @app.route("/Admin.InventoryCacheStats", methods=["GET", "POST"])
+    def admin_inventory_cache_stats(self, request):
+        """
+        Return the TTL, hits and misses per kind of array object of the
+        inventory cache of each block backend.
+        """
+        if not self.orchestrator:
+            return json.dumps({})
+        return json.dumps(self.orchestrator.get_inventory_cache_stats())
+
+    @app.route("/Admin.EtcdMemberHealth", methods=["GET", "POST"])
+    def admin_etcd_member_health(self, request):
+        """
+        Return whether each etcd member is considered healthy, that is
+        whether it served the requests sent to it recently.
+        """
+        orch = self.orchestrator or self._file_orchestrator
+        if not orch:
+            return json.dumps({})
+        return json.dumps(orch.get_etcd_member_health())
+
     @app.route("/VolumeDriver.Get", methods=["POST"])
     def volumedriver_get(self, name):
         """
         Return volume information.
 
-        :param unicode name: The name of the volume.
+        :param unicode name: The name of the volume. The details held by
+            the array are returned too if "Detail" is true.
 
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_get, name)
+
+    def _volumedriver_get(self, name):
         contents = json.loads(name.content.getvalue())
         qualified_name = contents['Name']
         tokens = qualified_name.split('/')
@@ -894,10 +1014,14 @@ class VolumePlugin(object):
         except exception.EtcdMetadataNotFound:
             pass
 
+        # Docker only needs the metadata. Other clients may ask for the
+        # details held by the array too
+        detail = bool(contents.get('Detail'))
         if self.orchestrator:
             return self.orchestrator.get_volume_snap_details(volname,
                                                              snapname,
-                                                             qualified_name)
+                                                             qualified_name,
+                                                             detail)
         return json.dumps({u"Err": ''})
 
     @app.route("/VolumeDriver.List", methods=["POST"])
@@ -909,14 +1033,13 @@ class VolumePlugin(object):
 
         :return: Result indicating success.
         """
+        return self._run_request(self._volumedriver_list, body)
+
+    def _volumedriver_list(self, body):
         share_list = self._req_router.list_objects()
 
-        volume_list = []
+        volume_entries = ''
         if self.orchestrator:
-            volume_list = self.orchestrator.volumedriver_list()
-
-        final_list = share_list + volume_list
-        if not final_list:
-            return json.dumps({u"Err": ''})
+            volume_entries = self.orchestrator.volumedriver_list()
 
-        return json.dumps({u"Err": '', u"Volumes": final_list})
+        return _encode_list_response(share_list, volume_entries)
@@ -0,0 +1,774 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Metadata stores the volume, share and file persona metadata clients of
+etcdutil can be backed by.
+
+A store exposes the part of the python-etcd client interface these
+clients use: hierarchical keys read, written, updated and deleted with
+the etcd v2 semantics (results, modified indexes, compare-and-swap
+conditions and exceptions), plus named locks. The etcd client is the
+default store. SqliteStore keeps the metadata in a local SQLite
+database for single node deployments. EtcdV3Store keeps it in etcd
+through the v3 API, whose transactions make multi-key writes atomic and
+whose leases make a lock cost a single round trip.
+"""
+
+import abc
+import base64
+import etcd
+import json
+import os
+import six
+import socket
+import sqlite3
+import threading
+import time
+import urllib3
+import uuid
+
+from urllib3.connection import HTTPConnection
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+STORE_ETCD = 'etcd'
+STORE_SQLITE = 'sqlite'
+STORE_ETCD3 = 'etcd3'
+
+# Seconds a connection waits for another writer of the database
+SQLITE_BUSY_TIMEOUT = 30
+# Longest pause in seconds between two attempts to take a busy lock
+SQLITE_LOCK_MAX_POLL = 0.1
+
+# Path of the etcd v3 JSON gateway (etcd 3.4 and later)
+ETCD3_API_PREFIX = '/v3'
+# Keys fetched per range request when listing a directory
+ETCD3_RANGE_PAGE_SIZE = 500
+# TTL in seconds of the lease the locks of the process are attached to.
+# It is kept alive while the process runs so that a lock outlives long
+# operations but is freed soon after its holder died
+ETCD3_LOCK_LEASE_TTL = 15
+ETCD3_LOCK_PREFIX = '/_locks/'
+# Longest pause in seconds between two attempts to take a busy lock
+ETCD3_LOCK_MAX_POLL = 0.2
+# Seconds to wait for an etcd member to answer a request
+ETCD3_REQUEST_TIMEOUT = 60
+
+
+def _prefix_end(prefix):
+    """Smallest key greater than all the keys starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _build_tree(key, rows, recursive):
+    """Builds the etcd v2 node of directory key
+
+    rows are the (key, value, is_dir, modified_index) tuples of the keys
+    below the directory, sorted by key.
+    """
+    prefix = key.rstrip('/') + '/'
+    root = {'key': key, 'dir': True, 'nodes': []}
+    dirs = {key: root}
+
+    def get_dir(dkey):
+        node = dirs.get(dkey)
+        if node is None:
+            node = {'key': dkey, 'dir': True, 'nodes': []}
+            dirs[dkey] = node
+            get_dir(dkey.rsplit('/', 1)[0] or '/')['nodes'].append(node)
+        return node
+
+    for k, value, is_dir, index in rows:
+        parts = k[len(prefix):].split('/')
+        if not recursive and len(parts) > 1:
+            # Only the sub-directory itself is listed
+            child = dirs.get(prefix + parts[0])
+            if child is None:
+                child = {'key': prefix + parts[0], 'dir': True}
+                dirs[child['key']] = child
+                root['nodes'].append(child)
+            continue
+        if is_dir:
+            node = get_dir(k)
+            node['modifiedIndex'] = node['createdIndex'] = index
+            if not recursive:
+                del node['nodes']
+        else:
+            get_dir(k.rsplit('/', 1)[0])['nodes'].append(
+                {'key': k, 'value': value, 'modifiedIndex': index,
+                 'createdIndex': index})
+    return root
+
+
+@six.add_metaclass(abc.ABCMeta)
+class MetadataStore(object):
+    @abc.abstractmethod
+    def read(self, key, recursive=False, **kwargs):
+        pass
+
+    @abc.abstractmethod
+    def write(self, key, value, dir=False, prevExist=None, prevIndex=None,
+              prevValue=None, **kwargs):
+        pass
+
+    @abc.abstractmethod
+    def update(self, obj):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key, recursive=None, dir=None, prevValue=None,
+               prevIndex=None, **kwargs):
+        pass
+
+    @abc.abstractmethod
+    def write_many(self, items):
+        """Writes (key, value) items, atomically if the store allows it"""
+        pass
+
+    @abc.abstractmethod
+    def get_lock(self, name):
+        pass
+
+
+class SqliteStore(MetadataStore):
+    """Metadata store kept in a SQLite database in WAL mode
+
+    Each thread uses its own connection. Writes run in immediate
+    transactions so that conditions are checked and the global modified
+    index is bumped atomically, also across processes sharing the file.
+    Watches are not supported.
+    """
+    supports_watch = False
+    supports_transactions = True
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS kv ('
+                     'key TEXT PRIMARY KEY, value TEXT, '
+                     'dir INTEGER NOT NULL DEFAULT 0, '
+                     'modified_index INTEGER NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                     'name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS locks ('
+                     'name TEXT PRIMARY KEY, owner TEXT NOT NULL, '
+                     'expires REAL NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('index', 0)")
+        LOG.info('Using SQLite metadata store %s', path)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are managed explicitly
+            conn = sqlite3.connect(self._path, timeout=SQLITE_BUSY_TIMEOUT,
+                                   isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    @staticmethod
+    def _normalize(key):
+        return '/' + key.strip('/')
+
+    @staticmethod
+    def _get_row(conn, key):
+        return conn.execute('SELECT value, dir, modified_index FROM kv '
+                            'WHERE key = ?', (key,)).fetchone()
+
+    @staticmethod
+    def _has_children(conn, key):
+        prefix = key.rstrip('/') + '/'
+        return conn.execute('SELECT 1 FROM kv WHERE key > ? AND key < ? '
+                            'LIMIT 1', (prefix, _prefix_end(prefix))
+                            ).fetchone() is not None
+
+    @staticmethod
+    def _current_index(conn):
+        return conn.execute("SELECT value FROM meta WHERE name = 'index'"
+                            ).fetchone()[0]
+
+    def _next_index(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 "
+                     "WHERE name = 'index'")
+        return self._current_index(conn)
+
+    def _tree(self, conn, key, recursive):
+        prefix = key.rstrip('/') + '/'
+        rows = conn.execute('SELECT key, value, dir, modified_index FROM kv '
+                            'WHERE key > ? AND key < ? ORDER BY key',
+                            (prefix, _prefix_end(prefix)))
+        return _build_tree(key, rows, recursive)
+
+    def read(self, key, recursive=False, wait=False, **kwargs):
+        if wait:
+            raise etcd.EtcdException('Watches are not supported by the '
+                                     'SQLite metadata store')
+        key = self._normalize(key)
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            row = self._get_row(conn, key)
+            if row is not None and not row[1]:
+                node = {'key': key, 'value': row[0],
+                        'modifiedIndex': row[2], 'createdIndex': row[2]}
+            elif row is not None or key == '/' or \
+                    self._has_children(conn, key):
+                node = self._tree(conn, key, recursive)
+                if row is not None:
+                    node['modifiedIndex'] = node['createdIndex'] = row[2]
+            else:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+            index = self._current_index(conn)
+        finally:
+            conn.execute('COMMIT')
+        result = etcd.EtcdResult('get', node)
+        result.etcd_index = index
+        return result
+
+    def write(self, key, value, dir=False, prevExist=None, prevIndex=None,
+              prevValue=None, ttl=None, **kwargs):
+        if ttl:
+            raise etcd.EtcdException('TTLs are not supported by the SQLite '
+                                     'metadata store')
+        key = self._normalize(key)
+        conn = self._transaction()
+        try:
+            row = self._get_row(conn, key)
+            exists = row is not None or self._has_children(conn, key)
+            if prevExist is False and exists:
+                raise etcd.EtcdAlreadyExist('Key already exists : %s' % key)
+            if (prevExist or prevIndex is not None or
+                    prevValue is not None) and row is None:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+            if exists and (dir or row is None or row[1]):
+                raise etcd.EtcdNotFile('Not a file : %s' % key)
+            if prevIndex is not None and row[2] != prevIndex:
+                raise etcd.EtcdCompareFailed(
+                    'Compare failed : [%s != %s]' % (prevIndex, row[2]))
+            if prevValue is not None and row[0] != prevValue:
+                raise etcd.EtcdCompareFailed(
+                    'Compare failed : [%s != %s]' % (prevValue, row[0]))
+
+            index = self._next_index(conn)
+            conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)',
+                         (key, None if dir else value, int(bool(dir)),
+                          index))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+        node = {'key': key, 'modifiedIndex': index, 'createdIndex': index}
+        if dir:
+            node['dir'] = True
+        else:
+            node['value'] = value
+        action = 'compareAndSwap' if prevIndex is not None or \
+            prevValue is not None else 'set'
+        return etcd.EtcdResult(action, node)
+
+    def update(self, obj):
+        kwargs = {'dir': obj.dir, 'prevExist': True}
+        if not obj.dir:
+            kwargs['prevIndex'] = obj.modifiedIndex
+        return self.write(obj.key, obj.value, **kwargs)
+
+    def delete(self, key, recursive=None, dir=None, prevValue=None,
+               prevIndex=None, **kwargs):
+        key = self._normalize(key)
+        conn = self._transaction()
+        try:
+            row = self._get_row(conn, key)
+            has_children = self._has_children(conn, key)
+            if row is None and not has_children:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+            if (has_children or (row and row[1])) and \
+                    not (recursive or (dir and not has_children)):
+                raise etcd.EtcdNotFile('Not a file : %s' % key)
+            if prevIndex is not None and (row is None or
+                                          row[2] != prevIndex):
+                raise etcd.EtcdCompareFailed(
+                    'Compare failed : [%s]' % prevIndex)
+            if prevValue is not None and (row is None or
+                                          row[0] != prevValue):
+                raise etcd.EtcdCompareFailed(
+                    'Compare failed : [%s]' % prevValue)
+
+            index = self._next_index(conn)
+            conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+            if recursive:
+                prefix = key.rstrip('/') + '/'
+                conn.execute('DELETE FROM kv WHERE key > ? AND key < ?',
+                             (prefix, _prefix_end(prefix)))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return etcd.EtcdResult('delete', {'key': key,
+                                          'modifiedIndex': index})
+
+    def write_many(self, items):
+        conn = self._transaction()
+        try:
+            index = self._next_index(conn)
+            for key, value in items:
+                key = self._normalize(key)
+                row = self._get_row(conn, key)
+                if (row is not None and row[1]) or \
+                        self._has_children(conn, key):
+                    raise etcd.EtcdNotFile('Not a file : %s' % key)
+                conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?, 0, ?)',
+                             (key, value, index))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return [etcd.EtcdResult('set', {'key': self._normalize(key),
+                                        'value': value,
+                                        'modifiedIndex': index,
+                                        'createdIndex': index})
+                for key, value in items]
+
+    def get_lock(self, name):
+        return SqliteLock(self, name)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PollingLock(object):
+    """Named lock taken by polling the store until it is free
+
+    Offers the part of the etcd.Lock interface used by EtcdLock.
+    Subclasses implement a single attempt to take, the refresh and the
+    release of the lock.
+    """
+    max_poll = SQLITE_LOCK_MAX_POLL
+
+    def __init__(self, store, name):
+        self._store = store
+        self.name = name
+        self._owner = uuid.uuid4().hex
+        self.is_acquired = False
+
+    def acquire(self, blocking=True, lock_ttl=3600, timeout=0):
+        deadline = time.time() + timeout if timeout else None
+        poll = 0.001
+        while True:
+            if self._try_acquire(lock_ttl):
+                self.is_acquired = True
+                return True
+            if not blocking or (deadline and time.time() >= deadline):
+                return False
+            time.sleep(poll)
+            poll = min(poll * 2, self.max_poll)
+
+    @abc.abstractmethod
+    def _try_acquire(self, lock_ttl):
+        pass
+
+    @abc.abstractmethod
+    def refresh(self, lock_ttl):
+        pass
+
+    @abc.abstractmethod
+    def release(self):
+        pass
+
+
+class SqliteLock(PollingLock):
+    """Named lock kept as a row of the SQLite store
+
+    A lock whose holder died is taken over once its TTL expired.
+    """
+
+    def _try_acquire(self, lock_ttl):
+        now = time.time()
+        conn = self._store._transaction()
+        try:
+            conn.execute('DELETE FROM locks WHERE name = ? AND expires < ?',
+                         (self.name, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO locks '
+                                  'VALUES (?, ?, ?)',
+                                  (self.name, self._owner, now + lock_ttl))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return cursor.rowcount == 1
+
+    def refresh(self, lock_ttl):
+        conn = self._store._transaction()
+        try:
+            conn.execute('UPDATE locks SET expires = ? '
+                         'WHERE name = ? AND owner = ?',
+                         (time.time() + lock_ttl, self.name, self._owner))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def release(self):
+        conn = self._store._transaction()
+        try:
+            conn.execute('DELETE FROM locks WHERE name = ? AND owner = ?',
+                         (self.name, self._owner))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self.is_acquired = False
+
+
+def _b64(text):
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def _unb64(data):
+    return base64.b64decode(data).decode('utf-8')
+
+
+def _compare(key, target, value, result='EQUAL'):
+    field = {'CREATE': 'create_revision', 'MOD': 'mod_revision',
+             'VERSION': 'version', 'VALUE': 'value'}[target]
+    if target == 'VALUE':
+        value = _b64(value)
+    return {'key': _b64(key), 'target': target, 'result': result,
+            field: value}
+
+
+def _put(key, value, lease=None):
+    request = {'key': _b64(key), 'value': _b64(value)}
+    if lease:
+        request['lease'] = lease
+    return {'request_put': request}
+
+
+def _delete(key, range_end=None):
+    request = {'key': _b64(key)}
+    if range_end:
+        request['range_end'] = _b64(range_end)
+    return {'request_delete_range': request}
+
+
+def _range(key):
+    return {'request_range': {'key': _b64(key)}}
+
+
+class EtcdV3Store(MetadataStore):
+    """Metadata store kept in etcd through the v3 API
+
+    The requests are sent to the JSON gateway of the etcd members, so no
+    gRPC client is needed. v3 keys are flat: a key is stored as is and a
+    directory as a marker key with a trailing '/', so that directories
+    keep the etcd v2 semantics the metadata clients rely on. Conditional
+    writes and deletes are single transactions whose failure branch reads
+    the key, which tells a missing key from a failed comparison without
+    another round trip. Watches are not supported.
+
+    Locks are keys attached to one lease per store that is kept alive by
+    a background thread. Taking a free lock and releasing it are one
+    transaction each.
+    """
+    supports_watch = False
+    supports_transactions = True
+
+    def __init__(self, hosts, protocol='http', cert=None, pool_size=None):
+        self._endpoints = ['%s://%s:%s' % (protocol, host, port)
+                           for host, port in hosts]
+        self._endpoints_lock = threading.Lock()
+        kwargs = {'maxsize': pool_size or 10,
+                  'socket_options':
+                      HTTPConnection.default_socket_options +
+                      [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]}
+        if cert:
+            kwargs['cert_file'], kwargs['key_file'] = cert
+        self._http = urllib3.PoolManager(num_pools=len(self._endpoints),
+                                         **kwargs)
+        self._lease_id = None
+        self._lease_lock = threading.Lock()
+        self._keepalive_thread = None
+        LOG.info('Using etcd v3 metadata store %s', self._endpoints)
+
+    def _call(self, path, payload):
+        """Posts payload to the gateway of the first reachable member"""
+        error = None
+        for _i in range(len(self._endpoints)):
+            endpoint = self._endpoints[0]
+            try:
+                response = self._http.request(
+                    'POST', endpoint + ETCD3_API_PREFIX + path,
+                    body=json.dumps(payload),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=ETCD3_REQUEST_TIMEOUT)
+            except (urllib3.exceptions.HTTPError, socket.error) as ex:
+                LOG.warning('etcd member %s is unreachable: %s',
+                            endpoint, ex)
+                error = ex
+                with self._endpoints_lock:
+                    if self._endpoints[0] == endpoint:
+                        self._endpoints.append(self._endpoints.pop(0))
+                continue
+            data = json.loads(response.data.decode('utf-8') or '{}')
+            if response.status != 200:
+                raise etcd.EtcdException(
+                    'etcd request %s failed: %s' %
+                    (path, data.get('error') or data.get('message')))
+            return data
+        raise etcd.EtcdConnectionFailed('No etcd member is reachable',
+                                        cause=error)
+
+    def _txn(self, compare, success, failure=None):
+        return self._call('/kv/txn', {'compare': compare,
+                                      'success': success,
+                                      'failure': failure or []})
+
+    @staticmethod
+    def _normalize(key):
+        return '/' + key.strip('/')
+
+    @staticmethod
+    def _revision(response):
+        return int(response['header']['revision'])
+
+    def _range_prefix(self, prefix):
+        """All the key-values below prefix
+
+        They are fetched in pages of a bounded size, all read at the
+        revision of the first one.
+        """
+        kvs = []
+        start = prefix
+        revision = None
+        while True:
+            request = {'key': _b64(start),
+                       'range_end': _b64(_prefix_end(prefix)),
+                       'limit': ETCD3_RANGE_PAGE_SIZE}
+            if revision:
+                request['revision'] = revision
+            response = self._call('/kv/range', request)
+            revision = revision or self._revision(response)
+            page = response.get('kvs', [])
+            kvs.extend(page)
+            if not response.get('more') or not page:
+                return kvs, revision
+            start = _unb64(page[-1]['key']) + '\0'
+
+    def read(self, key, recursive=False, wait=False, **kwargs):
+        if wait:
+            raise etcd.EtcdException('Watches are not supported by the '
+                                     'etcd v3 metadata store')
+        key = self._normalize(key)
+        response = self._call('/kv/range', {'key': _b64(key)})
+        if response.get('kvs'):
+            kv = response['kvs'][0]
+            node = {'key': key, 'value': _unb64(kv.get('value', '')),
+                    'modifiedIndex': int(kv['mod_revision']),
+                    'createdIndex': int(kv['create_revision'])}
+            index = self._revision(response)
+        else:
+            prefix = key.rstrip('/') + '/'
+            kvs, index = self._range_prefix(prefix)
+            if not kvs and key != '/':
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+            rows = []
+            marker_index = None
+            for kv in kvs:
+                k = _unb64(kv['key'])
+                if k == prefix:
+                    marker_index = int(kv['mod_revision'])
+                elif k.endswith('/'):
+                    rows.append((k[:-1], None, True,
+                                 int(kv['mod_revision'])))
+                else:
+                    rows.append((k, _unb64(kv.get('value', '')), False,
+                                 int(kv['mod_revision'])))
+            node = _build_tree(key, rows, recursive)
+            if marker_index is not None:
+                node['modifiedIndex'] = node['createdIndex'] = marker_index
+        result = etcd.EtcdResult('get', node)
+        result.etcd_index = index
+        return result
+
+    def write(self, key, value, dir=False, prevExist=None, prevIndex=None,
+              prevValue=None, ttl=None, **kwargs):
+        if ttl:
+            raise etcd.EtcdException('TTLs are not supported by the etcd v3 '
+                                     'metadata store')
+        key = self._normalize(key)
+        target = key.rstrip('/') + '/' if dir else key
+        value = '' if dir or value is None else str(value)
+        compare = []
+        if prevExist is False:
+            compare.append(_compare(target, 'CREATE', 0))
+        elif prevExist or prevIndex is not None or prevValue is not None:
+            compare.append(_compare(target, 'VERSION', 0, 'GREATER'))
+        if prevIndex is not None:
+            compare.append(_compare(target, 'MOD', prevIndex))
+        if prevValue is not None:
+            compare.append(_compare(target, 'VALUE', prevValue))
+
+        if compare:
+            response = self._txn(compare, [_put(target, value)],
+                                 [_range(target)])
+            if not response.get('succeeded'):
+                self._raise_compare_failed(key, response, prevExist)
+        else:
+            response = self._call('/kv/put', {'key': _b64(target),
+                                              'value': _b64(value)})
+        index = self._revision(response)
+
+        node = {'key': key, 'modifiedIndex': index, 'createdIndex': index}
+        if dir:
+            node['dir'] = True
+        else:
+            node['value'] = value
+        action = 'compareAndSwap' if prevIndex is not None or \
+            prevValue is not None else 'set'
+        return etcd.EtcdResult(action, node)
+
+    @staticmethod
+    def _raise_compare_failed(key, response, prevExist=None):
+        found = response['responses'][0]['response_range'].get('kvs')
+        if not found:
+            raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+        if prevExist is False:
+            raise etcd.EtcdAlreadyExist('Key already exists : %s' % key)
+        raise etcd.EtcdCompareFailed('Compare failed : %s' % key)
+
+    def update(self, obj):
+        kwargs = {'dir': obj.dir, 'prevExist': True}
+        if not obj.dir:
+            kwargs['prevIndex'] = obj.modifiedIndex
+        return self.write(obj.key, obj.value, **kwargs)
+
+    def delete(self, key, recursive=None, dir=None, prevValue=None,
+               prevIndex=None, **kwargs):
+        key = self._normalize(key)
+        prefix = key.rstrip('/') + '/'
+        if recursive:
+            response = self._txn([], [_delete(key),
+                                      _delete(prefix, _prefix_end(prefix))])
+            deleted = sum(int(r['response_delete_range'].get('deleted', 0))
+                          for r in response['responses'])
+            if not deleted:
+                raise etcd.EtcdKeyNotFound('Key not found : %s' % key)
+        else:
+            target = prefix if dir else key
+            compare = [_compare(target, 'VERSION', 0, 'GREATER')]
+            if prevIndex is not None:
+                compare.append(_compare(target, 'MOD', prevIndex))
+            if prevValue is not None:
+                compare.append(_compare(target, 'VALUE', prevValue))
+            response = self._txn(compare, [_delete(target)],
+                                 [_range(target)])
+            if not response.get('succeeded'):
+                self._raise_compare_failed(key, response)
+        return etcd.EtcdResult('delete', {
+            'key': key, 'modifiedIndex': self._revision(response)})
+
+    def write_many(self, items):
+        items = [(self._normalize(key), str(value)) for key, value in items]
+        response = self._txn([], [_put(key, value) for key, value in items])
+        index = self._revision(response)
+        return [etcd.EtcdResult('set', {'key': key, 'value': value,
+                                        'modifiedIndex': index,
+                                        'createdIndex': index})
+                for key, value in items]
+
+    def get_lock(self, name):
+        return EtcdV3Lock(self, name)
+
+    def _get_lease(self):
+        with self._lease_lock:
+            if self._lease_id is None:
+                response = self._call('/lease/grant',
+                                      {'TTL': ETCD3_LOCK_LEASE_TTL})
+                self._lease_id = response['ID']
+                LOG.info('Granted lock lease %s', self._lease_id)
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(
+                    target=self._keep_lease_alive,
+                    name='etcd3-lease-keepalive')
+                self._keepalive_thread.daemon = True
+                self._keepalive_thread.start()
+            return self._lease_id
+
+    def _keep_lease_alive(self):
+        while True:
+            time.sleep(ETCD3_LOCK_LEASE_TTL / 3.0)
+            lease_id = self._lease_id
+            try:
+                response = self._call('/lease/keepalive', {'ID': lease_id})
+            except Exception as ex:
+                LOG.warning('Failed to keep lock lease %s alive: %s',
+                            lease_id, ex)
+                continue
+            if int(response.get('result', {}).get('TTL', 0)) <= 0:
+                # A new lease is granted with the next lock
+                LOG.error('Lock lease %s expired, the locks held by this '
+                          'process were lost', lease_id)
+                self._drop_lease(lease_id)
+
+    def _drop_lease(self, lease_id):
+        with self._lease_lock:
+            if self._lease_id == lease_id:
+                self._lease_id = None
+
+
+class EtcdV3Lock(PollingLock):
+    """Named lock kept as an etcd v3 key attached to the store lease
+
+    The lock lives as long as the lease, that is until it is released or
+    its holder stops keeping the lease alive. lock_ttl is hence unused.
+    """
+    max_poll = ETCD3_LOCK_MAX_POLL
+
+    def __init__(self, store, name):
+        super(EtcdV3Lock, self).__init__(store, name)
+        self._key = ETCD3_LOCK_PREFIX + name
+
+    def _try_acquire(self, lock_ttl):
+        lease_id = self._store._get_lease()
+        try:
+            response = self._store._txn(
+                [_compare(self._key, 'CREATE', 0)],
+                [_put(self._key, self._owner, lease_id)])
+        except etcd.EtcdException as ex:
+            if 'lease not found' not in str(ex):
+                raise
+            # Expired before the keep-alive thread noticed it
+            self._store._drop_lease(lease_id)
+            return False
+        return bool(response.get('succeeded'))
+
+    def refresh(self, lock_ttl):
+        # The store keeps the lease alive
+        pass
+
+    def release(self):
+        self._store._txn([_compare(self._key, 'VALUE', self._owner)],
+                         [_delete(self._key)])
+        self.is_acquired = False
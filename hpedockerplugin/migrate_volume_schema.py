@@ -0,0 +1,54 @@
+# (c) Copyright [2016] Hewlett Packard Enterprise Development LP
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Upgrades the volume metadata stored in etcd to the current schema version
+in place. Run it once all the plugin instances using the etcd cluster have
+been upgraded:
+
+    python -m hpedockerplugin.migrate_volume_schema \
+        --config-file /etc/hpedockerplugin/hpe.conf
+
+Volumes are migrated one at a time under their volume lock, so plugin
+instances may keep serving requests meanwhile. They need no restart: they
+read the schema version again when they create a volume and keep doing so
+until it is the current one.
+"""
+
+import sys
+
+from config import setupcfg
+import hpedockerplugin.etcdutil as util
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    host_config = setupcfg.get_host_config(argv)
+    etcd_util = util.EtcdUtil(
+        host_config.host_etcd_ip_address,
+        host_config.host_etcd_port_number,
+        host_config.host_etcd_client_cert,
+        host_config.host_etcd_client_key,
+        store=host_config.host_metadata_store,
+        store_path=host_config.host_metadata_store_path)
+    migrated = etcd_util.migrate_volume_schema()
+    print('Migrated %s volumes to schema version %s. Running plugin '
+          'instances create new volumes with it from now on' %
+          (migrated, util.VOLUME_SCHEMA_SPLIT_STATE))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
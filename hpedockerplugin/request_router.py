@@ -2,6 +2,7 @@ from oslo_log import log as logging
 
 from hpedockerplugin import exception
 from hpedockerplugin import request_context as req_ctxt
+import hpedockerplugin.etcdutil as util
 import hpedockerplugin.synchronization as synchronization
 
 LOG = logging.getLogger(__name__)
@@ -13,6 +14,7 @@ class RequestRouter(object):
                                'file': kwargs.get('file_orchestrator')}
         # TODO: Workaround just to help unit-test framework to work
         # To be fixed later
+        self._etcd = None
         if self._orchestrators['volume']:
             self._etcd = self._orchestrators['volume']._etcd_client
         elif self._orchestrators['file']:
@@ -40,8 +42,68 @@ class RequestRouter(object):
             LOG.error(msg)
             raise exception.InvalidInput(msg)
 
-    @synchronization.synchronized_fp_share('{name}')
+    def get_persona(self, name):
+        """Returns the persona of the object having the name
+
+        :return: PERSONA_VOLUME, PERSONA_FILE or None for a name not in the
+            name index and not a share
+        """
+        entry = self._lookup_name(name)
+        if entry:
+            return entry['persona']
+        if self._name_index_complete():
+            return None
+
+        # The index may miss names until it is marked complete. Only
+        # shares need to be told apart
+        orch = self._orchestrators['file']
+        if orch:
+            try:
+                share = orch.get_meta_data_by_name(name)
+            except exception.EtcdMetadataNotFound:
+                share = None
+            if share:
+                LOG.info("Share '%s' missing in name index. Adding "
+                         "it..." % name)
+                self._etcd.add_name(name, util.PERSONA_FILE,
+                                    share.get('backend'), share.get('id'))
+                return util.PERSONA_FILE
+        return None
+
+    def _lookup_name(self, name):
+        if self._etcd:
+            return self._etcd.lookup_name(name)
+        return None
+
+    def _name_index_complete(self):
+        return bool(self._etcd and self._etcd.name_index_complete())
+
+    def name_exists(self, name):
+        if self._lookup_name(name):
+            return True
+        if self._name_index_complete():
+            return False
+        # Objects of an older plugin version are only found by probing
+        # until the index is marked complete
+        return bool((self._orchestrators['volume'] and
+                     self._orchestrators['volume'].volume_exists(name)) or
+                    (self._orchestrators['file'] and
+                     self._orchestrators['file'].share_exists(name)))
+
+    def _is_share(self, name):
+        return self.get_persona(name) == util.PERSONA_FILE
+
+    # Only requests for shares take the share lock, so that the requests
+    # for volumes never queue behind a share mount of the same name.
+    # Whether the name is a share is checked again under the lock
     def route_remove_request(self, name):
+        if not self._is_share(name):
+            raise exception.EtcdMetadataNotFound(
+                "Remove failed: '%s' doesn't exist" % name)
+        return self._route_remove_request(name)
+
+    @synchronization.synchronized_fp_share('{name}')
+    def _route_remove_request(self, name):
         orch = self._orchestrators['file']
         if orch:
             meta_data = orch.get_meta_data_by_name(name)
@@ -55,8 +117,14 @@ class RequestRouter(object):
         raise exception.EtcdMetadataNotFound(
             "Remove failed: '%s' doesn't exist" % name)
 
-    @synchronization.synchronized_fp_share('{name}')
     def route_mount_request(self, name, mount_id):
+        if not self._is_share(name):
+            raise exception.EtcdMetadataNotFound(
+                "Mount failed: '%s' doesn't exist" % name)
+        return self._route_mount_request(name, mount_id)
+
+    @synchronization.synchronized_fp_share('{name}')
+    def _route_mount_request(self, name, mount_id):
         orch = self._orchestrators['file']
         if orch:
             meta_data = orch.get_meta_data_by_name(name)
@@ -70,8 +138,14 @@ class RequestRouter(object):
         raise exception.EtcdMetadataNotFound(
             "Mount failed: '%s' doesn't exist" % name)
 
-    @synchronization.synchronized_fp_share('{name}')
     def route_unmount_request(self, name, mount_id):
+        if not self._is_share(name):
+            raise exception.EtcdMetadataNotFound(
+                "Unmount failed: '%s' doesn't exist" % name)
+        return self._route_unmount_request(name, mount_id)
+
+    @synchronization.synchronized_fp_share('{name}')
+    def _route_unmount_request(self, name, mount_id):
         orch = self._orchestrators['file']
         if orch:
             meta_data = orch.get_meta_data_by_name(name)
@@ -93,9 +167,11 @@ class RequestRouter(object):
     #             return orch.list_objects()
     #     # TODO: Check if we need to return empty response here?
 
+    # Get, Path and List are read-only and take no lock. They hence never
+    # wait for a mount or unmount in progress
     def get_object_details(self, name):
         orch = self._orchestrators['file']
-        if orch:
+        if orch and self._is_share(name):
             meta_data = orch.get_meta_data_by_name(name)
             if meta_data:
                 return orch.get_object_details(meta_data)
@@ -110,7 +186,7 @@ class RequestRouter(object):
 
     def route_get_path_request(self, name):
         orch = self._orchestrators['file']
-        if orch:
+        if orch and self._is_share(name):
             meta_data = orch.get_meta_data_by_name(name)
             if meta_data:
                 return orch.get_path(meta_data)
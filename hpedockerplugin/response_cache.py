@@ -0,0 +1,100 @@
+"""
+Short-lived cache of the responses to VolumeDriver.Get and List.
+
+Docker and orchestrators inspect volumes far more often than they change
+them, while answering a Get of a volume takes several calls to the array.
+Responses are kept for a few seconds by volume name. Requests changing a
+volume through this node drop its responses right away. Changes made by
+other nodes drop them when seen by the etcd watch, if the local mirror of
+etcd is enabled, or else when they expire.
+"""
+import json
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+LIST_KEY = ('list',)
+
+
+def encode_list_entries(objs):
+    """Returns the JSON of the objects separated by commas
+
+    objs may be a generator, so that only one object is held in memory
+    as a dictionary at a time. The List response is cached encoded that
+    way, as a single string.
+    """
+    return ', '.join(json.dumps(obj) for obj in objs)
+
+
+def cacheable(response):
+    """Only successful responses describing a volume are kept"""
+    try:
+        response = json.loads(response)
+    except (TypeError, ValueError):
+        return False
+    return not response.get('Err') and 'Volume' in response
+
+
+class ResponseCache(object):
+    def __init__(self, ttl, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (volume name, expiry, response)
+        self._entries = {}
+        # Bumped by every invalidation so that a response loaded while
+        # the volume was being changed is not kept
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._ttl > 0
+
+    def get_or_load(self, key, name, load, is_cacheable=cacheable):
+        """Returns the response cached for key or loads and caches it
+
+        :param name: Name of the volume the response is about. None for
+            responses about all the volumes
+        """
+        if not self.enabled:
+            return load()
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generation = self._generation
+        response = load()
+        if is_cacheable(response):
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (name, self._clock() + self._ttl,
+                                          response)
+        return response
+
+    def invalidate(self, name=None):
+        """Drops the responses about a volume and the List response
+
+        Everything is dropped if no name is given.
+        """
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self._entries = {}
+                return
+            self._entries = {k: v for k, v in self._entries.items()
+                             if v[0] is not None and v[0] != name}
+        LOG.debug('Dropped cached responses of %s' % name)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses}
@@ -1,26 +1,149 @@
+import bisect
 import inspect
 import json
+import string
+import threading
+import time
 
 from oslo_log import log as logging
 
+import hpedockerplugin.etcdutil as util
 import hpedockerplugin.exception as exception
 
 LOG = logging.getLogger(__name__)
 
+# Upper bounds in seconds of the buckets of the lock wait and hold time
+# histograms. Longer times fall in a last, unbounded bucket
+LOCK_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+# Entries of the hottest locks table
+HOT_LOCKS_TOP_N = 10
+# Lock names whose totals are kept. Once reached, only the half of them
+# waited for the longest is kept
+MAX_LOCK_NAMES = 1000
 
-def __synchronized(lock_type, lock_name, f, *a, **k):
-    call_args = inspect.getcallargs(f, *a, **k)
-    call_args['f_name'] = f.__name__
-    lck_name = lock_name.format(**call_args)
+
+class LockStats(object):
+    """Wait and hold times of the locks taken by the synchronized methods
+
+    Kept per lock type as histograms and per lock name as totals, from
+    which the locks waited for the longest are reported. Totals are kept
+    for at most MAX_LOCK_NAMES names.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._names = {}
+
+    def _type_stats(self, lock_type):
+        stats = self._types.get(lock_type)
+        if stats is None:
+            stats = {'acquired': 0, 'failed': 0,
+                     'wait': [0] * (len(LOCK_TIME_BUCKETS) + 1),
+                     'hold': [0] * (len(LOCK_TIME_BUCKETS) + 1)}
+            self._types[lock_type] = stats
+        return stats
+
+    def record_wait(self, lock_type, name, wait, acquired):
+        bucket = bisect.bisect_left(LOCK_TIME_BUCKETS, wait)
+        with self._lock:
+            stats = self._type_stats(lock_type)
+            stats['acquired' if acquired else 'failed'] += 1
+            stats['wait'][bucket] += 1
+            totals = self._names.get((lock_type, name))
+            if totals is None:
+                if len(self._names) >= MAX_LOCK_NAMES:
+                    self._prune_names()
+                totals = [0, 0.0, 0.0]
+                self._names[(lock_type, name)] = totals
+            totals[0] += 1
+            totals[1] += wait
+            totals[2] = max(totals[2], wait)
+
+    def _prune_names(self):
+        hottest = sorted(self._names.items(), key=lambda item: item[1][1],
+                         reverse=True)[:MAX_LOCK_NAMES // 2]
+        self._names = dict(hottest)
+
+    def record_hold(self, lock_type, hold):
+        bucket = bisect.bisect_left(LOCK_TIME_BUCKETS, hold)
+        with self._lock:
+            self._type_stats(lock_type)['hold'][bucket] += 1
+
+    def snapshot(self, top_n=HOT_LOCKS_TOP_N):
+        bounds = [str(b) for b in LOCK_TIME_BUCKETS] + ['+Inf']
+        with self._lock:
+            types = {}
+            for lock_type, stats in self._types.items():
+                types[lock_type] = {
+                    'acquired': stats['acquired'],
+                    'failed': stats['failed'],
+                    'wait_seconds': dict(zip(bounds, stats['wait'])),
+                    'hold_seconds': dict(zip(bounds, stats['hold']))}
+            hottest = sorted(self._names.items(), key=lambda item: item[1][1],
+                             reverse=True)[:top_n]
+        return {'lock_types': types,
+                'hottest_locks': [
+                    {'lock_type': lock_type, 'name': name,
+                     'acquires': totals[0], 'total_wait': totals[1],
+                     'max_wait': totals[2]}
+                    for (lock_type, name), totals in hottest]}
+
+
+lock_stats = LockStats()
+
+
+def _lock_name_builder(lock_name, f):
+    """Returns a function building the lock name of a call of f
+
+    The fields of the lock name template are resolved to the positions of
+    the arguments of f once, instead of binding all the arguments of every
+    call.
+    """
+    params = list(inspect.signature(f).parameters.values())
+    arg_names = [p.name for p in params]
+    fields = {}
+    for _text, field, _spec, _conv in string.Formatter().parse(lock_name):
+        if field is None or field == 'f_name':
+            continue
+        pos = arg_names.index(field)
+        fields[field] = (pos, params[pos].default)
+
+    def build(a, k):
+        values = {'f_name': f.__name__}
+        for field, (pos, default) in fields.items():
+            if field in k:
+                values[field] = k[field]
+            elif pos < len(a):
+                values[field] = a[pos]
+            else:
+                values[field] = default
+        return lock_name.format(**values)
+    return build
+
+
+def __synchronized(lock_type, build_lock_name, f, *a, **k):
+    lck_name = build_lock_name(a, k)
     lock_acquired = False
-    self = call_args['self']
+    self = a[0]
     lock = self._etcd.get_lock(lock_type, lck_name)
+    start = time.time()
     try:
-        lock.try_lock_name()
+        try:
+            lock.try_lock_name()
+        except Exception:
+            lock_stats.record_wait(lock_type, lck_name, time.time() - start,
+                                   False)
+            raise
+        acquired_at = time.time()
+        lock_stats.record_wait(lock_type, lck_name, acquired_at - start,
+                               True)
         lock_acquired = True
-        LOG.info('Lock acquired: [caller=%s, lock-name=%s]'
-                 % (f.__name__, lck_name))
-        return f(*a, **k)
+        LOG.info('Lock acquired: [caller=%s, lock-name=%s, wait=%.3fs]'
+                 % (f.__name__, lck_name, acquired_at - start))
+        # Metadata read under the lock is used to modify it. Hence don't
+        # allow it to come from a local mirror which may be lagging
+        with util.consistent_reads():
+            return f(*a, **k)
     except exception.HPEPluginLockFailed:
         LOG.exception('Lock acquire failed: [caller=%(caller)s, '
                       'lock-name=%(name)s]',
@@ -30,10 +153,12 @@ def __synchronized(lock_type, lock_name, f, *a, **k):
         return response
     finally:
         if lock_acquired:
+            hold = time.time() - acquired_at
+            lock_stats.record_hold(lock_type, hold)
             try:
                 lock.try_unlock_name()
-                LOG.info('Lock released: [caller=%s, lock-name=%s]' %
-                         (f.__name__, lck_name))
+                LOG.info('Lock released: [caller=%s, lock-name=%s, '
+                         'hold=%.3fs]' % (f.__name__, lck_name, hold))
             except exception.HPEPluginUnlockFailed:
                 LOG.exception('Lock release failed: [caller=%(caller)s'
                               ', lock-name=%(name)s]',
@@ -43,23 +168,29 @@ def __synchronized(lock_type, lock_name, f, *a, **k):
 
 def synchronized_volume(lock_name):
     def _synchronized(f):
+        build_lock_name = _lock_name_builder(lock_name, f)
+
         def _wrapped(*a, **k):
-            return __synchronized('VOL', lock_name, f, *a, **k)
+            return __synchronized('VOL', build_lock_name, f, *a, **k)
         return _wrapped
     return _synchronized
 
 
 def synchronized_rcg(lock_name):
     def _synchronized(f):
+        build_lock_name = _lock_name_builder(lock_name, f)
+
         def _wrapped(*a, **k):
-            return __synchronized('RCG', lock_name, f, *a, **k)
+            return __synchronized('RCG', build_lock_name, f, *a, **k)
         return _wrapped
     return _synchronized
 
 
 def synchronized_fp_share(lock_name):
     def _synchronized(f):
+        build_lock_name = _lock_name_builder(lock_name, f)
+
         def _wrapped(*a, **k):
-            return __synchronized('FP_SHARE', lock_name, f, *a, **k)
+            return __synchronized('FP_SHARE', build_lock_name, f, *a, **k)
         return _wrapped
     return _synchronized
@@ -13,6 +13,7 @@ from oslo_utils import netutils
 from oslo_utils import units
 from twisted.python.filepath import FilePath
 
+import hpedockerplugin.etcdutil as util
 import hpedockerplugin.exception as exception
 import hpedockerplugin.fileutil as fileutil
 import math
@@ -37,6 +38,34 @@ VolumeOwnedAndNotMounted = 1
 VolumeNotOwned = 2
 
 
+def _add_mount_ids(node_id, mount_ids):
+    """Change of a volume adding mount IDs of a node to node_mount_info"""
+    def add(vol):
+        node_mount_ids = vol.setdefault('node_mount_info', {}).setdefault(
+            node_id, [])
+        node_mount_ids.extend(mount_id for mount_id in mount_ids
+                              if mount_id not in node_mount_ids)
+    return add
+
+
+def _remove_mount_id(node_id, mount_id):
+    """Change of a volume removing a mount ID of a node
+
+    The node is removed from node_mount_info once it has no mount IDs
+    left and node_mount_info once it has no nodes left.
+    """
+    def remove(vol):
+        node_mount_info = vol.get('node_mount_info') or {}
+        node_mount_ids = node_mount_info.get(node_id, [])
+        if mount_id in node_mount_ids:
+            node_mount_ids.remove(mount_id)
+        if not node_mount_ids:
+            node_mount_info.pop(node_id, None)
+        if not node_mount_info:
+            vol.pop('node_mount_info', None)
+    return remove
+
+
 class VolumeManager(object):
     def __init__(self, host_config, hpepluginconfig, etcd_util,
                  node_id,
@@ -52,6 +81,8 @@ class VolumeManager(object):
         self._use_multipath = True
         self._enforce_multipath = True
         self._etcd = etcd_util
+        self._get_volume_detail = bool(
+            getattr(hpepluginconfig, 'hpe3par_get_volume_detail', False))
 
         self._initialize_configuration()
         self._pwd_decryptor = utils.PasswordDecryptor(backend_name,
@@ -186,6 +217,12 @@ class VolumeManager(object):
             LOG.error(msg)
             raise exception.HPEPluginNotInitializedException(reason=msg)
 
+    def get_inventory_cache_stats(self):
+        stats = {'primary': self._primary_driver.get_inventory_cache_stats()}
+        if self.tgt_bkend_config:
+            stats['remote'] = self._remote_driver.get_inventory_cache_stats()
+        return stats
+
     def _get_connector(self, hpepluginconfig):
         protocol = 'ISCSI'
         if 'HPE3PARFCDriver' in hpepluginconfig.hpedockerplugin_driver:
@@ -992,18 +1029,20 @@ class VolumeManager(object):
         LOG.debug("Get volume/snapshot: \n%s" % str(response))
         return response
 
-    def _get_snapshot_etcd_record(self, parent_volname, snapname):
+    def _get_snapshot_etcd_record(self, parent_volname, snapname,
+                                  detail=True):
         volumeinfo = self._etcd.get_vol_byname(parent_volname)
         snapshots = volumeinfo.get('snapshots', None)
-        if 'snap_cpg' in volumeinfo:
+        if 'snap_cpg' in volumeinfo or not detail:
             snapshot_cpg = volumeinfo.get('snap_cpg')
         else:
             snapshot_cpg = self._hpeplugin_driver.get_snapcpg(volumeinfo,
                                                               False)
         if snapshots:
-            self._sync_snapshots_from_array(volumeinfo['id'],
-                                            volumeinfo['snapshots'],
-                                            snapshot_cpg)
+            if detail:
+                self._sync_snapshots_from_array(volumeinfo['id'],
+                                                volumeinfo['snapshots'],
+                                                snapshot_cpg)
             snapinfo = self._etcd.get_vol_byname(snapname)
             LOG.debug('value of snapinfo from etcd read is %s', snapinfo)
             if snapinfo is None:
@@ -1012,8 +1051,10 @@ class VolumeManager(object):
                 LOG.debug(msg)
                 response = json.dumps({u"Err": msg})
                 return response
-            snapinfo['snap_cpg'] = snapshot_cpg
-            self._etcd.update_vol(snapinfo['id'], 'snap_cpg', snapshot_cpg)
+            if detail:
+                snapinfo['snap_cpg'] = snapshot_cpg
+                self._etcd.update_vol(snapinfo['id'], 'snap_cpg',
+                                      snapshot_cpg)
             return self._get_snapshot_response(snapinfo, snapname)
         else:
             msg = (_LE('Snapshot_get: snapname not found after sync %s'),
@@ -1022,8 +1063,16 @@ class VolumeManager(object):
             response = json.dumps({u"Err": msg})
             return response
 
-    def get_volume_snap_details(self, volname, snapname, qualified_name):
+    def get_volume_snap_details(self, volname, snapname, qualified_name,
+                                detail=False):
+        """Answers VolumeDriver.Get
 
+        The response is built from the metadata alone, unless the details
+        held by the array are asked for or hpe3par_get_volume_detail is
+        set. These are the QoS, flash cache, domain and RCG details, and
+        snapshots removed from the array are dropped from the metadata.
+        """
+        detail = detail or self._get_volume_detail
         volinfo = self._etcd.get_vol_byname(volname)
         LOG.info("Value of volinfo is: %s", volinfo)
         if volinfo is None:
@@ -1036,13 +1085,14 @@ class VolumeManager(object):
             snap_metadata = volinfo['snap_metadata']
             parent_volname = snap_metadata['parent_name']
             snapname = snap_metadata['name']
-            return self._get_snapshot_etcd_record(parent_volname, snapname)
-        if 'snap_cpg' not in volinfo:
+            return self._get_snapshot_etcd_record(parent_volname, snapname,
+                                                  detail)
+        if 'snap_cpg' not in volinfo and detail:
             snap_cpg = self._hpeplugin_driver.get_snapcpg(volinfo, False)
             if snap_cpg:
                 volinfo['snap_cpg'] = snap_cpg
                 self._etcd.update_vol(volinfo['id'], 'snap_cpg', snap_cpg)
-        if 'cpg' not in volinfo:
+        if 'cpg' not in volinfo and detail:
             volinfo['cpg'] = self._hpeplugin_driver.get_cpg(volinfo, False,
                                                             allowSnap=False)
             self._etcd.update_vol(volinfo['id'], 'cpg', volinfo['cpg'])
@@ -1062,7 +1112,8 @@ class VolumeManager(object):
                   'Devicename': devicename,
                   'Status': {}}
         snapshot_cpg = volinfo.get('snap_cpg', volinfo.get('cpg'))
-        if volinfo.get('snapshots') and volinfo.get('snapshots') != '':
+        if detail and volinfo.get('snapshots') and \
+                volinfo.get('snapshots') != '':
             self._sync_snapshots_from_array(volinfo['id'],
                                             volinfo['snapshots'], snapshot_cpg)
         # Is this request for snapshot inspect?
@@ -1098,11 +1149,12 @@ class VolumeManager(object):
                     ss_list_to_show.append(snapshot)
                 volume['Status'].update({'Snapshots': ss_list_to_show})
 
-            backend_vol_name = utils.get_3par_vol_name(volinfo['id'])
-            self._set_qos_and_flash_cache_info(backend_vol_name, volinfo)
+            if detail:
+                backend_vol_name = utils.get_3par_vol_name(volinfo['id'])
+                self._set_qos_and_flash_cache_info(backend_vol_name, volinfo)
 
             qos_name = volinfo.get('qos_name')
-            if qos_name is not None:
+            if qos_name is not None and detail:
                 try:
                     qos_detail = self._hpeplugin_driver.get_qos_detail(
                         qos_name)
@@ -1132,8 +1184,9 @@ class VolumeManager(object):
             vol_detail['cpg'] = volinfo.get('cpg')
             vol_detail['snap_cpg'] = volinfo.get('snap_cpg')
             vol_detail['backend'] = volinfo.get('backend')
-            vol_detail['domain'] = self._hpeplugin_driver.get_domain(
-                vol_detail['cpg'])
+            if detail:
+                vol_detail['domain'] = self._hpeplugin_driver.get_domain(
+                    vol_detail['cpg'])
 
             LOG.info(' get_volume_snap_details : adding 3par vol info')
             if '3par_vol_name' in volinfo:
@@ -1152,6 +1205,7 @@ class VolumeManager(object):
                 vol_detail['secondary_snap_cpg'] = \
                     self.tgt_bkend_config.hpe3par_snapcpg[0]
 
+            if volinfo.get('rcg_info') and detail:
                 # fetch rcg details and display
                 rcg_name = volinfo['rcg_info']['local_rcg_name']
                 try:
@@ -1172,10 +1226,8 @@ class VolumeManager(object):
         return response
 
     def list_volumes(self):
-        volumes = self._etcd.get_all_vols()
-
-        volumelist = []
-        for volinfo in volumes:
+        """Yield the List entries of all volumes one at a time"""
+        for volinfo in self._etcd.iter_vols():
             path_info = self._etcd.get_path_info_from_vol(volinfo)
             if path_info is not None and 'mount_dir' in path_info:
                 mountdir = path_info['mount_dir']
@@ -1188,9 +1240,7 @@ class VolumeManager(object):
                       'size': volinfo['size'],
                       'Mountpoint': mountdir,
                       'Status': {}}
-            volumelist.append(volume)
-
-        return volumelist
+            yield volume
 
     def get_path(self, volname):
         volinfo = self._etcd.get_vol_byname(volname)
@@ -1238,7 +1288,7 @@ class VolumeManager(object):
             # Failover case where volume is evicted from other node to this one
             return VolumeNotOwned
 
-    def _update_mount_id_list(self, vol, mount_id):
+    def _update_mount_id_list(self, vol, mount_id, vol_uow):
         node_mount_info = vol['node_mount_info']
 
         # Check if mount_id is unique
@@ -1249,17 +1299,37 @@ class VolumeManager(object):
 
         LOG.info("Adding new mount-id %s to node_mount_info..."
                  % mount_id)
-        node_mount_info[self._node_id].append(mount_id)
+        vol_uow.apply(_add_mount_ids(self._node_id, [mount_id]),
+                      'node_mount_info')
         LOG.info("Updating etcd with modified node_mount_info: %s..."
                  % node_mount_info)
-        self._etcd.update_vol(vol['id'],
-                              'node_mount_info',
-                              node_mount_info)
+        vol_uow.commit()
         LOG.info("Updated etcd with modified node_mount_info: %s!"
                  % node_mount_info)
 
+    @synchronization.synchronized_volume('{volname}')
+    def add_mount_ids(self, volname, mount_ids):
+        """Adds the mount IDs of mounts coalesced with a completed one"""
+        vol = self._etcd.get_vol_byname(volname)
+        node_mount_info = vol.get('node_mount_info') if vol else None
+        if not node_mount_info or self._node_id not in node_mount_info:
+            msg = "Volume %s is no longer mounted on this node" % volname
+            LOG.info(msg)
+            return json.dumps({"Err": msg})
+
+        mount_ids = [mount_id for mount_id in mount_ids
+                     if mount_id not in node_mount_info[self._node_id]]
+        if mount_ids:
+            vol_uow = util.VolumeUnitOfWork(self._etcd, vol)
+            LOG.info("Adding mount-ids %s to node_mount_info..."
+                     % mount_ids)
+            vol_uow.apply(_add_mount_ids(self._node_id, mount_ids),
+                          'node_mount_info')
+            vol_uow.commit()
+        return self._get_success_response(vol)
+
     def _get_success_response(self, vol):
-        path_info = json.loads(vol['path_info'])
+        path_info = util.load_path_info(vol['path_info'])
         path = FilePath(path_info['device_info']['path']).realpath()
         response = json.dumps({"Err": '', "Name": vol['display_name'],
                                "Mountpoint": path_info['mount_dir'],
@@ -1414,28 +1484,29 @@ class VolumeManager(object):
             raise exception.HPEPluginMountException(reason=msg)
 
         undo_steps = []
-        volid = vol['id']
+
+        # Metadata changes made by this request are written to etcd
+        # together once the mount outcome is known
+        vol_uow = util.VolumeUnitOfWork(self._etcd, vol)
 
         # Update volume metadata with the fields that may not be
         # there due to the fact that this volume might have been
         # created using an older version of plugin
         is_snap = False
         if 'is_snap' not in vol:
-            vol['is_snap'] = volume.DEFAULT_TO_SNAP_TYPE
-            self._etcd.update_vol(volid, 'is_snap', is_snap)
+            vol_uow.update('is_snap', volume.DEFAULT_TO_SNAP_TYPE)
         elif vol['is_snap']:
             is_snap = vol['is_snap']
             vol['fsOwner'] = vol['snap_metadata'].get('fsOwner')
             vol['fsMode'] = vol['snap_metadata'].get('fsMode')
 
         if 'mount_conflict_delay' not in vol:
-            m_conf_delay = volume.DEFAULT_MOUNT_CONFLICT_DELAY
-            vol['mount_conflict_delay'] = m_conf_delay
-            self._etcd.update_vol(volid, 'mount_conflict_delay',
-                                  m_conf_delay)
+            vol_uow.update('mount_conflict_delay',
+                           volume.DEFAULT_MOUNT_CONFLICT_DELAY)
         # Initialize node-mount-info if volume is being mounted
         # for the first time
-        if self._is_vol_not_mounted(vol):
+        first_mount = self._is_vol_not_mounted(vol)
+        if first_mount:
             LOG.info("Initializing node_mount_info... adding first "
                      "mount ID %s" % mount_id)
             node_mount_info = {self._node_id: [mount_id]}
@@ -1447,7 +1518,7 @@ class VolumeManager(object):
             flag = self._is_vol_mounted_on_this_node(node_mount_info, vol)
             # If mounted on this node itself then just append mount-id
             if flag == VolumeOwnedAndMounted:
-                self._update_mount_id_list(vol, mount_id)
+                self._update_mount_id_list(vol, mount_id, vol_uow)
                 return self._get_success_response(vol)
             elif flag == VolumeNotOwned:
                 # Volume mounted on different node
@@ -1487,8 +1558,10 @@ class VolumeManager(object):
                         old_path_info = updated_list
 
                     old_path_info.append((old_node_id, path_info))
-                    self._etcd.update_vol(volid, 'old_path_info',
-                                          old_path_info)
+                    # Persist it right away as VLUNs of the previous
+                    # node are gone even if this mount fails
+                    vol_uow.update('old_path_info', old_path_info)
+                    vol_uow.commit()
 
                 node_mount_info = {self._node_id: [mount_id]}
                 LOG.info("New node_mount_info set: %s" % node_mount_info)
@@ -1523,9 +1596,7 @@ class VolumeManager(object):
                                      % (dev_sym_link, mount_dir))
                             try:
                                 fileutil.mount_dir(dev_sym_link, mount_dir)
-                                self._etcd.update_vol(vol['id'],
-                                                      'path_info',
-                                                      json.dumps(path_info))
+                                vol_uow.update('path_info', path_info)
                             except Exception as ex:
                                 msg = "Mount volume failed: %s" % \
                                       six.text_type(ex)
@@ -1544,9 +1615,9 @@ class VolumeManager(object):
                                     # the new mount_id received
                                     node_mount_info[self._node_id] = \
                                         [mount_id]
-                                    self._etcd.update_vol(vol['id'],
-                                                          'node_mount_info',
-                                                          node_mount_info)
+                                    vol_uow.update('node_mount_info',
+                                                   node_mount_info)
+                            vol_uow.commit()
                             return self._get_success_response(vol)
                         else:
                             LOG.info("Symlink %s exists but corresponding "
@@ -1681,12 +1752,17 @@ class VolumeManager(object):
 
             LOG.info("Updating node_mount_info in etcd with mount_id %s..."
                      % mount_id)
-            self._etcd.update_vol(volid,
-                                  'node_mount_info',
-                                  node_mount_info)
+            if first_mount:
+                # Keeps the mount IDs of another node that mounted the
+                # volume in the meantime
+                vol_uow.apply(_add_mount_ids(self._node_id, [mount_id]),
+                              'node_mount_info')
+            else:
+                vol_uow.update('node_mount_info', node_mount_info)
+            vol_uow.update('path_info', path_info)
+            vol_uow.commit()
             LOG.info("node_mount_info updated successfully in etcd with "
                      "mount_id %s" % mount_id)
-            self._etcd.update_vol(volid, 'path_info', json.dumps(path_info))
 
             response = json.dumps({u"Err": '', u"Name": volname,
                                    u"Mountpoint": mount_dir,
@@ -1773,8 +1849,8 @@ class VolumeManager(object):
             LOG.error(msg)
             raise exception.HPEPluginUMountException(reason=msg)
 
-        volid = vol['id']
         is_snap = vol['is_snap']
+        vol_uow = util.VolumeUnitOfWork(self._etcd, vol)
 
         path_info = None
         node_owns_volume = True
@@ -1814,12 +1890,12 @@ class VolumeManager(object):
                     if len(vol['old_path_info']) == 0:
                         LOG.info("Last old_path_info found. "
                                  "Removing it too...")
-                        vol.pop('old_path_info')
-                    LOG.info("Updating volume meta-data: %s..." % vol)
-                    self._etcd.save_vol(vol)
-                    LOG.info("Volume meta-data updated: %s" % vol)
+                        vol_uow.remove('old_path_info')
+                    else:
+                        vol_uow.update('old_path_info',
+                                       vol['old_path_info'])
 
-                    path_info = json.loads(path_info[1])
+                    path_info = util.load_path_info(path_info[1])
                     LOG.info("Cleaning up devices using old_path_info: %s"
                              % path_info)
                 else:
@@ -1835,34 +1911,28 @@ class VolumeManager(object):
 
                 LOG.info("Current mount_id_list %s " % mount_id_list)
 
-                try:
-                    mount_id_list.remove(mount_id)
-                except ValueError as ex:
-                    LOG.exception('Ignoring exception: %s' % ex)
-                    pass
-
-                LOG.info("Updating node_mount_info '%s' in etcd..."
-                         % node_mount_info)
-                # Update the mount_id list in etcd
-                self._etcd.update_vol(volid, 'node_mount_info',
-                                      node_mount_info)
-
-                LOG.info("Updated node_mount_info '%s' in etcd!"
-                         % node_mount_info)
+                if mount_id not in mount_id_list:
+                    LOG.info("Mount-id %s not found in mount_id_list. "
+                             "Ignoring it" % mount_id)
+                # Removes node_mount_info along with the last mount-id
+                vol_uow.apply(_remove_mount_id(self._node_id, mount_id),
+                              'node_mount_info')
 
                 if len(mount_id_list) > 0:
                     # Don't proceed with unmount
+                    LOG.info("Updating node_mount_info '%s' in etcd..."
+                             % node_mount_info)
+                    vol_uow.commit()
                     LOG.info("Volume still in use by %s containers... "
                              "no unmounting done!" % len(mount_id_list))
                     return json.dumps({u"Err": ''})
                 else:
-                    # delete the node_id key from node_mount_info
-                    LOG.info("Removing node_mount_info %s",
+                    LOG.info("Removed node_mount_info %s",
                              node_mount_info)
-                    vol.pop('node_mount_info')
-                    LOG.info("Saving volume to etcd: %s..." % vol)
-                    self._etcd.save_vol(vol)
-                    LOG.info("Volume saved to etcd: %s!" % vol)
+
+        # Mount state changes must be persisted even if device cleanup
+        # below fails
+        vol_uow.commit()
 
         # TODO: Requirement #5 will bring the flow here but the below flow
         # may result into exception. Need to ensure it doesn't happen
@@ -1946,7 +2016,8 @@ class VolumeManager(object):
         # hosts at the same time.
         # If this node owns the volume then update path_info
         if node_owns_volume:
-            self._etcd.update_vol(volid, 'path_info', None)
+            vol_uow.update('path_info', None)
+            vol_uow.commit()
 
         LOG.info(_LI('path for volume: %(name)s, was successfully removed: '
                      '%(path_name)s'), {'name': volname,
@@ -0,0 +1,81 @@
+"""
+Bounded thread pools running the blocking work of the plugin.
+
+Each backend gets a pool of its own, so that an unresponsive array only
+ties up the threads serving it. Docker requests and file persona background
+work have pools of their own as well.
+"""
+from concurrent import futures
+import threading
+
+from oslo_log import log as logging
+from twisted.internet import defer
+from twisted.python import failure
+
+LOG = logging.getLogger(__name__)
+
+# Threads of a backend pool unless configured otherwise
+DEFAULT_BACKEND_THREADS = 10
+
+
+class WorkerPool(object):
+    """Thread pool with busy and queued work gauges"""
+    def __init__(self, reactor, name, size):
+        self.name = name
+        self.size = size
+        self._reactor = reactor
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+
+    def _run(self, f, *args, **kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def submit(self, f, *args, **kwargs):
+        """Runs f in the pool without waiting for its result"""
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._run, f, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future):
+        ex = future.exception()
+        if ex is not None:
+            LOG.error('Background work in %s failed: %s' % (self.name, ex))
+
+    def defer(self, f, *args, **kwargs):
+        """Runs f in the pool, returning a Deferred firing with its result
+
+        The Deferred fires in the reactor thread.
+        """
+        d = defer.Deferred()
+
+        def run():
+            try:
+                result = self._run(f, *args, **kwargs)
+            except BaseException:
+                self._reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                self._reactor.callFromThread(d.callback, result)
+
+        with self._lock:
+            self._queued += 1
+        self._executor.submit(run)
+        return d
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size,
+                    'busy': self._busy,
+                    'queued': self._queued,
+                    'utilization': float(self._busy) / self.size}
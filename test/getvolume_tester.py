@@ -17,7 +17,8 @@ class GetVolumeUnitTest(hpedockerunittest.HpeDockerUnitTestExecutor):
         mock_etcd.get_vol_byname.return_value = data.volume_with_snapshots
 
     def override_configuration(self, all_configs):
-        pass
+        for config in all_configs['block'][1].values():
+            config.hpe3par_get_volume_detail = True
 
 
 class TestGetVolumeWithQos(GetVolumeUnitTest):
@@ -82,6 +83,40 @@ class TestGetVolumeWithQos(GetVolumeUnitTest):
         mock_3parclient.queryQoSRule.assert_called()
 
 
+class TestGetVolumeDetailRequested(TestGetVolumeWithQos):
+    def get_request_params(self):
+        return {"Name": data.VOLUME_NAME,
+                "Detail": True}
+
+    def override_configuration(self, all_configs):
+        pass
+
+
+class TestGetVolumeFromMetadata(GetVolumeUnitTest):
+    def get_request_params(self):
+        return {"Name": data.VOLUME_NAME}
+
+    def override_configuration(self, all_configs):
+        pass
+
+    def setup_mock_objects(self):
+        mock_etcd = self.mock_objects['mock_etcd']
+        mock_etcd.get_vol_byname.return_value = copy.deepcopy(data.volume_qos)
+        mock_etcd.get_vol_path_info.return_value = None
+
+    def check_response(self, resp):
+        volume_detail = resp[u'Volume'][u'Status'][u'volume_detail']
+        self._test_case.assertNotIn(u'qos_detail', resp[u'Volume'][u'Status'])
+        self._test_case.assertNotIn(u'domain', volume_detail)
+        self._test_case.assertEqual(data.HPE3PAR_CPG2,
+                                    volume_detail[u'snap_cpg'])
+
+        # Nothing is read from the array
+        mock_3parclient = self.mock_objects['mock_3parclient']
+        mock_3parclient.queryQoSRule.assert_not_called()
+        mock_3parclient.findVolumeSet.assert_not_called()
+
+
 class TestGetVolumeWithGetQoSFails(GetVolumeUnitTest):
     def get_request_params(self):
         return {"Name": data.VOLUME_NAME,
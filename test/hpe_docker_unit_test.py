@@ -55,6 +55,8 @@ class HpeDockerUnitTestExecutor(object):
         req_body = self._get_request_body(self.get_request_params())
 
         _api = api.VolumePlugin(reactor, self._all_configs)
+        # Handlers run in the test thread, returning their response
+        _api._run_request = lambda handler, *args: handler(*args)
         try:
             resp = getattr(_api, plugin_api)(req_body)
             resp = json.loads(resp)
@@ -95,6 +97,8 @@ class HpeDockerUnitTestExecutor(object):
         req_body = self._get_request_body(self.get_request_params())
 
         _api = api.VolumePlugin(reactor, self._all_configs)
+        # Handlers run in the test thread, returning their response
+        _api._run_request = lambda handler, *args: handler(*args)
 
         if _api.orchestrator:
             _api.orchestrator._execute_request = \
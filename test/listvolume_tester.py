@@ -13,7 +13,7 @@ class ListVolumeUnitTest(hpedockerunittest.HpeDockerUnitTestExecutor):
 
     def setup_mock_objects(self):
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.get_all_vols.return_value = []
+        mock_etcd.iter_vols.return_value = []
 
     def override_configuration(self, config):
         pass
@@ -32,7 +32,7 @@ class TestListNoVolumes(ListVolumeUnitTest):
         mock_3parclient.getWsApiVersion.assert_called()
 
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.get_all_vols.assert_called()
+        mock_etcd.iter_vols.assert_called()
 
 
 class TestListVolumeDefault(ListVolumeUnitTest):
@@ -63,7 +63,7 @@ class TestListVolumeDefault(ListVolumeUnitTest):
         mock_3parclient.getWsApiVersion.assert_called()
 
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.get_all_vols.assert_called()
+        mock_etcd.iter_vols.assert_called()
         mock_etcd.get_path_info_from_vol.assert_called()
         self._test_case.assertEqual(
             mock_etcd.get_path_info_from_vol.call_count, 2)
@@ -73,4 +73,4 @@ class TestListVolumeDefault(ListVolumeUnitTest):
 
     def setup_mock_objects(self):
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.get_all_vols.return_value = data.vols_list
+        mock_etcd.iter_vols.return_value = data.vols_list
@@ -202,7 +202,7 @@ class TestMountVolumeFCHost(MountVolumeUnitTest):
             # lost+found directory removed or not
             mock_fileutil.remove_dir.assert_called()
 
-            mock_etcd.update_vol.assert_called()
+            mock_etcd.update_vol_fields.assert_called()
 
             mock_protocol_connector = \
                 self.mock_objects['mock_protocol_connector']
@@ -272,7 +272,7 @@ class TestMountVolumeFCHostVLUNExists(MountVolumeUnitTest):
 
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         mock_protocol_connector = self.mock_objects['mock_protocol_connector']
         mock_protocol_connector.connect_volume.assert_called()
@@ -347,7 +347,7 @@ class TestMountVolumeNoFCHostNoVLUN(MountVolumeUnitTest):
         # be moved to base class
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         # TODO: This is common check across all TCs and can
         # be moved to base class
@@ -467,7 +467,7 @@ class TestMountVolumeISCSIHostNoVLUN(MountVolumeUnitTest):
 
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         mock_protocol_connector = self.mock_objects['mock_protocol_connector']
         mock_protocol_connector.connect_volume.assert_called()
@@ -534,7 +534,7 @@ class TestMountVolumeISCSIHostVLUNExist(MountVolumeUnitTest):
 
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         mock_protocol_connector = self.mock_objects['mock_protocol_connector']
         mock_protocol_connector.connect_volume.assert_called()
@@ -615,7 +615,7 @@ class TestMountVolumeISCSIHostChapOn(MountVolumeUnitTest):
 
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         mock_protocol_connector = self.mock_objects['mock_protocol_connector']
         mock_protocol_connector.connect_volume.assert_called()
@@ -747,7 +747,7 @@ class TestMountVolumeNoISCSIHostNoVLUN(MountVolumeUnitTest):
         # be moved to base class
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         # TODO: This is common check across all TCs and can
         # be moved to base class
@@ -983,7 +983,7 @@ class TestVolFencingForcedUnmount(MountVolumeUnitTest):
         self._test_case.assertEqual(resp['Devicename'], u'/tmp')
 
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         # Check if these functions were actually invoked
         # in the flow or not
@@ -1157,7 +1157,7 @@ class TestMountPreviousVersionVolumeFCHost(MountVolumeUnitTest):
 
         mock_etcd = self.mock_objects['mock_etcd']
         mock_etcd.get_vol_byname.assert_called()
-        mock_etcd.update_vol.assert_called()
+        mock_etcd.update_vol_fields.assert_called()
 
         mock_protocol_connector = self.mock_objects['mock_protocol_connector']
         mock_protocol_connector.connect_volume.assert_called()
@@ -110,6 +110,12 @@ def mock_decorator(func):
             mock_create_file_client.return_value = mock_file_client
             mock_get_etcd_client.return_value = mock_share_etcd
             mock_get_fp_etcd_client.return_value = mock_fp_etcd
+            # Names are not in the name index. Requests are hence routed
+            # by probing the personas
+            mock_etcd.lookup_name.return_value = None
+            mock_share_etcd.lookup_name.return_value = None
+            mock_etcd.name_index_complete.return_value = False
+            mock_share_etcd.name_index_complete.return_value = False
             mock_file_client.http = mock.Mock(spec=http.HTTPJSONRESTClient)
 
             mock_objects = {
@@ -0,0 +1,57 @@
+from testtools import TestCase
+from twisted.internet import task
+
+from hpedockerplugin import admission
+from hpedockerplugin import exception
+
+
+class TestAdmissionController(TestCase):
+    def setUp(self):
+        super(TestAdmissionController, self).setUp()
+        self.clock = task.Clock()
+
+    def _admit(self, controller, operation, backend):
+        results = []
+        d = controller.admit(operation, backend)
+        d.addBoth(results.append)
+        return results
+
+    def test_requests_beyond_burst_queued(self):
+        controller = admission.AdmissionController(
+            self.clock, backend_rate=2, backend_burst=2)
+
+        admitted = [self._admit(controller, 'unmount', 'DEFAULT')
+                    for _i in range(4)]
+
+        self.assertEqual([[None], [None], [], []], admitted)
+        self.assertEqual(2, controller.snapshot()['DEFAULT']['queue_depth'])
+        self.clock.advance(0.5)
+        self.assertEqual([None], admitted[2])
+        self.assertEqual([], admitted[3])
+        self.clock.advance(0.5)
+        self.assertEqual([None], admitted[3])
+        self.assertEqual({'admitted': 4, 'queued': 2, 'rejected': 0,
+                          'queue_depth': 0},
+                         controller.snapshot()['DEFAULT'])
+
+    def test_rejected_when_queue_full(self):
+        controller = admission.AdmissionController(
+            self.clock, backend_rate=1, backend_burst=1, max_queue=1)
+
+        admitted = [self._admit(controller, 'mount', 'DEFAULT')
+                    for _i in range(3)]
+
+        self.assertEqual([None], admitted[0])
+        self.assertEqual([], admitted[1])
+        admitted[2][0].trap(exception.AdmissionRejected)
+        # Other backends are not affected
+        self.assertEqual([None], self._admit(controller, 'mount', 'B3'))
+
+    def test_operation_rate_shared_by_backends(self):
+        controller = admission.AdmissionController(
+            self.clock, backend_rate=0, backend_burst=1,
+            operation_rates={'remove': '1'})
+
+        self.assertEqual([None], self._admit(controller, 'remove', 'B1'))
+        self.assertEqual([], self._admit(controller, 'remove', 'B2'))
+        self.assertEqual([None], self._admit(controller, 'mount', 'B3'))
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+
+from testtools import TestCase
+
+from hpedockerplugin import coalescing
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestSingleFlight(TestCase):
+    def test_concurrent_calls_share_result(self):
+        single_flight = coalescing.SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def get(name):
+            calls.append(name)
+            release.wait(5)
+            return 'details of %s' % name
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(
+                single_flight.do(('get', 'vol1'), get, 'vol1')))
+            for _i in range(3)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: len(single_flight._calls) == 1 and calls)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(['vol1'], calls)
+        self.assertEqual(['details of vol1'] * 3, results)
+        # Calls made afterwards are not served the old result
+        single_flight.do(('get', 'vol1'), get, 'vol1')
+        self.assertEqual(2, len(calls))
+
+
+class TestMountCoalescer(TestCase):
+    def setUp(self):
+        super(TestMountCoalescer, self).setUp()
+        self.coalescer = coalescing.MountCoalescer()
+        self.release = threading.Event()
+        self.mounts = []
+        self.added = []
+        self.results = {}
+
+    def _mount(self, mount_id, response):
+        def mount():
+            self.mounts.append(mount_id)
+            if mount_id == 'm1':
+                self.release.wait(5)
+            return response
+
+        def add_mount_ids(mount_ids):
+            self.added.append(mount_ids)
+            return json.dumps({'Err': '', 'Mountpoint': '/mnt'})
+
+        self.results[mount_id] = self.coalescer.mount(
+            'vol1', mount_id, mount, add_mount_ids)
+
+    def _mount_concurrently(self, leader_response):
+        leader = threading.Thread(target=self._mount,
+                                  args=('m1', leader_response))
+        leader.start()
+        _wait_for(lambda: self.mounts)
+        followers = [threading.Thread(
+            target=self._mount,
+            args=(mount_id, json.dumps({'Err': ''})))
+            for mount_id in ('m2', 'm3')]
+        for follower in followers:
+            follower.start()
+        _wait_for(lambda: len(self.coalescer._batches['vol1'].mount_ids) == 2)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+    def test_mount_ids_added_in_one_write(self):
+        self._mount_concurrently(json.dumps({'Err': '', 'Mountpoint': '/mnt'}))
+
+        self.assertEqual(['m1'], self.mounts)
+        self.assertEqual([['m2', 'm3']], [sorted(ids) for ids in self.added])
+        self.assertEqual('/mnt', json.loads(self.results['m3'])['Mountpoint'])
+
+    def test_followers_mount_if_mount_fails(self):
+        self._mount_concurrently(json.dumps({'Err': 'failed'}))
+
+        self.assertEqual(['m1', 'm2', 'm3'], sorted(self.mounts))
+        self.assertEqual([], self.added)
@@ -0,0 +1,724 @@
+import etcd
+import json
+import mock
+import socket
+from testtools import TestCase
+import threading
+import time
+
+from hpedockerplugin import etcdutil as util
+from hpedockerplugin import exception
+
+
+class _FakeEtcdResult(object):
+    def __init__(self, key, value=None, dir=False, children=None,
+                 modifiedIndex=1, action='get', etcd_index=1):
+        self.key = key
+        self.value = value
+        self.dir = dir
+        self._children = children or []
+        self.modifiedIndex = modifiedIndex
+        self.action = action
+        self.etcd_index = etcd_index
+
+    @property
+    def children(self):
+        return self._children
+
+    @property
+    def leaves(self):
+        return self._children
+
+
+class FakeEtcdClient(object):
+    """In-memory stand-in for etcd.Client supporting the v2 calls used"""
+    def __init__(self, *args, **kwargs):
+        self.store = {}
+        self.dirs = set()
+        self.index = 0
+        self.reads = []
+
+    def read(self, key, recursive=False, wait=False, **kwargs):
+        if wait:
+            time.sleep(0.01)
+            raise etcd.EtcdWatchTimedOut()
+        key = key.rstrip('/')
+        self.reads.append(key)
+        if key in self.dirs:
+            children = [_FakeEtcdResult(k, v[0], modifiedIndex=v[1])
+                        for k, v in sorted(self.store.items())
+                        if k.startswith(key + '/')]
+            return _FakeEtcdResult(key, dir=True, children=children,
+                                   etcd_index=self.index)
+        if key not in self.store:
+            raise etcd.EtcdKeyNotFound()
+        value, index = self.store[key]
+        return _FakeEtcdResult(key, value, modifiedIndex=index)
+
+    def write(self, key, value, dir=False, prevExist=None, prevIndex=None,
+              **kwargs):
+        key = key.rstrip('/')
+        exists = key in self.store or key in self.dirs
+        if prevExist is False and exists:
+            raise etcd.EtcdAlreadyExist()
+        if prevIndex is not None and \
+                self.store.get(key, (None, None))[1] != prevIndex:
+            raise etcd.EtcdCompareFailed()
+        self.index += 1
+        if dir:
+            self.dirs.add(key)
+        else:
+            self.store[key] = (value, self.index)
+        return _FakeEtcdResult(key, value, modifiedIndex=self.index)
+
+    def update(self, result):
+        return self.write(result.key, result.value)
+
+    def write_many(self, items):
+        return [self.write(key, value) for key, value in items]
+
+    def delete(self, key, prevValue=None, **kwargs):
+        key = key.rstrip('/')
+        if key not in self.store:
+            raise etcd.EtcdKeyNotFound()
+        if prevValue is not None and self.store[key][0] != prevValue:
+            raise etcd.EtcdCompareFailed()
+        self.index += 1
+        del self.store[key]
+        return _FakeEtcdResult(key, modifiedIndex=self.index)
+
+
+def _fake_etcd_client(*args, **kwargs):
+    return FakeEtcdClient()
+
+
+class TestVolumeNameIndex(TestCase):
+    def setUp(self):
+        super(TestVolumeNameIndex, self).setUp()
+        patcher = mock.patch.object(util, 'get_etcd_client',
+                                    side_effect=_fake_etcd_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _vol(vol_id, name):
+        return {'id': vol_id, 'name': vol_id, 'display_name': name}
+
+    def test_get_vol_byname_uses_index(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        etcd_util.save_vol(self._vol('id1', 'vol1'))
+        etcd_util.save_vol(self._vol('id2', 'vol2'))
+        etcd_util.client.reads = []
+
+        vol = etcd_util.get_vol_byname('vol2')
+
+        self.assertEqual('id2', vol['id'])
+        self.assertNotIn(util.VOLUMEROOT, etcd_util.client.reads)
+
+    @staticmethod
+    def _indexed_id(client, name):
+        value = client.store[util.VOLUME_NAME_INDEX_ROOT + '/' + name][0]
+        return json.loads(value)['id']
+
+    def test_backfill_existing_volumes(self):
+        client = FakeEtcdClient()
+        client.dirs.add(util.VOLUMEROOT)
+        client.store[util.VOLUMEROOT + '/id1'] = \
+            (json.dumps(self._vol('id1', 'vol1')), 1)
+        with mock.patch.object(util, 'get_etcd_client', return_value=client):
+            etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+
+        self.assertEqual('id1', self._indexed_id(client, 'vol1'))
+        self.assertEqual('id1', etcd_util.get_vol_byname('vol1')['id'])
+
+    def test_index_completed_by_operator(self):
+        client = FakeEtcdClient()
+        client.dirs.update([util.VOLUMEROOT, util.VOLUME_NAME_INDEX_ROOT])
+        with mock.patch.object(util, 'get_etcd_client', return_value=client):
+            etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        # Saved by an older plugin version, without an index entry
+        client.store[util.VOLUMEROOT + '/id1'] = \
+            (json.dumps(self._vol('id1', 'vol1')), 1)
+
+        self.assertFalse(etcd_util.name_index_complete())
+        self.assertEqual((1, 1), etcd_util.complete_name_index())
+        self.assertEqual('id1', self._indexed_id(client, 'vol1'))
+        self.assertTrue(etcd_util.name_index_complete())
+
+    def test_miss_in_incomplete_index_scanned(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        etcd_util.client.reads = []
+
+        self.assertIsNone(etcd_util.get_vol_byname('vol1'))
+        self.assertIn(util.VOLUMEROOT, etcd_util.client.reads)
+
+    def test_miss_in_complete_index_not_scanned(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        etcd_util.save_vol(self._vol('id1', 'vol1'))
+        etcd_util.complete_name_index()
+        etcd_util.client.reads = []
+
+        self.assertIsNone(etcd_util.get_vol_byname('vol2'))
+        self.assertEqual('vol1',
+                         etcd_util.get_vol_byname('id1')['display_name'])
+        self.assertNotIn(util.VOLUMEROOT, etcd_util.client.reads)
+
+    def test_unindexed_volume_found_by_scan(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        client = etcd_util.client
+        client.store[util.VOLUMEROOT + '/id1'] = \
+            (json.dumps(self._vol('id1', 'vol1')), 1)
+
+        self.assertEqual('id1', etcd_util.get_vol_byname('vol1')['id'])
+        self.assertEqual('id1', self._indexed_id(client, 'vol1'))
+
+    def test_failed_index_write_does_not_fail_save(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        etcd_util.complete_name_index()
+        client = etcd_util.client
+        write = client.write
+
+        def failing_write(key, value, **kwargs):
+            if key.startswith(util.VOLUME_NAME_INDEX_ROOT + '/'):
+                raise etcd.EtcdConnectionFailed()
+            return write(key, value, **kwargs)
+
+        with mock.patch.object(client, 'write', side_effect=failing_write):
+            etcd_util.save_vol(self._vol('id1', 'vol1'))
+
+        self.assertNotIn(util.VOLUME_NAME_INDEX_COMPLETE_KEY, client.store)
+        self.assertEqual('id1', etcd_util.get_vol_byname('vol1')['id'])
+
+    def test_failed_delete_keeps_index_entry(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        vol = self._vol('id1', 'vol1')
+        etcd_util.save_vol(vol)
+        etcd_util.complete_name_index()
+
+        with mock.patch.object(etcd_util.client, 'delete',
+                               side_effect=etcd.EtcdConnectionFailed()):
+            self.assertRaises(etcd.EtcdConnectionFailed,
+                              etcd_util.delete_vol, vol)
+
+        self.assertEqual('id1', etcd_util.get_vol_byname('vol1')['id'])
+
+    def test_delete_vol_removes_index_entry(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        vol = self._vol('id1', 'vol1')
+        etcd_util.save_vol(vol)
+
+        etcd_util.delete_vol(vol)
+
+        self.assertIsNone(etcd_util.get_vol_byname('vol1'))
+        self.assertNotIn(util.VOLUME_NAME_INDEX_ROOT + '/vol1',
+                         etcd_util.client.store)
+
+
+class TestNameIndex(TestCase):
+    def setUp(self):
+        super(TestNameIndex, self).setUp()
+        self.client = FakeEtcdClient()
+        patcher = mock.patch.object(util, 'get_etcd_client',
+                                    return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_follow_volumes_and_shares(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        share_etcd = util.HpeShareEtcdClient('127.0.0.1', 2379, None, None)
+        vol = {'id': 'id1', 'name': 'id1', 'display_name': 'vol1',
+               'backend': 'DEFAULT'}
+        share = {'id': 'id2', 'name': 'share1', 'backend': 'DEFAULT_FILE'}
+        etcd_util.save_vol(vol)
+        share_etcd.save_share(share)
+
+        self.assertEqual({'persona': util.PERSONA_VOLUME,
+                          'backend': 'DEFAULT', 'id': 'id1'},
+                         share_etcd.lookup_name('vol1'))
+        self.assertEqual({'persona': util.PERSONA_FILE,
+                          'backend': 'DEFAULT_FILE', 'id': 'id2'},
+                         etcd_util.lookup_name('share1'))
+
+        etcd_util.delete_vol(vol)
+        share_etcd.delete_share('share1')
+
+        self.assertIsNone(etcd_util.lookup_name('vol1'))
+        self.assertIsNone(etcd_util.lookup_name('share1'))
+
+    def test_backfill_existing_objects(self):
+        self.client.dirs.update([util.VOLUMEROOT, util.SHAREROOT])
+        self.client.store[util.VOLUMEROOT + '/id1'] = (json.dumps(
+            {'id': 'id1', 'display_name': 'vol1', 'backend': 'DEFAULT'}), 1)
+        self.client.store[util.SHAREROOT + '/share1'] = (json.dumps(
+            {'id': 'id2', 'name': 'share1', 'backend': 'DEFAULT_FILE'}), 2)
+
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+
+        self.assertEqual(util.PERSONA_VOLUME,
+                         etcd_util.lookup_name('vol1')['persona'])
+        self.assertEqual(util.PERSONA_FILE,
+                         etcd_util.lookup_name('share1')['persona'])
+        self.assertFalse(etcd_util.name_index_complete())
+
+    def test_volume_not_found_by_share_name(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        share_etcd = util.HpeShareEtcdClient('127.0.0.1', 2379, None, None)
+        share_etcd.save_share({'id': 'id2', 'name': 'share1',
+                               'backend': 'DEFAULT_FILE'})
+
+        self.assertIsNone(etcd_util.get_vol_byname('share1'))
+
+
+class TestEtcdTreeMirror(TestCase):
+    def setUp(self):
+        super(TestEtcdTreeMirror, self).setUp()
+        patcher = mock.patch.object(util, 'get_etcd_client',
+                                    side_effect=_fake_etcd_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None,
+                                       mirror=True)
+        self.addCleanup(self.etcd_util._mirror.stop)
+
+    def test_reads_served_from_mirror(self):
+        self.etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                                 'display_name': 'vol1'})
+        client = self.etcd_util.client
+        client.reads = []
+
+        self.assertEqual('id1', self.etcd_util.get_vol_byname('vol1')['id'])
+        self.assertEqual('vol1',
+                         self.etcd_util.get_vol_by_id('id1')['display_name'])
+        self.assertEqual(1, len(self.etcd_util.get_all_vols()))
+        self.assertEqual([], client.reads)
+
+    def test_consistent_reads_go_to_etcd(self):
+        self.etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                                 'display_name': 'vol1'})
+        client = self.etcd_util.client
+        client.reads = []
+
+        with util.consistent_reads():
+            self.etcd_util.get_vol_by_id('id1')
+
+        self.assertEqual([util.VOLUMEROOT + '/id1'], client.reads)
+
+    def test_watch_events_applied_in_order(self):
+        mirror = self.etcd_util._mirror
+        key = util.VOLUMEROOT + '/id1'
+        vol = json.dumps({'id': 'id1', 'display_name': 'vol1'})
+        mirror._apply_event(_FakeEtcdResult(key, vol, modifiedIndex=10,
+                                            action='set'))
+        mirror._apply_event(_FakeEtcdResult(key, modifiedIndex=12,
+                                            action='delete'))
+        # A late event must not bring back a deleted volume
+        mirror._apply_event(_FakeEtcdResult(key, vol, modifiedIndex=11,
+                                            action='set'))
+
+        self.assertIsNone(mirror.get(key))
+        self.assertIsNone(mirror.get_by_field('vol1'))
+
+    def test_watch_events_reported_by_volume_name(self):
+        changed = []
+        self.etcd_util.add_change_listener(changed.append)
+        self.etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                                 'display_name': 'vol1'})
+        key = util.VOLUMEROOT + '/id1'
+
+        self.etcd_util._mirror._apply_event(
+            _FakeEtcdResult(key, modifiedIndex=100, action='delete'))
+        self.etcd_util._state_mirror._apply_event(
+            _FakeEtcdResult(util.VOLUME_STATE_ROOT + '/id2', '{}',
+                            modifiedIndex=101, action='set'))
+
+        self.assertEqual(['vol1', None], changed)
+
+
+class TestVolumeUnitOfWork(TestCase):
+    def setUp(self):
+        super(TestVolumeUnitOfWork, self).setUp()
+        patcher = mock.patch.object(util, 'get_etcd_client',
+                                    side_effect=_fake_etcd_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        self.etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                                 'display_name': 'vol1',
+                                 'node_mount_info': {'node1': ['m1']}})
+
+    def test_commit_reapplies_changes_on_conflict(self):
+        vol = self.etcd_util.get_vol_by_id('id1')
+        uow = util.VolumeUnitOfWork(self.etcd_util, vol)
+        uow.update('path_info', {'mount_dir': '/m1'})
+        uow.remove('node_mount_info')
+
+        # Another node modifies the volume after it was read here
+        other = self.etcd_util.get_vol_by_id('id1')
+        other['is_snap'] = False
+        self.etcd_util.client.write(util.VOLUMEROOT + '/id1',
+                                    json.dumps(other))
+        uow.commit()
+
+        vol = self.etcd_util.get_vol_by_id('id1')
+        self.assertEqual({'mount_dir': '/m1'}, vol['path_info'])
+        self.assertFalse(vol['is_snap'])
+        self.assertNotIn('node_mount_info', vol)
+
+    def test_commit_merges_concurrent_mounts(self):
+        vol = self.etcd_util.get_vol_by_id('id1')
+        uow = util.VolumeUnitOfWork(self.etcd_util, vol)
+        uow.apply(lambda v: v['node_mount_info'].setdefault(
+            'node2', []).append('m2'), 'node_mount_info')
+
+        other = self.etcd_util.get_vol_by_id('id1')
+        other['node_mount_info']['node1'].append('m3')
+        self.etcd_util.client.write(util.VOLUMEROOT + '/id1',
+                                    json.dumps(other))
+        uow.commit()
+
+        vol = self.etcd_util.get_vol_by_id('id1')
+        self.assertEqual({'node1': ['m1', 'm3'], 'node2': ['m2']},
+                         vol['node_mount_info'])
+
+    def test_read_indexes_cleared_per_request(self):
+        self.etcd_util.get_vol_by_id('id1')
+
+        with util.consistent_reads():
+            self.assertEqual({}, util._get_read_indexes())
+
+    def test_commit_fails_if_volume_removed(self):
+        vol = self.etcd_util.get_vol_by_id('id1')
+        uow = util.VolumeUnitOfWork(self.etcd_util, vol)
+        uow.update('path_info', {'mount_dir': '/m1'})
+        self.etcd_util.delete_vol(vol)
+
+        self.assertRaises(util.exception.HPEPluginSaveFailed, uow.commit)
+
+
+class TestVolumeSchema(TestCase):
+    def setUp(self):
+        super(TestVolumeSchema, self).setUp()
+        self.client = FakeEtcdClient()
+        patcher = mock.patch.object(util, 'get_etcd_client',
+                                    return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path_info = {'name': 'vol1', 'mount_dir': '/m1',
+                          'device_info': {'path': '/dev/dm-1'}}
+
+    def _store(self, key):
+        return json.loads(self.client.store[key][0])
+
+    def test_mount_state_stored_apart(self):
+        self.client.store[util.VOLUME_SCHEMA_KEY] = ('2', 1)
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                            'display_name': 'vol1', 'path_info': None,
+                            'snapshots': ['snap1']})
+        doc_index = self.client.store[util.VOLUMEROOT + '/id1'][1]
+
+        vol = etcd_util.get_vol_by_id('id1')
+        uow = util.VolumeUnitOfWork(etcd_util, vol)
+        uow.update('node_mount_info', {'node1': ['m1']})
+        uow.update('path_info', self.path_info)
+        uow.commit()
+
+        self.assertEqual(doc_index,
+                         self.client.store[util.VOLUMEROOT + '/id1'][1])
+        self.assertNotIn('path_info', self._store(util.VOLUMEROOT + '/id1'))
+        self.assertEqual(self.path_info,
+                         self._store(util.VOLUME_STATE_ROOT +
+                                     '/id1')['path_info'])
+        vol = etcd_util.get_vol_byname('vol1')
+        self.assertEqual(self.path_info, vol['path_info'])
+        self.assertEqual(['snap1'], vol['snapshots'])
+        self.assertEqual(1, len(etcd_util.get_all_vols()))
+
+    def test_migrate_volume_schema(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        old_path_info = dict(self.path_info, mount_dir='/m0')
+        etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                            'display_name': 'vol1',
+                            'node_mount_info': {'node1': ['m1']},
+                            'path_info': self.path_info,
+                            'old_path_info': [['node0', old_path_info]]})
+        # Older plugin versions read path_info as a JSON string
+        self.assertEqual(
+            self.path_info,
+            json.loads(self._store(util.VOLUMEROOT + '/id1')['path_info']))
+        vol = etcd_util.get_vol_by_id('id1')
+
+        with mock.patch.object(etcd_util, 'get_lock') as get_lock:
+            self.assertEqual(1, etcd_util.migrate_volume_schema())
+            self.assertEqual(0, etcd_util.migrate_volume_schema())
+        get_lock.assert_called_once_with('VOL', 'vol1')
+
+        self.assertEqual('2', self.client.store[util.VOLUME_SCHEMA_KEY][0])
+        self.assertEqual({'node_mount_info', 'path_info', 'old_path_info'},
+                         set(self._store(util.VOLUME_STATE_ROOT + '/id1')))
+        vol['schema_version'] = util.VOLUME_SCHEMA_SPLIT_STATE
+        self.assertEqual(vol, etcd_util.get_vol_by_id('id1'))
+
+    def test_schema_migrated_by_other_process(self):
+        etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        migrating_util = util.EtcdUtil('127.0.0.1', 2379, None, None)
+        migrating_util.migrate_volume_schema()
+
+        etcd_util.save_vol({'id': 'id1', 'name': 'id1',
+                            'display_name': 'vol1', 'path_info': None})
+
+        self.assertEqual(util.VOLUME_SCHEMA_SPLIT_STATE,
+                         self._store(util.VOLUMEROOT + '/id1')[
+                             'schema_version'])
+
+
+class TestEtcdConnectionFactory(TestCase):
+    def setUp(self):
+        super(TestEtcdConnectionFactory, self).setUp()
+        self.factory = util.EtcdConnectionFactory()
+
+    def test_clients_shared_per_endpoint(self):
+        client = self.factory.get_client('127.0.0.1', 2379, None, None,
+                                         pool_size=5)
+
+        self.assertIs(client, self.factory.get_client('127.0.0.1', 2379,
+                                                      None, None))
+        self.assertIsNot(client, self.factory.get_client('127.0.0.2', 2379,
+                                                         None, None))
+        self.assertEqual(5, client.http.connection_pool_kw['maxsize'])
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                      client.http.connection_pool_kw['socket_options'])
+
+    def test_failed_member_tried_last(self):
+        client = self.factory.get_client('127.0.0.1', 2379, None, None)
+        client._base_uri = 'http://m1:2379'
+        client._machines_cache = ['http://m2:2379', 'http://m3:2379']
+        client._member_failures['http://m2:2379'] = time.time()
+
+        self.assertEqual('http://m3:2379', client._next_server())
+        self.assertEqual({'http://m1:2379': False, 'http://m2:2379': False},
+                         util.get_member_health(client))
+        self.assertEqual({}, util.get_member_health(FakeEtcdClient()))
+
+
+class _FakeMember(object):
+    def __init__(self, name, delay=0):
+        self.name = name
+        self.delay = delay
+        self.reads = 0
+
+    def read(self, key, **kwargs):
+        self.reads += 1
+        time.sleep(self.delay)
+        return _FakeEtcdResult(key, self.name)
+
+
+class TestEtcdReadRouter(TestCase):
+    def setUp(self):
+        super(TestEtcdReadRouter, self).setUp()
+        factory = util.EtcdConnectionFactory()
+        self.client = factory.get_client('127.0.0.1', 2379, None, None)
+        self.client._base_uri = 'http://m1:2379'
+        self.client._machines_cache = ['http://m2:2379']
+
+    def _router(self, hedge_percentile=None, m1_delay=0, m2_delay=0):
+        router = util.EtcdReadRouter(self.client, hedge_percentile)
+        router._members = {'http://m1:2379': _FakeMember('m1', m1_delay),
+                           'http://m2:2379': _FakeMember('m2', m2_delay)}
+        return router
+
+    def test_reads_sent_to_fastest_member(self):
+        router = self._router(m1_delay=0.05)
+        # The first reads probe each member
+        router.read('/key')
+        router.read('/key')
+
+        self.assertEqual('m2', router.read('/key').value)
+        self.assertEqual('m2', router.read('/key').value)
+
+    def test_slow_read_hedged_on_next_member(self):
+        router = self._router(hedge_percentile=90, m2_delay=0.01)
+        for i in range(util.READ_HEDGE_MIN_SAMPLES + 2):
+            router.read('/key')
+        router._members['http://m1:2379'].delay = 0.5
+        router._members['http://m2:2379'].reads = 0
+
+        start = time.time()
+        result = router.read('/key')
+
+        self.assertIn(result.value, ('m1', 'm2'))
+        self.assertEqual(1, router._members['http://m2:2379'].reads)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_reads_lagging_own_writes_sent_to_leader(self):
+        router = self._router()
+        self.client.last_write_index = 5
+        leader_read = mock.Mock(return_value=_FakeEtcdResult('/key',
+                                                             'leader'))
+        missing = etcd.EtcdKeyNotFound('Key not found', {'index': 4})
+        router._members['http://m2:2379'].read = mock.Mock(
+            side_effect=missing)
+
+        with mock.patch.object(self.client, 'read', leader_read):
+            self.assertEqual('leader', router.read('/key').value)
+            self.assertEqual('leader', router.read('/key').value)
+
+        leader_read.assert_called_with('/key', quorum=True)
+        self.assertEqual(2, leader_read.call_count)
+
+    def test_locked_reads_use_quorum(self):
+        client = mock.Mock()
+        router = mock.Mock()
+
+        util.read_stale_ok(client, router, '/key')
+        with util.consistent_reads():
+            util.read_stale_ok(client, router, '/key')
+
+        router.read.assert_called_once_with('/key')
+        client.read.assert_called_once_with('/key', quorum=True)
+
+
+class _FakeLockClient(object):
+    def __init__(self):
+        self.acquires = 0
+        self.refreshes = 0
+
+    def get_lock(self, name):
+        client = self
+
+        class _Lock(object):
+            is_acquired = False
+
+            def acquire(self, **kwargs):
+                client.acquires += 1
+                self.is_acquired = True
+
+            def refresh(self, lock_ttl):
+                client.refreshes += 1
+
+            def release(self):
+                self.is_acquired = False
+
+        return _Lock()
+
+
+class TestEtcdLock(TestCase):
+    def test_local_waiters_queue_in_process(self):
+        client = _FakeLockClient()
+        lock = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1')
+        lock.try_lock_name()
+
+        waiter = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1')
+        thread = threading.Thread(target=waiter.try_lock_name)
+        thread.start()
+        time.sleep(0.05)
+        # The waiter has not gone to etcd while the lock is held locally
+        self.assertEqual(1, client.acquires)
+
+        lock.try_unlock_name()
+        thread.join(1)
+        self.assertEqual(2, client.acquires)
+        waiter.try_unlock_name()
+        self.assertEqual({}, util._local_locks._locks)
+
+    def test_local_lock_released_if_etcd_lock_fails(self):
+        client = _FakeLockClient()
+        lock = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1')
+        lock._lock.acquire = mock.Mock()
+
+        self.assertRaises(exception.HPEPluginLockFailed, lock.try_lock_name)
+        self.assertEqual({}, util._local_locks._locks)
+
+    @mock.patch.object(util, 'LOCK_HEARTBEAT_INTERVAL', 0.01)
+    def test_held_lock_kept_alive(self):
+        heartbeat = util._LockHeartbeat()
+        client = _FakeLockClient()
+        lock = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1')
+
+        with mock.patch.object(util, '_lock_heartbeat', heartbeat):
+            lock.try_lock_name()
+            time.sleep(0.1)
+            lock.try_unlock_name()
+            refreshes = client.refreshes
+            time.sleep(0.05)
+
+        self.assertGreater(refreshes, 1)
+        self.assertEqual(refreshes, client.refreshes)
+
+    def test_stuck_holder_no_longer_kept_alive(self):
+        heartbeat = util._LockHeartbeat()
+        lock = mock.Mock()
+        heartbeat._locks[lock] = time.time() - 1
+
+        heartbeat._refresh_all()
+
+        lock.refresh.assert_not_called()
+        self.assertEqual({}, heartbeat._locks)
+
+    def test_lock_without_max_hold_time_kept_alive(self):
+        heartbeat = util._LockHeartbeat()
+        lock = mock.Mock()
+        heartbeat._locks[lock] = None
+
+        heartbeat._refresh_all()
+
+        lock.refresh.assert_called_once_with(util.LOCK_TTL)
+        self.assertIn(lock, heartbeat._locks)
+
+    def test_max_hold_time_by_lock_type(self):
+        self.assertEqual(600, util._lock_max_hold_time(None, 'VOL'))
+        self.assertIsNone(util._lock_max_hold_time(None, 'FP_SHARE'))
+        self.assertEqual(3600, util._lock_max_hold_time({'FP_FPG': '3600'},
+                                                        'FP_FPG'))
+        self.assertIsNone(util._lock_max_hold_time({'VOL': '0'}, 'VOL'))
+
+    def test_wait_timeout_by_lock_type(self):
+        client = FakeEtcdClient()
+        client.get_lock = mock.Mock()
+        with mock.patch.object(util, 'get_etcd_client', return_value=client):
+            etcd_util = util.EtcdUtil('127.0.0.1', 2379, None, None,
+                                      lock_wait_timeouts={'VOL': '30'})
+
+        self.assertEqual(30, etcd_util.get_lock('VOL', 'vol1')._wait_timeout)
+        self.assertEqual(util.LOCK_WAIT_TIMEOUT,
+                         etcd_util.get_lock('RCG', 'rcg1')._wait_timeout)
+
+    def test_etcd_lock_wait_bounded(self):
+        client = mock.Mock()
+        client.lock_prefix = '/_locks'
+        client.watch.side_effect = etcd.EtcdWatchTimedOut()
+        lock = util.HeartbeatEtcdLock(client, 'vol1')
+        nearest = mock.Mock(key='/_locks/vol1/1', modifiedIndex=1)
+
+        with mock.patch.object(lock, '_get_blocker', return_value=nearest):
+            self.assertFalse(lock._acquired(timeout=0.05))
+
+    def test_local_waiter_times_out(self):
+        client = _FakeLockClient()
+        holder = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1')
+        holder.try_lock_name()
+
+        waiter = util.EtcdLock(util.LOCKROOT + '/', client, 'vol1',
+                               wait_timeout=0.05)
+        self.assertRaises(exception.HPEPluginLockFailed,
+                          waiter.try_lock_name)
+        holder.try_unlock_name()
+        waiter.try_lock_name()
+        waiter.try_unlock_name()
+        self.assertEqual({}, util._local_locks._locks)
+
+    def test_etcd_lock_waits_for_nearest_holder_ahead(self):
+        client = mock.Mock()
+        client.lock_prefix = '/_locks'
+        lock = util.HeartbeatEtcdLock(client, 'vol1')
+        lock._sequence = '3'
+
+        def queue(count):
+            return mock.Mock(leaves=[
+                mock.Mock(key='/_locks/vol1/%s' % (i + 1))
+                for i in range(count)])
+
+        client.read.return_value = queue(3)
+        self.assertEqual('/_locks/vol1/2', lock._get_blocker().key)
+        lock._sequence = '1'
+        self.assertIsNone(lock._get_blocker())
@@ -0,0 +1,64 @@
+import mock
+from testtools import TestCase
+
+from hpedockerplugin.hpe import host_index
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHostIndex(TestCase):
+    def setUp(self):
+        super(TestHostIndex, self).setUp()
+        self.clock = _FakeClock()
+        self.index = host_index.HostIndex('array', refresh_interval=60,
+                                          clock=self.clock)
+        self.get_hosts = mock.Mock(return_value={'members': [
+            {'name': 'host1',
+             'FCPaths': [{'wwn': '123456789012345A'}]},
+            {'name': 'host2',
+             'iSCSIPaths': [{'name': 'iqn.1993-08.org.debian:01:host2'}]}]})
+        self.query_host = mock.Mock(return_value={'members': []})
+
+    def _find(self, wwns=None, iqns=None):
+        return self.index.find_host(wwns, iqns, self.get_hosts,
+                                    self.query_host)
+
+    def test_hosts_read_once(self):
+        self.assertEqual('host1', self._find(wwns='12:34:56:78:90:12:34:5a'))
+        self.assertEqual('host2',
+                         self._find(iqns=['iqn.1993-08.org.debian:01:host2']))
+
+        self.get_hosts.assert_called_once_with()
+        self.query_host.assert_not_called()
+
+    def test_index_updated_and_queried_on_miss(self):
+        self._find(wwns='123456789012345A')
+        self.index.add_paths('host1', wwns=['1111111111111111'])
+        self.index.remove_host('host2')
+        self.query_host.return_value = {'members': [
+            {'name': 'host3',
+             'iSCSIPaths': [{'name': 'iqn.1993-08.org.debian:01:host2'}]}]}
+
+        self.assertEqual('host1', self._find(wwns='1111111111111111'))
+        self.assertEqual('host3',
+                         self._find(iqns='iqn.1993-08.org.debian:01:host2'))
+        self.query_host.assert_called_once_with(
+            wwns=None, iqns=['iqn.1993-08.org.debian:01:host2'])
+        self.assertIsNone(self._find(wwns='2222222222222222'))
+
+    def test_hosts_read_again_after_refresh_interval(self):
+        self.assertEqual('host1', self._find(wwns='123456789012345A'))
+        # The initiator was moved to another host by someone else
+        self.get_hosts.return_value = {'members': [
+            {'name': 'host3', 'FCPaths': [{'wwn': '123456789012345A'}]}]}
+        self.assertEqual('host1', self._find(wwns='123456789012345A'))
+
+        self.clock.now = 60
+        self.assertEqual('host3', self._find(wwns='123456789012345A'))
+        self.assertEqual(2, self.get_hosts.call_count)
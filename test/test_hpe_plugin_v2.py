@@ -573,6 +573,16 @@ class HpeDockerUnitTestsBase(object):
         test = getvolume_tester.TestGetVolumeWithQos()
         test.run_test(self)
 
+    @tc_banner_decorator
+    def test_get_vol_detail_requested(self):
+        test = getvolume_tester.TestGetVolumeDetailRequested()
+        test.run_test(self)
+
+    @tc_banner_decorator
+    def test_get_vol_from_metadata(self):
+        test = getvolume_tester.TestGetVolumeFromMetadata()
+        test.run_test(self)
+
     @tc_banner_decorator
     def test_clone_vol(self):
         test = getvolume_tester.TestCloneVolume()
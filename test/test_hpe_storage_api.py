@@ -0,0 +1,51 @@
+import json
+from testtools import TestCase
+from twisted.internet import defer
+from twisted.internet import task
+
+from hpedockerplugin import hpe_storage_api as api
+
+
+class _FakeWorkerPool(object):
+    """Runs the calls when told to instead of in threads"""
+    def __init__(self):
+        self.calls = []
+
+    def defer(self, f, *args):
+        d = defer.Deferred()
+        self.calls.append(lambda: d.callback(f(*args)))
+        return d
+
+
+class TestRequestThreads(TestCase):
+    def setUp(self):
+        super(TestRequestThreads, self).setUp()
+        self.plugin = api.VolumePlugin.__new__(api.VolumePlugin)
+        self.plugin._reactor = task.Clock()
+        self.plugin._request_pool = _FakeWorkerPool()
+        self.plugin._request_timeout = 10
+
+    def _handler(self, name):
+        return json.dumps({u"Err": '', u"Name": name})
+
+    def test_handler_runs_in_request_pool(self):
+        results = []
+        d = self.plugin._run_request(self._handler, 'vol1')
+        d.addCallback(results.append)
+
+        self.assertEqual([], results)
+        self.plugin._request_pool.calls.pop()()
+        self.assertEqual({u"Err": '', u"Name": 'vol1'},
+                         json.loads(results[0]))
+
+    def test_slow_handler_answered_with_timeout(self):
+        results = []
+        d = self.plugin._run_request(self._handler, 'vol1')
+        d.addCallback(results.append)
+
+        self.plugin._reactor.advance(10)
+
+        self.assertIn('timed out', json.loads(results[0])['Err'])
+        # The late result of the handler is dropped
+        self.plugin._request_pool.calls.pop()()
+        self.assertEqual(1, len(results))
@@ -0,0 +1,50 @@
+from hpe3parclient import exceptions as hpeexceptions
+import mock
+from testtools import TestCase
+
+from hpedockerplugin.hpe import inventory_cache
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestInventoryCache(TestCase):
+    def setUp(self):
+        super(TestInventoryCache, self).setUp()
+        self.clock = _FakeClock()
+        self.cache = inventory_cache.InventoryCache(
+            'array', ttls={'ports': '10'}, clock=self.clock)
+
+    def test_objects_kept_for_their_ttl(self):
+        get_ports = mock.Mock(return_value={'members': []})
+
+        ports = self.cache.get('ports', None, get_ports)
+        ports['members'].append({'portPos': {}})
+        self.assertEqual({'members': []},
+                         self.cache.get('ports', None, get_ports))
+        self.clock.now = 10
+        self.cache.get('ports', None, get_ports)
+
+        self.assertEqual(2, get_ports.call_count)
+        self.assertEqual({'ttl': 10.0, 'hits': 1, 'misses': 2},
+                         self.cache.stats()['kinds']['ports'])
+
+    def test_host_invalidated_and_errors_not_kept(self):
+        get_host = mock.Mock(side_effect=[hpeexceptions.HTTPNotFound(),
+                                          {'name': 'host1'},
+                                          {'name': 'host1', 'FCPaths': []}])
+
+        self.assertRaises(hpeexceptions.HTTPNotFound, self.cache.get,
+                          'host', 'host1', get_host)
+        self.cache.get('host', 'host1', get_host)
+        self.cache.get('host', 'host2', lambda: {'name': 'host2'})
+        self.cache.invalidate('host', 'host1')
+
+        self.assertEqual({'name': 'host1', 'FCPaths': []},
+                         self.cache.get('host', 'host1', get_host))
+        self.assertEqual(2, self.cache.stats()['entries'])
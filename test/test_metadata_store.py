@@ -0,0 +1,274 @@
+import base64
+import etcd
+import mock
+import os
+import shutil
+import tempfile
+from testtools import TestCase
+
+from hpedockerplugin import etcdutil as util
+from hpedockerplugin import metadata_store
+
+
+class TestSqliteStore(TestCase):
+    def setUp(self):
+        super(TestSqliteStore, self).setUp()
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.path = os.path.join(tempdir, 'metadata.db')
+        self.store = metadata_store.SqliteStore(self.path)
+
+    def test_read_write_semantics(self):
+        self.store.write('/volumes', None, dir=True)
+        result = self.store.read('/volumes', recursive=True)
+        # Like etcd, an empty directory is its own only leaf
+        self.assertEqual(['/volumes'], [r.key for r in result.leaves])
+
+        self.store.write('/volumes/id1', 'v1')
+        self.store.write('/volumes/id2', 'v2')
+        self.store.write('/file-persona/b1/cpg1/fpg1', 'f1')
+
+        result = self.store.read('/volumes', recursive=True)
+        self.assertEqual(['v1', 'v2'], [r.value for r in result.children])
+        result = self.store.read('/file-persona/b1', recursive=True)
+        self.assertEqual(['f1'], [r.value for r in result.leaves])
+        self.assertRaises(etcd.EtcdKeyNotFound, self.store.read, '/shares')
+        self.assertRaises(etcd.EtcdAlreadyExist, self.store.write,
+                          '/volumes/id1', 'v', prevExist=False)
+        self.assertRaises(etcd.EtcdException, self.store.write,
+                          '/volumes/id3', 'v3', ttl=10)
+
+    def test_compare_and_swap(self):
+        result = self.store.write('/volumes/id1', 'v1')
+
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.write,
+                          '/volumes/id1', 'v2',
+                          prevIndex=result.modifiedIndex + 1)
+        result.value = 'v2'
+        updated = self.store.update(result)
+        self.assertGreater(updated.modifiedIndex, result.modifiedIndex)
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.update, result)
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.delete,
+                          '/volumes/id1', prevValue='v1')
+        self.store.delete('/volumes/id1', prevValue='v2')
+        self.assertRaises(etcd.EtcdKeyNotFound, self.store.read,
+                          '/volumes/id1')
+
+    def test_lock(self):
+        lock = self.store.get_lock('vol1')
+        other = metadata_store.SqliteStore(self.path).get_lock('vol1')
+
+        self.assertTrue(lock.acquire(lock_ttl=300, timeout=1))
+        self.assertFalse(other.acquire(lock_ttl=300, timeout=0.05))
+        lock.release()
+        self.assertTrue(other.acquire(lock_ttl=300, timeout=1))
+        other.release()
+
+    def test_expired_lock_taken_over(self):
+        lock = self.store.get_lock('vol1')
+        lock.acquire(lock_ttl=0, timeout=1)
+
+        self.assertTrue(self.store.get_lock('vol1').acquire(timeout=1))
+
+    def test_refreshed_lock_not_taken_over(self):
+        lock = self.store.get_lock('vol1')
+        lock.acquire(lock_ttl=0, timeout=1)
+        lock.refresh(300)
+
+        self.assertFalse(self.store.get_lock('vol1').acquire(timeout=0.05))
+
+
+def _b64(text):
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def _unb64(data):
+    return base64.b64decode(data).decode('utf-8')
+
+
+class FakeEtcdV3Gateway(object):
+    """In-memory stand-in for the JSON gateway of an etcd v3 cluster"""
+    def __init__(self):
+        # key -> [value, create_revision, mod_revision, version]
+        self.kvs = {}
+        self.revision = 0
+        self.leases = 0
+        self.calls = []
+
+    def __call__(self, path, payload):
+        self.calls.append(path)
+        if path == '/lease/grant':
+            self.leases += 1
+            return {'ID': str(self.leases), 'TTL': str(payload['TTL'])}
+        if path == '/lease/keepalive':
+            return {'result': {'ID': payload['ID'], 'TTL': '30'}}
+        if path == '/kv/txn':
+            succeeded = all(self._compare(c) for c in payload['compare'])
+            ops = payload['success' if succeeded else 'failure']
+            responses = [self._op(op) for op in ops]
+            return {'header': {'revision': str(self.revision)},
+                    'succeeded': succeeded, 'responses': responses}
+        op = {'/kv/range': 'request_range', '/kv/put': 'request_put',
+              '/kv/deleterange': 'request_delete_range'}[path]
+        response = self._op({op: payload}).popitem()[1]
+        response['header'] = {'revision': str(self.revision)}
+        return response
+
+    def _compare(self, compare):
+        kv = self.kvs.get(_unb64(compare['key']), ['', 0, 0, 0])
+        target = compare['target']
+        if target == 'VALUE':
+            actual, expected = kv[0], _unb64(compare['value'])
+        else:
+            field = {'CREATE': 'create_revision', 'MOD': 'mod_revision',
+                     'VERSION': 'version'}[target]
+            actual = kv[{'CREATE': 1, 'MOD': 2, 'VERSION': 3}[target]]
+            expected = int(compare[field])
+        if compare['result'] == 'GREATER':
+            return actual > expected
+        return actual == expected
+
+    def _keys(self, request):
+        key = _unb64(request['key'])
+        if 'range_end' not in request:
+            return [key] if key in self.kvs else []
+        end = _unb64(request['range_end'])
+        return sorted(k for k in self.kvs if key <= k < end)
+
+    def _op(self, op):
+        kind, request = list(op.items())[0]
+        keys = self._keys(request)
+        if kind == 'request_range':
+            limit = request.get('limit') or len(keys)
+            kvs = [{'key': _b64(k), 'value': _b64(self.kvs[k][0]),
+                    'create_revision': str(self.kvs[k][1]),
+                    'mod_revision': str(self.kvs[k][2])}
+                   for k in keys[:limit]]
+            return {'response_range': {'kvs': kvs,
+                                       'more': len(keys) > limit}}
+        self.revision += 1
+        if kind == 'request_put':
+            key = _unb64(request['key'])
+            kv = self.kvs.get(key, [None, self.revision, 0, 0])
+            self.kvs[key] = [_unb64(request['value']), kv[1],
+                             self.revision, kv[3] + 1]
+            return {'response_put': {}}
+        for key in keys:
+            del self.kvs[key]
+        return {'response_delete_range': {'deleted': str(len(keys))}}
+
+
+class TestEtcdV3Store(TestCase):
+    def setUp(self):
+        super(TestEtcdV3Store, self).setUp()
+        self.gateway = FakeEtcdV3Gateway()
+        self.store = self._new_store()
+
+    def _new_store(self):
+        store = metadata_store.EtcdV3Store([('127.0.0.1', 2379)])
+        store._call = self.gateway
+        return store
+
+    def test_read_write_semantics(self):
+        self.store.write('/volumes', None, dir=True)
+        result = self.store.read('/volumes', recursive=True)
+        self.assertEqual(['/volumes'], [r.key for r in result.leaves])
+        self.assertRaises(etcd.EtcdAlreadyExist, self.store.write,
+                          '/volumes', None, dir=True, prevExist=False)
+
+        self.store.write('/volumes/id1', 'v1')
+        self.store.write('/volumes/id2', 'v2')
+        self.store.write('/file-persona/b1/cpg1/fpg1', 'f1')
+
+        result = self.store.read('/volumes', recursive=True)
+        self.assertEqual(['v1', 'v2'], [r.value for r in result.children])
+        result = self.store.read('/file-persona/b1', recursive=True)
+        self.assertEqual(['f1'], [r.value for r in result.leaves])
+        self.assertRaises(etcd.EtcdKeyNotFound, self.store.read, '/shares')
+        self.assertRaises(etcd.EtcdAlreadyExist, self.store.write,
+                          '/volumes/id1', 'v', prevExist=False)
+        self.assertRaises(etcd.EtcdException, self.store.write,
+                          '/volumes/id3', 'v3', ttl=10)
+
+    def test_compare_and_swap(self):
+        result = self.store.write('/volumes/id1', 'v1')
+
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.write,
+                          '/volumes/id1', 'v2',
+                          prevIndex=result.modifiedIndex + 1)
+        self.assertRaises(etcd.EtcdKeyNotFound, self.store.write,
+                          '/volumes/id2', 'v2', prevIndex=1)
+        result.value = 'v2'
+        updated = self.store.update(result)
+        self.assertGreater(updated.modifiedIndex, result.modifiedIndex)
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.update, result)
+        self.assertRaises(etcd.EtcdCompareFailed, self.store.delete,
+                          '/volumes/id1', prevValue='v1')
+        self.store.delete('/volumes/id1', prevValue='v2')
+        self.assertRaises(etcd.EtcdKeyNotFound, self.store.read,
+                          '/volumes/id1')
+
+    def test_listing_is_paged(self):
+        for i in range(5):
+            self.store.write('/volumes/id%s' % i, 'v%s' % i)
+        del self.gateway.calls[:]
+
+        with mock.patch.object(metadata_store, 'ETCD3_RANGE_PAGE_SIZE', 2):
+            result = self.store.read('/volumes', recursive=True)
+
+        self.assertEqual(['v0', 'v1', 'v2', 'v3', 'v4'],
+                         [r.value for r in result.children])
+        # The key itself, then three pages of the directory
+        self.assertEqual(['/kv/range'] * 4, self.gateway.calls)
+
+    def test_write_many_is_one_transaction(self):
+        results = self.store.write_many([('/volumes/id1', 'v1'),
+                                         ('/volumes-by-name/vol1', 'id1')])
+
+        self.assertEqual(['/kv/txn'], self.gateway.calls)
+        self.assertEqual(1, len(set(r.modifiedIndex for r in results)))
+        self.assertEqual('id1',
+                         self.store.read('/volumes-by-name/vol1').value)
+
+    def test_lock_round_trips(self):
+        lock = self.store.get_lock('vol1')
+        other = self._new_store().get_lock('vol1')
+        self.assertTrue(lock.acquire(timeout=1))
+        self.assertFalse(other.acquire(timeout=0.05))
+        lock.release()
+        del self.gateway.calls[:]
+
+        self.assertTrue(lock.acquire(timeout=1))
+        lock.release()
+
+        # The lease is reused, so acquire and release are one call each
+        self.assertEqual(['/kv/txn', '/kv/txn'], self.gateway.calls)
+        self.assertTrue(other.acquire(timeout=1))
+
+
+class TestEtcdUtilWithSqliteStore(TestCase):
+    def setUp(self):
+        super(TestEtcdUtilWithSqliteStore, self).setUp()
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.etcd_util = util.EtcdUtil(
+            None, None, None, None, mirror=True,
+            store=metadata_store.STORE_SQLITE,
+            store_path=os.path.join(tempdir, 'metadata.db'))
+
+    def test_volume_lifecycle(self):
+        vol = {'id': 'id1', 'name': 'id1', 'display_name': 'vol1',
+               'path_info': None}
+        self.etcd_util.save_vol(vol)
+
+        vol = self.etcd_util.get_vol_byname('vol1')
+        uow = util.VolumeUnitOfWork(self.etcd_util, vol)
+        uow.update('node_mount_info', {'node1': ['m1']})
+        uow.commit()
+        with self.etcd_util.get_lock('VOL', 'vol1'):
+            vols = self.etcd_util.get_all_vols()
+        self.etcd_util.delete_vol(vol)
+
+        self.assertEqual([{'node1': ['m1']}],
+                         [v['node_mount_info'] for v in vols])
+        self.assertIsNone(self.etcd_util.get_vol_byname('vol1'))
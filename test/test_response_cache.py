@@ -0,0 +1,77 @@
+import json
+
+from testtools import TestCase
+
+from hpedockerplugin import response_cache
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.clock = _FakeClock()
+        self.cache = response_cache.ResponseCache(5, clock=self.clock)
+        self.loads = []
+
+    def _get(self, name):
+        def load():
+            self.loads.append(name)
+            return json.dumps({u"Err": '', u"Volume": {'Name': name}})
+        return self.cache.get_or_load(('get', name), name, load)
+
+    def _list(self):
+        def load():
+            self.loads.append('list')
+            return response_cache.encode_list_entries(
+                {'Name': name} for name in ('vol1', 'vol2'))
+        return self.cache.get_or_load(response_cache.LIST_KEY, None, load,
+                                      is_cacheable=lambda volumes: True)
+
+    def test_responses_cached_until_expiry(self):
+        self._get('vol1')
+        self._get('vol1')
+        self._list()
+        self.assertEqual('{"Name": "vol1"}, {"Name": "vol2"}', self._list())
+        self.assertEqual(['vol1', 'list'], self.loads)
+
+        self.clock.now = 5
+        self._get('vol1')
+        self.assertEqual(['vol1', 'list', 'vol1'], self.loads)
+        self.assertEqual({'entries': 2, 'hits': 2, 'misses': 3},
+                         self.cache.stats())
+
+    def test_invalidate_drops_name_and_list(self):
+        self._get('vol1')
+        self._get('vol2')
+        self._list()
+
+        self.cache.invalidate('vol1')
+        self._get('vol1')
+        self._get('vol2')
+        self._list()
+
+        self.assertEqual(['vol1', 'vol2', 'list', 'vol1', 'list'],
+                         self.loads)
+
+    def test_errors_and_stale_loads_not_cached(self):
+        def failing_load():
+            self.loads.append('failed')
+            return json.dumps({u"Err": 'failed'})
+
+        def changed_while_loading():
+            self.cache.invalidate('vol1')
+            return self._get('vol2')
+
+        self.cache.get_or_load(('get', 'vol1'), 'vol1', failing_load)
+        self.cache.get_or_load(('get', 'vol3'), 'vol3',
+                               changed_while_loading)
+
+        self.assertEqual({'entries': 1, 'hits': 0, 'misses': 3},
+                         self.cache.stats())
@@ -0,0 +1,110 @@
+import threading
+
+from hpe3parclient import exceptions as hpeexceptions
+import mock
+from testtools import TestCase
+
+from hpedockerplugin.hpe import session_pool
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionPool(TestCase):
+    def setUp(self):
+        super(TestSessionPool, self).setUp()
+        self.clock = _FakeClock()
+        self.sessions = []
+        self.pool = session_pool.SessionPool(
+            'array', self._login, max_sessions=1, idle_timeout=60,
+            clock=self.clock)
+
+    def _login(self):
+        session = mock.Mock()
+        self.sessions.append(session)
+        return session
+
+    def test_session_reused(self):
+        session = self.pool.acquire()
+        self.pool.release(session)
+        self.pool.release(self.pool.acquire(),
+                          error=hpeexceptions.HTTPNotFound())
+
+        self.assertIs(session, self.pool.acquire())
+        self.assertEqual(1, self.pool.logins)
+        session.client_logout.assert_not_called()
+
+    def test_session_replaced_after_error_or_idle(self):
+        self.pool.release(self.pool.acquire(),
+                          error=hpeexceptions.HTTPUnauthorized())
+        self.pool.release(self.pool.acquire())
+        self.clock.now = 60
+        self.pool.acquire()
+
+        self.assertEqual(3, self.pool.logins)
+        self.sessions[0].client_logout.assert_called_once_with()
+        self.sessions[1].client_logout.assert_called_once_with()
+
+    def test_session_kept_after_handled_error(self):
+        # A call made while an enclosing handler deals with another
+        # error must not have its session treated as failed
+        try:
+            raise hpeexceptions.HTTPUnauthorized()
+        except hpeexceptions.HTTPUnauthorized:
+            with self.pool.session() as session:
+                pass
+        self.assertIs(session, self.pool.acquire())
+        self.assertEqual(1, self.pool.logins)
+
+    def test_calls_beyond_limit_wait(self):
+        session = self.pool.acquire()
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(self.pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual([], acquired)
+
+        self.pool.release(session)
+        waiter.join(5)
+        self.assertEqual([session], acquired)
+        self.assertEqual({'max_sessions': 1, 'in_use': 1, 'idle': 0,
+                          'logins': 1}, self.pool.stats())
+
+
+class TestSSHClientPool(TestCase):
+    def setUp(self):
+        super(TestSSHClientPool, self).setUp()
+        self.clients = []
+        self.pool = session_pool.SSHClientPool(
+            'array', self._create_client, max_sessions=1, keepalive=15)
+
+    def _create_client(self):
+        client = mock.Mock()
+        client._run.return_value = ['ok']
+        self.clients.append(client)
+        return client
+
+    def test_connection_reused_and_kept_alive(self):
+        self.assertEqual(['ok'], self.pool.run(['showsched']))
+        self.assertEqual(['ok'], self.pool.run(['showvv']))
+
+        self.assertEqual(1, len(self.clients))
+        client = self.clients[0]
+        transport = client.ssh.ssh.get_transport.return_value
+        transport.set_keepalive.assert_called_with(15)
+        client.ssh.close.assert_not_called()
+
+    def test_connection_closed_after_failed_command(self):
+        self.pool.run(['showsched'])
+        self.clients[0]._run.side_effect = Exception('Channel closed')
+
+        self.assertRaises(Exception, self.pool.run, ['showsched'])
+        self.clients[0].ssh.close.assert_called_once_with()
+        self.pool.run(['showsched'])
+        self.assertEqual(2, self.pool.logins)
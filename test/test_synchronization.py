@@ -0,0 +1,76 @@
+import json
+import mock
+from testtools import TestCase
+
+from hpedockerplugin import exception
+from hpedockerplugin import synchronization
+
+
+class _Manager(object):
+    def __init__(self):
+        self._etcd = mock.Mock()
+
+    @synchronization.synchronized_volume('{volname}')
+    def mount(self, volname, mount_id=None):
+        return volname
+
+    @synchronization.synchronized_rcg('{f_name}-{rcg_name}-{role}')
+    def failover(self, rcg_name, role='primary'):
+        return rcg_name
+
+
+class TestSynchronized(TestCase):
+    def setUp(self):
+        super(TestSynchronized, self).setUp()
+        self.stats = synchronization.LockStats()
+        patcher = mock.patch.object(synchronization, 'lock_stats',
+                                    self.stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mgr = _Manager()
+
+    def test_lock_name_from_arguments(self):
+        self.mgr.mount('vol1')
+        self.mgr.mount(volname='vol2', mount_id='m1')
+        self.mgr.failover('rcg1')
+        self.mgr.failover('rcg1', role='secondary')
+
+        self.assertEqual(
+            [mock.call('VOL', 'vol1'), mock.call('VOL', 'vol2'),
+             mock.call('RCG', 'failover-rcg1-primary'),
+             mock.call('RCG', 'failover-rcg1-secondary')],
+            self.mgr._etcd.get_lock.call_args_list)
+
+    def test_lock_times_recorded(self):
+        self.mgr.mount('vol1')
+        self.mgr.mount('vol1')
+        self.mgr.mount('vol2')
+
+        stats = self.stats.snapshot(top_n=1)
+        vol_stats = stats['lock_types']['VOL']
+        self.assertEqual(3, vol_stats['acquired'])
+        self.assertEqual(3, sum(vol_stats['wait_seconds'].values()))
+        self.assertEqual(3, sum(vol_stats['hold_seconds'].values()))
+        self.assertEqual(1, len(stats['hottest_locks']))
+
+    def test_failed_acquire_recorded(self):
+        lock = self.mgr._etcd.get_lock.return_value
+        lock.try_lock_name.side_effect = exception.HPEPluginLockFailed(
+            obj='vol1')
+
+        response = json.loads(self.mgr.mount('vol1'))
+
+        self.assertEqual({'Err': ''}, response)
+        self.assertFalse(lock.try_unlock_name.called)
+        vol_stats = self.stats.snapshot()['lock_types']['VOL']
+        self.assertEqual(1, vol_stats['failed'])
+        self.assertEqual(0, sum(vol_stats['hold_seconds'].values()))
+
+    @mock.patch.object(synchronization, 'MAX_LOCK_NAMES', 4)
+    def test_lock_names_capped(self):
+        for i in range(5):
+            self.stats.record_wait('VOL', 'vol%s' % i, i, True)
+
+        hottest = self.stats.snapshot()['hottest_locks']
+        self.assertEqual(['vol4', 'vol3', 'vol2'],
+                         [entry['name'] for entry in hottest])
@@ -0,0 +1,53 @@
+import mock
+from testtools import TestCase
+
+from hpedockerplugin.hpe import vlun_tracker
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _vlun(hostname, nsp, active=True):
+    return {'hostname': hostname, 'portPos': nsp, 'active': active}
+
+
+class TestNspLoadTracker(TestCase):
+    def setUp(self):
+        super(TestNspLoadTracker, self).setUp()
+        self.clock = _FakeClock()
+        self.tracker = vlun_tracker.NspLoadTracker(
+            'array', refresh_interval=60, clock=self.clock)
+        self.nsps = ['1:8:1', '1:8:2']
+        self.get_vluns = mock.Mock(return_value={'members': [
+            _vlun('host1', '1:8:1'),
+            _vlun('host1', '1:8:1', active=False),
+            _vlun('host2', '1:8:1')]})
+
+    def _least_used_nsp(self, hostname):
+        return self.tracker.least_used_nsp(hostname, self.nsps,
+                                           self.get_vluns, lambda p: p)
+
+    def test_counts_kept_up_to_date_without_array_reads(self):
+        self.assertEqual('1:8:2', self._least_used_nsp('host3'))
+        self.assertEqual('1:8:1', self._least_used_nsp('host1'))
+
+        for _i in range(3):
+            self.tracker.vlun_created('host4', '1:8:2')
+        self.tracker.vlun_deleted('host2', '1:8:1')
+        self.assertEqual('1:8:1', self._least_used_nsp('host3'))
+        self.assertEqual('1:8:2', self._least_used_nsp('host4'))
+        self.get_vluns.assert_called_once_with()
+
+    def test_counts_reloaded(self):
+        self._least_used_nsp('host3')
+        self.tracker.vlun_created('host3', None)
+        self._least_used_nsp('host3')
+        self.clock.now = 60
+        self._least_used_nsp('host3')
+
+        self.assertEqual(3, self.get_vluns.call_count)
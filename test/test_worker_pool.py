@@ -0,0 +1,45 @@
+import threading
+
+from testtools import TestCase
+
+from hpedockerplugin import worker_pool
+
+
+class _FakeReactor(object):
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class TestWorkerPool(TestCase):
+    def setUp(self):
+        super(TestWorkerPool, self).setUp()
+        self.pool = worker_pool.WorkerPool(_FakeReactor(), 'test', 1)
+
+    def test_gauges(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def work():
+            started.set()
+            release.wait(5)
+
+        futures = [self.pool.submit(work) for _i in range(3)]
+        started.wait(5)
+
+        self.assertEqual({'size': 1, 'busy': 1, 'queued': 2,
+                          'utilization': 1.0}, self.pool.stats())
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(0, self.pool.stats()['busy'])
+
+    def test_defer_fires_with_result(self):
+        done = threading.Event()
+        results = []
+        d = self.pool.defer(lambda a, b: a + b, 1, b=2)
+        d.addBoth(results.append)
+        d.addBoth(lambda _: done.set())
+
+        done.wait(5)
+
+        self.assertEqual([3], results)
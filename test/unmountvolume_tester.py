@@ -1,5 +1,5 @@
-# import mock
 import copy
+import mock
 
 import test.fake_3par_data as data
 import test.hpe_docker_unit_test as hpedockerunittest
@@ -131,9 +131,8 @@ class TestUnmountVolOnceMountedTwiceOnThisNode(UnmountVolumeUnitTest):
         self._test_case.assertEqual(resp, {u"Err": ''})
 
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.update_vol.assert_called_with(self._vol['id'],
-                                                'node_mount_info',
-                                                self._vol['node_mount_info'])
+        mock_etcd.update_vol_fields.assert_called_once_with(
+            self._vol, ['node_mount_info'], mock.ANY)
 
         # node_id_list should have only one node-id left after
         # un-mount is called
@@ -186,15 +185,19 @@ class TestUnmountVolMountedTwiceOnThisNode(UnmountVolumeUnitTest):
         vol = self._vol
         mock_etcd = self.mock_objects['mock_etcd']
         if self._tc_run_cnt == 0:
-            mock_etcd.update_vol.assert_called_with(vol['id'],
-                                                    'node_mount_info',
-                                                    vol['node_mount_info'])
+            mock_etcd.update_vol_fields.assert_called_once_with(
+                vol, ['node_mount_info'], mock.ANY)
             # node_id_list should have only one node-id left after
             # un-mount is called
             self._test_case.assertEqual(len(vol['node_mount_info']
                                             [data.THIS_NODE_ID]), 1)
         elif self._tc_run_cnt == 1:
-            mock_etcd.save_vol.assert_called_with(vol)
+            # Mount state is written before device cleanup and
+            # path_info after it
+            mock_etcd.update_vol_fields.assert_any_call(
+                vol, ['node_mount_info'], mock.ANY)
+            mock_etcd.update_vol_fields.assert_called_with(
+                vol, ['path_info'], mock.ANY)
             self._test_case.assertNotIn('node_mount_info',
                                         self._vol)
 
@@ -248,7 +251,8 @@ class TestUnmountVolNotOwnedByThisNode(UnmountVolumeUnitTest):
 
         vol = self._vol
         mock_etcd = self.mock_objects['mock_etcd']
-        mock_etcd.save_vol.assert_called_with(vol)
+        mock_etcd.update_vol_fields.assert_called_once_with(
+            vol, ['old_path_info'], mock.ANY)
         self._test_case.assertIn('node_mount_info',
                                  self._vol)
 